@@ -5,23 +5,44 @@
 
 # ИМПОРТЫ
 # Стандартные библиотеки
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import signal
+import sqlite3
 import sys
+import tempfile
+import threading
 import time
+PROCESS_STARTED = time.perf_counter()  # Отсюда отсчитывается время запуска в отчёте startup_report
 import traceback
-from functools import partial
+import tracemalloc
+from functools import partial, wraps
 import asyncio
+import bisect
+import csv
+import gzip
+import heapq
+import io
+import itertools
+import json
+import math
 import re
+import shutil
 import unicodedata
-import requests
+import zlib
+import multiprocessing
+from collections import Counter, OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
-# Внешние библиотеки
+# Внешние библиотеки (requests и numpy импортируются там, где нужны: они заметно замедляют запуск)
 import aiosqlite
-import nest_asyncio
-import urllib.parse 
 
 # Telegram API и связанные библиотеки
 import telegram
@@ -30,31 +51,237 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     Bot
 )
 from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     ApplicationBuilder,
+    BasePersistence,
+    PersistenceInput,
     CommandHandler,
     ContextTypes,
+    ApplicationHandlerStop,
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     CallbackContext,
     filters,
-    JobQueue
+    JobQueue,
+    TypeHandler
 )
 from telegram.constants import ParseMode
+from telegram.request import HTTPXRequest
 
 # КОНФИГУРАЦИЯ ЛОГИРОВАНИЯ
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-logger = logging.getLogger(__name__)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Уровни отдельных подсистем, например LOG_LEVELS="dorama.search=DEBUG,dorama.activity=WARNING"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "httpx=WARNING")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))  # Доля DEBUG-строк о каждом нажатии, которая попадает в лог
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь как есть: сообщение форматируется уже в потоке QueueListener.
+
+    Поэтому в логгер нельзя передавать объекты, которые потом изменяются на месте.
+    """
+
+    def prepare(self, record):
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю DEBUG-записей; записи уровня INFO и выше — все."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+def setup_logging() -> logging.handlers.QueueListener:
+    # Цикл событий только кладёт запись в очередь, в stderr пишет отдельный поток
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[DeferredQueueHandler(log_queue)])
+    for item in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)  # Дописываем очередь при выходе
+    return listener
+
+log_listener = setup_logging()
+logger = logging.getLogger("dorama")
+db_logger = logging.getLogger("dorama.db")  # SQL и обслуживание базы
+search_logger = logging.getLogger("dorama.search")  # Поиск, индексы, пагинация
+activity_logger = logging.getLogger("dorama.activity")  # Учёт действий пользователей
+click_logger = logging.getLogger("dorama.clicks")  # Подробности о каждом нажатии, с выборкой
+click_logger.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+# МЕТРИКИ
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")  # /metrics доступен только локально
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))  # 0 — не запускать HTTP-сервер
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "50"))  # SQL дольше этого попадает в лог вместе с планом
+# Режим проверки: план строится для каждого запроса, полный просмотр doramas считается ошибкой
+SQL_FORBID_FULL_SCANS = os.environ.get("SQL_FORBID_FULL_SCANS") == "1"
+SQL_STATS_TOP = 15  # Сколько самых затратных запросов показывает /sql_stats
+# Профилирование по команде /profile
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL = 0.005  # Как часто снимается стек цикла событий (сек)
+PROFILE_TOP = 20  # Сколько функций и строк выделения памяти попадает в сводку
+# Обслуживание SQLite: задачи выполняются в окне низкой нагрузки, когда бот простаивает
+MAINTENANCE_WINDOW = os.environ.get("MAINTENANCE_WINDOW", "3-6")  # Часы по локальному времени, [начало, конец)
+MAINTENANCE_IDLE_SECONDS = 120  # Сколько секунд без обновлений считается простоем
+MAINTENANCE_CHECK_INTERVAL = 15 * 60  # Как часто JobQueue проверяет, не пора ли (сек)
+MAINTENANCE_PERIODS = {  # Задача -> как часто её выполнять (сек)
+    "optimize": 6 * 3600,
+    "analyze": 24 * 3600,
+    "vacuum": 24 * 3600,
+    "checkpoint": 3600,
+}
+ANALYZE_LIMIT = 1000  # PRAGMA analysis_limit: ANALYZE смотрит столько строк на индекс, а не всю таблицу
+# Резервные копии баз (SQLite backup API): сжатые снимки в BACKUP_DIR, по BACKUP_KEEP на каждый файл
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL = float(os.environ.get("BACKUP_INTERVAL_HOURS", "24")) * 3600  # 0 — только по команде /backup
+BACKUP_FIRST_DELAY = 10 * 60  # Первая копия — через 10 минут после запуска, не во время прогрева
+BACKUP_PAGES_PER_STEP = 256  # Страниц за шаг: между шагами база свободна для записи
+BACKUP_STEP_PAUSE = 0.02  # Пауза после каждого шага, чтобы запись успела взять блокировку (сек)
+BACKUP_BUSY_SLEEP = 0.05  # Сколько ждать повтора, если шаг вернул BUSY/LOCKED (сек)
+# Массовый импорт дорам из CSV/JSONL (/import)
+IMPORT_MAX_BYTES = 10 * 1024 * 1024  # Bot API отдаёт боту файлы до 20 МБ
+IMPORT_POSTER_CONCURRENCY = 4  # Сколько ссылок Яндекс.Диска разрешаем одновременно
+IMPORT_REPORT_INLINE_ROWS = 30  # Отчёт длиннее этого присылается файлом
+EXPORT_FETCH_ROWS = 500  # По сколько строк /export читает из курсора и сжимает за раз
+FORM_PENDING_LIMIT = 5  # Сколько форм /add одного пользователя могут ждать подтверждения
+# Фоновые миграции
+MIGRATION_BATCH_ROWS = 200  # По сколько строк порционная миграция обновляет в одной транзакции
+MIGRATION_BATCH_SLEEP = 0.01  # Пауза между порциями, чтобы успели записать обработчики (сек)
+MIGRATION_BUSY_TIMEOUT_MS = 30_000  # Сколько фоновая миграция ждёт блокировку записи
+MIGRATION_ATTEMPTS = 5  # Сколько раз пробуем фоновые миграции, если они упали
+MIGRATION_RETRY_BACKOFF = 5.0  # Пауза перед повтором (сек), дальше удваивается
+# Задержка цикла событий и /healthz
+LOOP_LAG_INTERVAL = 0.1  # Как часто меряется задержка (сек)
+LOOP_LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD_MS", "250")) / 1000  # Дольше — в лог пишется стек блокирующего кода
+LOOP_LAG_WINDOW = 600  # Сколько последних замеров учитывается в /healthz (600 × 0.1 с = минута)
+HEALTH_DB_TIMEOUT = 2.0  # Сколько ждать ответа базы в /healthz (сек)
+HEALTH_MAX_UPDATE_AGE = float(os.environ.get("HEALTH_MAX_UPDATE_AGE", "0"))  # Сек без обновлений, после которых процесс нездоров; 0 — не проверять
+CATALOG_WARMUP_ATTEMPTS = 5  # Сколько раз пробуем построить индексы каталога при запуске
+CATALOG_WARMUP_BACKOFF = 1.0  # Пауза перед второй попыткой (сек), дальше удваивается
+# Адрес Bot API без токена, например локальный поддельный сервер из bench/fake_bot_api.py
+BOT_API_URL = os.environ.get("BOT_API_URL")
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# ======== Гистограмма в формате Prometheus ==========
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(LATENCY_BUCKETS):  # Больше последней границы — только в +Inf
+            self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+def prometheus_labels(**labels) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+
+# ======== Реестр метрик бота ==========
+class Metrics:
+    """Задержки и ошибки обработчиков, а также время SQL, Bot API и Яндекс.Диска."""
+    __slots__ = ("handler_latency", "handler_errors", "in_flight", "dependency_latency")
+
+    def __init__(self):
+        self.handler_latency = {}  # (обработчик, действие) -> Histogram
+        self.handler_errors = Counter()  # (обработчик, действие) -> число ошибок
+        self.in_flight = Counter()  # обработчик -> сколько вызовов выполняется сейчас
+        self.dependency_latency = {}  # (sql | bot_api | yandex, операция) -> Histogram
+
+    def observe_handler(self, handler: str, verb: str, seconds: float, failed: bool) -> None:
+        key = (handler, verb)
+        histogram = self.handler_latency.get(key)
+        if histogram is None:
+            histogram = self.handler_latency[key] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            self.handler_errors[key] += 1
+
+    def observe_dependency(self, dependency: str, operation: str, seconds: float) -> None:
+        key = (dependency, operation)
+        histogram = self.dependency_latency.get(key)
+        if histogram is None:
+            histogram = self.dependency_latency[key] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, dependency: str, operation: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_dependency(dependency, operation, time.perf_counter() - started)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP dorama_handler_latency_seconds Время обработки обновления",
+            "# TYPE dorama_handler_latency_seconds histogram",
+        ]
+        for (handler, verb), histogram in sorted(self.handler_latency.items()):
+            lines += histogram.render("dorama_handler_latency_seconds", prometheus_labels(handler=handler, verb=verb))
+        lines += [
+            "# HELP dorama_handler_errors_total Число обработчиков, завершившихся исключением",
+            "# TYPE dorama_handler_errors_total counter",
+        ]
+        for (handler, verb), count in sorted(self.handler_errors.items()):
+            lines.append(f"dorama_handler_errors_total{{{prometheus_labels(handler=handler, verb=verb)}}} {count}")
+        lines += [
+            "# HELP dorama_handler_in_flight Вызовы обработчика, выполняющиеся прямо сейчас",
+            "# TYPE dorama_handler_in_flight gauge",
+        ]
+        for handler, count in sorted(self.in_flight.items()):
+            lines.append(f"dorama_handler_in_flight{{{prometheus_labels(handler=handler)}}} {count}")
+        lines += [
+            "# HELP dorama_dependency_latency_seconds Время SQL, запросов к Bot API и к Яндекс.Диску",
+            "# TYPE dorama_dependency_latency_seconds histogram",
+        ]
+        for (dependency, operation), histogram in sorted(self.dependency_latency.items()):
+            lines += histogram.render(
+                "dorama_dependency_latency_seconds", prometheus_labels(dependency=dependency, operation=operation)
+            )
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
 
 
 # КОНФИГУРАЦИЯ БОТА И БД
 DB_PATH = 'doramas.db'
 DB_PATH_2 = 'doramas_users.db'
+# Колонки, из которых собирается карточка дорамы
+CARD_COLUMNS = "id, title_ru, title_en, country, year, director, lead_actress, lead_actor, personal_rating, comment, plot, poster_url"
 from config import TOKEN, ADMINS
 
 # ======== Константы ==========
@@ -65,6 +292,32 @@ COUNTRY_FLAGS = {
     "Япония": "🇯🇵",
 }
 PAGE_SIZE = 10
+TITLE_SEARCH_LIMIT = 200  # Максимум результатов поиска по названию
+FUZZY_MIN_SIMILARITY = 0.5  # Доля триграмм запроса, которая должна совпасть с названием
+FUZZY_SUGGESTIONS = 5  # Сколько вариантов предлагать в "Возможно, вы имели в виду"
+FUZZY_VERIFY_COST = 8  # Во сколько раз проверка кандидата по его триграммам дороже шага по списку вхождений
+INLINE_PEOPLE_LIMIT = 20  # Сколько имён подсказывать в инлайн-режиме (Telegram допускает до 50)
+PEOPLE_TOP_PREFIX = 4  # До какой длины ключа PeopleIndex держит готовый top-k имён
+INLINE_PEOPLE_CACHE_TIME = 300  # Сколько секунд Telegram может кешировать подсказки
+INLINE_RESULTS_LIMIT = 20  # Сколько дорам отдавать на инлайн-запрос @бот <название>
+INLINE_CACHE_TIME = 300  # Сколько секунд Telegram может кешировать ответ на инлайн-запрос
+INLINE_CACHE_SIZE = 512  # Сколько разных инлайн-запросов держим готовыми на стороне бота
+# Варианты для комбинированного фильтра: диапазоны лет (None — без границы) и минимальная оценка
+FILTER_YEAR_RANGES = [(None, 2009), (2010, 2014), (2015, 2017), (2018, 2022), (2023, None)]
+FILTER_MIN_RATINGS = [6, 7, 8, 9, 10]
+SIMILAR_TOP_K = 6  # Сколько похожих дорам храним и показываем для каждой
+SIMILARITY_FEATURE_DIM = 2048  # Размер вектора признаков (признаки хешируются в него)
+SIMILARITY_BLOCK_SIZE = 512  # По сколько строк считаем матрицу похожести за раз
+# Вес каждого признака в векторе дорамы
+SIMILARITY_WEIGHTS = {
+    "country": 1.0, "year": 0.5, "director": 2.0, "actor": 2.0, "actress": 2.0, "rating": 0.5, "title": 1.0,
+}
+# Первое слово инлайн-запроса (@бот актёр ли мин) -> поле таблицы
+INLINE_PEOPLE_PREFIXES = {
+    "актёр": "lead_actor", "актер": "lead_actor",
+    "актриса": "lead_actress",
+    "режиссёр": "director", "режиссер": "director",
+}
 DEFAULT_MESSAGE = "😔 Пожалуйста, используйте кнопки для навигации. Ввод текста не поддерживается."
 ACTION_TYPE_COMMAND = "command"
 ACTION_TYPE_MESSAGE = "message"
@@ -95,8 +348,139 @@ ACTION_TYPE_CALLBACK = "callback"
     SEARCH_DIRECTOR, 
     CHOOSE_DIRECTOR,
     SHOW_MENU,
-    PAGE
-) = range(25)
+    PAGE,
+    FILTER_MENU,
+    FILTER_DIRECTOR
+) = range(27)
+
+# ======== Сессии пользователей ==========
+SESSION_IDLE_TTL = 30 * 60  # Сессия без активности живёт 30 минут
+SESSION_MAX_USERS = 5000  # Максимум одновременно хранимых сессий
+SESSION_SWEEP_INTERVAL = 60  # Как часто чистим просроченные сессии (сек)
+CONVERSATION_TIMEOUT = 15 * 60  # Диалог без ответа завершается раньше, чем истекает сессия
+PERSISTENCE_UPDATE_INTERVAL = 5  # Как часто PTB отдаёт изменения в persistence (сек)
+PERSISTENCE_FLUSH_DELAY = 1  # Сколько ждём, чтобы собрать изменения в одну транзакцию (сек)
+
+# Все ключи, которые хэндлеры кладут в context.user_data
+SESSION_FIELDS = (
+    # Черновик добавления дорамы
+    'title_ru', 'title_en', 'country', 'year', 'director', 'lead_actress', 'lead_actor',
+    'personal_rating', 'comment', 'plot', 'poster_url',
+    # Проверенные формы /add, ждущие подтверждения: номер сообщения с формой -> значения
+    'pending_forms',
+    # Удаление
+    'dorama_id_to_delete',
+    # Поиск и пагинация
+    'search_type', 'normalized_title', 'total_results_title', 'total_results_country',
+    'search_actor_name', 'total_results_actor', 'actor_page',
+    'search_actress_name', 'total_results_actress', 'actress_page',
+    'search_director_name', 'total_results_director', 'director_page',
+    'language', 'letter_page', 'selected_letter', 'letter_doramas_page',
+    'rating_page', 'selected_rating', 'rating_doramas_page',
+    'current_page', 'page',
+    # Комбинированный фильтр
+    'filter_country', 'filter_years', 'filter_min_rating', 'filter_director',
+)
+_SESSION_FIELD_SET = frozenset(SESSION_FIELDS)
+
+class UserSession(MutableMapping):
+    """Компактная замена dict для context.user_data: фиксированный набор полей в __slots__."""
+    __slots__ = SESSION_FIELDS
+
+    def __getitem__(self, key):
+        if key not in _SESSION_FIELD_SET:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in _SESSION_FIELD_SET:
+            raise KeyError(f"Неизвестное поле сессии: {key}")
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in _SESSION_FIELD_SET:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return (field for field in SESSION_FIELDS if hasattr(self, field))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"UserSession({dict(self.items())!r})"
+
+# ======== Хранилище сессий: TTL простоя и LRU-вытеснение ==========
+class SessionStore:
+    """Отслеживает время последней активности пользователей в порядке LRU."""
+    __slots__ = ("_last_seen", "idle_ttl", "max_users")
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, max_users: int = SESSION_MAX_USERS):
+        self._last_seen: OrderedDict[int, float] = OrderedDict()
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def touch(self, user_id: int, now: float | None = None) -> list[int]:
+        """Отмечает активность пользователя и возвращает ID, вытесненных из-за лимита."""
+        self._last_seen[user_id] = time.monotonic() if now is None else now
+        self._last_seen.move_to_end(user_id)
+
+        evicted = []
+        while len(self._last_seen) > self.max_users:
+            old_user_id, _ = self._last_seen.popitem(last=False)
+            evicted.append(old_user_id)
+        return evicted
+
+    def pop_expired(self, now: float | None = None) -> list[int]:
+        """Удаляет и возвращает пользователей, неактивных дольше idle_ttl."""
+        deadline = (time.monotonic() if now is None else now) - self.idle_ttl
+        expired = []
+        # Записи упорядочены по времени активности, поэтому идём с самых старых
+        while self._last_seen:
+            user_id, last_seen = next(iter(self._last_seen.items()))
+            if last_seen > deadline:
+                break
+            self._last_seen.popitem(last=False)
+            expired.append(user_id)
+        return expired
+
+    def forget(self, user_id: int) -> None:
+        self._last_seen.pop(user_id, None)
+
+session_store = SessionStore()
+
+# ======== Отмечаем активность пользователя на каждом апдейте ==========
+async def touch_session(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if health.last_update_at is None:
+        logger.info("📨 Первое обновление через %.2f с после запуска процесса", time.perf_counter() - PROCESS_STARTED)
+    health.last_update_at = time.monotonic()
+    user = update.effective_user
+    if not user:
+        return
+    for user_id in session_store.touch(user.id):
+        if isinstance(context.application.persistence, SQLitePersistence):
+            await context.application.persistence.evict_user(user_id, context.application.user_data.get(user_id))
+        context.application.drop_user_data(user_id)
+        logger.info("Сессия пользователя %s вытеснена: превышен лимит %s.", user_id, session_store.max_users)
+
+# ======== Периодическая очистка неактивных сессий ==========
+async def sweep_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    expired = session_store.pop_expired()
+    for user_id in expired:
+        end_user_conversations(context.application, user_id)  # Без user_data продолжать их нельзя
+        context.application.drop_user_data(user_id)
+    if expired:
+        logger.info("Удалено неактивных сессий: %s. Активных: %s.", len(expired), len(session_store))
 
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 
@@ -114,26 +498,18 @@ def truncate_text(text, max_length=10):
 def prevent_hashtag_linking(text: str) -> str:
     return text.replace("#", "#\u200b")
 
-def escape_markdown(text: str) -> str:
-    # Определите набор символов для экранирования
-    escape_chars = "*[]()~`>#+-=|{}.!"
-    # Экранируйте найденные символы
-    for char in escape_chars:
-        text = text.replace(char, "\\" + char)
-    return text
-
-def escape_markdown_v2(text: str) -> str:
-    escape_chars = r"_*[]()~`>#+-=|{}.!"
-    return "".join("\\" + char if char in escape_chars else char for char in text)
-
-def remove_extra_escape(text: str) -> str:
-    # Список символов для удаления экранирования
-    chars_to_unescape = ".!~\-"
-    
-    # Удалите лишние экранирования
-    for char in chars_to_unescape:
-        text = text.replace("\\" + char, char)
-    
+# Таблицы замен (символ -> экранированный вариант) для обоих вариантов Markdown
+MARKDOWN_ESCAPE = {char: "\\" + char for char in "*[]()~`>#+-=|{}.!"}
+MARKDOWN_V2_ESCAPE = {char: "\\" + char for char in "_*[]()~`>#+-=|{}.!"}
+# Для карточки дорамы «.!~-» не экранируем, а после «#» ставим невидимый пробел, чтобы не было хэштега
+CARD_ESCAPE = {**{char: "\\" + char for char in "*[]()`>+=|{}"}, "#": "\\#\u200b"}
+
+def escape_markdown(text: str, table: dict = MARKDOWN_ESCAPE) -> str:
+    # str.translate на кириллице в разы медленнее: быстрый путь у него только для ASCII.
+    # replace идёт в C, а символы, которых в тексте нет, пропускаем сразу
+    for char, escaped in table.items():
+        if char in text:
+            text = text.replace(char, escaped)
     return text
 
 # ======== Создаём клавиатуру ==========
@@ -152,6 +528,7 @@ def create_main_menu_keyboard() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("Поиск по актеру 🤴🏻", callback_data="search_by_actor")],
         [InlineKeyboardButton("Поиск по актрисе 👸🏻", callback_data="search_by_actress")],
         [InlineKeyboardButton("Поиск по режиссеру 🎬", callback_data="search_by_director")],
+        [InlineKeyboardButton("Фильтр по нескольким условиям 🎛", callback_data="combined_filter")],
         [InlineKeyboardButton("Добавить (Катя)", callback_data="add_dorama"),
          InlineKeyboardButton("Удалить (Катя)", callback_data="delete_dorama")],
         [InlineKeyboardButton("В главное меню 🌸", callback_data="show_menu")]
@@ -163,6 +540,13 @@ def create_main_menu_keyboard() -> InlineKeyboardMarkup:
 def create_cancel_keyboard() -> InlineKeyboardMarkup:
     return create_button("Отмена", "cancel")
 
+# ======== Клавиатура для ввода имени: подсказки в инлайн-режиме и отмена ==========
+def create_people_prompt_keyboard(prefix: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⚡ Подсказки по имени", switch_inline_query_current_chat=f"{prefix} ")],
+        [InlineKeyboardButton("Отмена", callback_data="cancel")]
+    ])
+
 # ======== Определяем кнопку назад ==========
 back_button = InlineKeyboardMarkup([
     [InlineKeyboardButton("Вернуться в главное меню 🌸", callback_data="show_menu")]
@@ -181,71 +565,549 @@ def create_country_buttons():
     ]
 
 # РАБОТА С БАЗОЙ ДАННЫХ  
+# ======== Трассировка SQL: время каждого выражения и планы запросов ==========
+# Вызовы sqlite3, которые выполняют SQL-выражение (первый аргумент — текст запроса)
+SQL_STATEMENT_CALLS = {"execute", "executemany", "_execute_fetchall", "_execute_insert"}
+SQL_PLANNED = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+# SCAN — перебор всей таблицы («SCAN TABLE t AS a» — формат SQLite до 3.36). Обход по индексу
+# без условия на его столбцы («SCAN d USING COVERING INDEX i», без «(col=?)») читает её всю так же
+FULL_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(?: USING (?:COVERING )?INDEX \w+)?$")
+
+class StatementStats:
+    __slots__ = ("calls", "total", "slowest")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0  # Выполнение и чтение строк, секунды
+        self.slowest = 0.0
+
+class SqlTracer:
+    """Счётчики и суммарное время по каждому SQL-выражению, кеш EXPLAIN QUERY PLAN.
+
+    Обновляется только из цикла событий; в потоке соединения лишь замеряется время и строится план.
+    """
+    __slots__ = ("statements", "plans", "full_scans")
+
+    def __init__(self):
+        self.statements = {}  # текст запроса -> StatementStats
+        self.plans = {}  # текст запроса -> план (строки EXPLAIN QUERY PLAN через «; »)
+        self.full_scans = []  # (запрос, план) в режиме SQL_FORBID_FULL_SCANS
+
+    def needs_plan(self, sql: str, seconds: float) -> bool:
+        return sql not in self.plans and (SQL_FORBID_FULL_SCANS or seconds * 1000 > SLOW_QUERY_MS)
+
+    @staticmethod
+    def explain(connection: sqlite3.Connection, sql: str) -> str:
+        """Выполняется в потоке соединения. Параметры на план не влияют, подставляем NULL."""
+        if not sql.lstrip().upper().startswith(SQL_PLANNED):
+            return ""
+        try:
+            sqlite_statement = connection.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count("?"))
+            return "; ".join(row[3] for row in sqlite_statement.fetchall())
+        except sqlite3.Error as e:
+            return f"нет плана: {e}"
+
+    def record(self, sql: str, parameters, operation: str, seconds: float, plan: str | None) -> None:
+        stats = self.statements.get(sql)
+        if stats is None:
+            stats = self.statements[sql] = StatementStats()
+        if operation in SQL_STATEMENT_CALLS:
+            stats.calls += 1
+        stats.total += seconds
+        stats.slowest = max(stats.slowest, seconds)
+        if plan is not None and sql not in self.plans:
+            self.plans[sql] = plan
+            if SQL_FORBID_FULL_SCANS and self.scans_doramas(sql, plan):
+                self.full_scans.append((sql, plan))
+                db_logger.error("🚨 Полный просмотр doramas: %s | план: %s", sql, plan)
+        if seconds * 1000 > SLOW_QUERY_MS:
+            db_logger.warning(
+                "🐢 Медленный SQL (%.1f мс, %s): %s | параметры: %s | план: %s",
+                seconds * 1000, operation, sql, parameters, self.plans.get(sql, "—"),
+            )
+
+    @staticmethod
+    def scans_doramas(sql: str, plan: str) -> bool:
+        # В плане таблица называется так же, как в запросе: doramas или её псевдоним
+        names = {"doramas"} | set(re.findall(r"\bdoramas\s+(?:AS\s+)?(?!WHERE|ORDER|GROUP|LIMIT|JOIN|ON)(\w+)", sql, re.IGNORECASE))
+        return any(
+            (match := FULL_SCAN_RE.match(step.strip())) and not names.isdisjoint(match.groups())
+            for step in plan.split("; ")
+        )
+
+    def report(self, limit: int = SQL_STATS_TOP) -> str:
+        top = sorted(self.statements.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        lines = [f"SQL: {len(self.statements)} разных запросов, порог медленного {SLOW_QUERY_MS:g} мс"]
+        for sql, stats in top:
+            lines.append(
+                f"\n{stats.total * 1000:.1f} мс всего | {stats.calls} выз. | "
+                f"среднее {stats.total * 1000 / max(stats.calls, 1):.2f} мс | макс {stats.slowest * 1000:.1f} мс\n"
+                f"{truncate_text(sql, 300)}\n"
+                f"план: {self.plans.get(sql, 'не строился')}"
+            )
+        return "\n".join(lines)
+
+sql_tracer = SqlTracer()
+
+def describe_parameters(parameters):
+    # Для executemany не выводим (и не перебираем) весь набор строк
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple)):
+        return f"<{len(parameters)} строк>"
+    return parameters if isinstance(parameters, (list, tuple, dict)) else "<поток строк>"
+
+# ======== Соединение с учётом времени SQL ==========
+class MeteredConnection(aiosqlite.Connection):
+    """aiosqlite.Connection, который записывает в метрики время каждой операции с базой
+    и передаёт выполнение каждого SQL-выражения в sql_tracer."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statements = {}  # id(sqlite3.Cursor) -> (запрос, параметры): к ним относим время чтения строк
+
+    async def _execute(self, fn, *args, **kwargs):
+        operation = getattr(fn, "__name__", "call")
+        owner = getattr(fn, "__self__", None)
+        if operation in SQL_STATEMENT_CALLS and args:
+            sql = " ".join(args[0].split())
+            parameters = describe_parameters(args[1]) if len(args) > 1 else ()
+        elif isinstance(owner, sqlite3.Cursor) and id(owner) in self._statements:
+            sql, parameters = self._statements[id(owner)]  # fetchone/fetchmany/fetchall
+        else:
+            sql = None
+
+        def traced():
+            # Выполняется в потоке соединения
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            seconds = time.perf_counter() - started
+            plan = None
+            if sql is not None and sql_tracer.needs_plan(sql, seconds):
+                plan = sql_tracer.explain(self._conn, sql)
+            return result, seconds, plan
+
+        started = time.perf_counter()
+        try:
+            result, seconds, plan = await super()._execute(traced)
+        finally:
+            metrics.observe_dependency("sql", operation, time.perf_counter() - started)
+        if sql is not None:
+            sql_tracer.record(sql, parameters, operation, seconds, plan)
+            if isinstance(result, sqlite3.Cursor):
+                self._statements[id(result)] = (sql, parameters)
+        return result
+
+def connect_db(database: str) -> aiosqlite.Connection:
+    """Замена aiosqlite.connect: используется так же, через async with."""
+    return MeteredConnection(partial(sqlite3.connect, database), iter_chunk_size=64)
+
 # ======== Создаем БД и индексы для поиска ==========
-async def init_db():
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            # Создаем таблицу если она не существует
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS doramas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title_ru TEXT NOT NULL,
-                    title_en TEXT NOT NULL,
-                    country TEXT NOT NULL,
-                    year INTEGER NOT NULL,
-                    director TEXT NOT NULL,
-                    lead_actress TEXT NOT NULL,
-                    lead_actor TEXT NOT NULL,
-                    personal_rating INTEGER NOT NULL,
-                    comment TEXT NOT NULL,
-                    plot TEXT NOT NULL,
-                    poster_url TEXT
-                )
-            ''')
-
-            # Список индексов для создания
-            indexes = [
-                ('idx_title_ru', 'title_ru'),
-                ('idx_title_en', 'title_en'),
-                ('idx_country', 'country'),
-                ('idx_lead_actor', 'lead_actor'),
-                ('idx_lead_actress', 'lead_actress'),
-                ('idx_director', 'director'),
-            ]
+# ======== Миграции схемы: номер последней применённой хранится в PRAGMA user_version ==========
+class Migration:
+    """Шаг схемы. background=True — миграция, без результата которой код работает
+    (индекс, заполнение кэша): на старой базе её можно выполнить после запуска бота.
+    batched=True — apply сама коммитит короткими порциями и при повторе продолжает с места
+    остановки: одна долгая транзакция блокировала бы запись обработчикам бота."""
+    __slots__ = ("version", "description", "apply", "background", "batched")
+
+    def __init__(self, version: int, description: str, apply, background: bool = False, batched: bool = False):
+        self.version = version
+        self.description = description
+        self.apply = apply  # async def apply(db)
+        self.background = background
+        self.batched = batched
+
+async def apply_migration(db: aiosqlite.Connection, path: str, migration: Migration) -> None:
+    started = time.perf_counter()
+    if migration.batched:
+        # Транзакции открывает сама миграция; версия записывается, только когда дошла до конца
+        await migration.apply(db)
+        await db.execute(f"PRAGMA user_version = {int(migration.version)}")
+        await db.commit()
+    else:
+        await db.execute("BEGIN")  # DDL тоже внутри транзакции: миграция применяется целиком или никак
+        try:
+            await migration.apply(db)
+            await db.execute(f"PRAGMA user_version = {int(migration.version)}")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    db_logger.info(
+        "🧱 %s: миграция %s (%s) за %.2f с",
+        os.path.basename(path), migration.version, migration.description, time.perf_counter() - started,
+    )
 
-            # Создаем индексы
-            for index_name, column_name in indexes:
-                await db.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON doramas ({column_name})')
-            
+async def run_background_migrations(path: str, migrations: list) -> None:
+    """Фоновые миграции идут параллельно с ботом: ждём блокировку дольше обычного,
+    а упавшие (например, «database is locked») повторяем с растущей паузой."""
+    for attempt in range(1, MIGRATION_ATTEMPTS + 1):
+        try:
+            async with connect_db(path) as db:
+                await db.execute(f"PRAGMA busy_timeout = {int(MIGRATION_BUSY_TIMEOUT_MS)}")
+                async with db.execute("PRAGMA user_version") as cursor:
+                    current = (await cursor.fetchone())[0]
+                for migration in migrations:
+                    if migration.version > current:  # При повторе уже применённые пропускаем
+                        await apply_migration(db, path, migration)
+            return
+        except Exception as e:
+            logger.error(
+                "⚠️ Фоновая миграция %s не выполнена (попытка %s из %s): %s",
+                os.path.basename(path), attempt, MIGRATION_ATTEMPTS, e, exc_info=True,
+            )
+            if attempt < MIGRATION_ATTEMPTS:
+                await asyncio.sleep(MIGRATION_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+migration_tasks: set = set()  # Фоновые миграции, запущенные при старте
+
+async def run_migrations(path: str, migrations: list, background: bool = True) -> None:
+    """Применяет недостающие миграции; на актуальной базе — одно чтение user_version."""
+    async with connect_db(path) as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            current = (await cursor.fetchone())[0]
+        pending = [migration for migration in migrations if migration.version > current]
+        if not pending:
+            db_logger.debug("%s: схема актуальна (версия %s)", os.path.basename(path), current)
+            return
+        # В фон уходит только «хвост» из фоновых миграций: обязательная не должна ждать долгую
+        split = len(pending)
+        while background and split > 0 and pending[split - 1].background:
+            split -= 1
+        for migration in pending[:split]:
+            await apply_migration(db, path, migration)
+    if split < len(pending):
+        db_logger.info("%s: миграций в фоне: %s", os.path.basename(path), len(pending) - split)
+        task = asyncio.create_task(run_background_migrations(path, pending[split:]))
+        migration_tasks.add(task)
+        task.add_done_callback(migration_tasks.discard)
+
+# --- Миграции doramas.db ---
+async def migrate_catalog_base(db):
+    # Схема, которую раньше создавал init_db при каждом запуске; на старой базе всё уже есть
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS doramas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title_ru TEXT NOT NULL,
+            title_en TEXT NOT NULL,
+            country TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            director TEXT NOT NULL,
+            lead_actress TEXT NOT NULL,
+            lead_actor TEXT NOT NULL,
+            personal_rating INTEGER NOT NULL,
+            comment TEXT NOT NULL,
+            plot TEXT NOT NULL,
+            poster_url TEXT
+        )
+    ''')
+
+    # Готовая (уже экранированная) карточка дорамы: в старой базе колонки ещё нет
+    async with db.execute('PRAGMA table_info(doramas)') as cursor:
+        columns = {column[1] for column in await cursor.fetchall()}
+    if 'rendered_card' not in columns:
+        await db.execute('ALTER TABLE doramas ADD COLUMN rendered_card TEXT')
+
+    # Индексы, на которые ссылается INDEXED BY в DoramaQuery, и остальные
+    indexes = [
+        ('idx_title_ru', 'title_ru'),
+        ('idx_title_en', 'title_en'),
+        ('idx_country', 'country'),
+        ('idx_lead_actor', 'lead_actor'),
+        ('idx_lead_actress', 'lead_actress'),
+        ('idx_director', 'director'),
+        ('idx_year', 'year'),
+        ('idx_personal_rating', 'personal_rating'),
+    ]
+    for index_name, column_name in indexes:
+        await db.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON doramas ({column_name})')
+
+    # Ключи поиска (транслитерация, фонетические ключи имён) считаются при добавлении дорамы
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS search_keys (
+            dorama_id INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            key TEXT NOT NULL
+        )
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_search_keys_field_key ON search_keys (field, key)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_search_keys_dorama ON search_keys (dorama_id)')
+
+    # Готовые списки похожих дорам: пересчитываются в фоне после добавления/удаления
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS similar_doramas (
+            dorama_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            similar_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (dorama_id, rank)
+        )
+    ''')
+
+async def migrate_catalog_search_keys(db):
+    # Для уже существующей базы заполняем ключи один раз; без них не работает поиск по людям
+    async with db.execute('SELECT EXISTS (SELECT 1 FROM search_keys)') as cursor:
+        has_keys = (await cursor.fetchone())[0]
+    if has_keys:
+        return
+    async with db.execute('SELECT id, title_ru, title_en, director, lead_actress, lead_actor FROM doramas') as cursor:
+        rows = await cursor.fetchall()
+    await db.executemany(
+        'INSERT INTO search_keys (dorama_id, field, key) VALUES (?, ?, ?)',
+        [key_row for row in rows for key_row in search_key_rows(*row)]
+    )
+    if rows:
+        logger.info("🔑 Ключи поиска построены для %s дорам.", len(rows))
+
+async def migrate_catalog_cards(db):
+    # Карточки для дорам, добавленных до появления rendered_card; пока их нет, карточка рендерится на лету.
+    # Порциями по MIGRATION_BATCH_ROWS, каждая в своей короткой транзакции; при повторе
+    # уже готовые карточки не трогаем (rendered_card IS NULL)
+    last_id = 0
+    total = 0
+    while True:
+        await db.execute('BEGIN IMMEDIATE')  # Блокировку записи ждём по busy_timeout, а не посреди порции
+        try:
+            async with db.execute(
+                f'SELECT {CARD_COLUMNS} FROM doramas WHERE rendered_card IS NULL AND id > ? ORDER BY id LIMIT ?',
+                (last_id, MIGRATION_BATCH_ROWS),
+            ) as cursor:
+                cursor.row_factory = aiosqlite.Row
+                rows = await cursor.fetchall()
+            if rows:
+                await db.executemany(
+                    'UPDATE doramas SET rendered_card = ? WHERE id = ?',
+                    [(render_dorama_card(row), row['id']) for row in rows]
+                )
             await db.commit()
-            logger.info("✅ База данных успешно инициализирована или уже существует.")
+        except BaseException:
+            await db.rollback()
+            raise
+        if not rows:
+            break
+        total += len(rows)
+        last_id = rows[-1]['id']
+        await asyncio.sleep(MIGRATION_BATCH_SLEEP)
+    if total:
+        logger.info("🪪 Карточки подготовлены для %s дорам.", total)
+
+CATALOG_MIGRATIONS = [
+    Migration(1, "таблицы и индексы каталога", migrate_catalog_base),
+    Migration(2, "ключи поиска для существующих дорам", migrate_catalog_search_keys),
+    Migration(3, "карточки для существующих дорам", migrate_catalog_cards, background=True, batched=True),
+]
+
+async def init_db(background: bool = True):
+    """Приводит doramas.db к последней версии схемы; background=False — дождаться и фоновых миграций."""
+    try:
+        await run_migrations(DB_PATH, CATALOG_MIGRATIONS, background)
+        logger.info("✅ База данных успешно инициализирована или уже существует.")
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ Ошибка при инициализации базы данных: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при инициализации базы данных: %s", e, exc_info=True)
         sys.exit(1)
 
 # ======== Получаем общее количество дорам ==========
 async def get_total_doramas_count():
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connect_db(DB_PATH) as db:
             async with db.execute('SELECT COUNT(*) FROM doramas') as cursor:
                 count = await cursor.fetchone()
                 return count[0] if count else 0
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ Ошибка при получении количества дорам: {e}")
+        logger.error("⚠️ Ошибка при получении количества дорам: %s", e)
         return 0
     
+# ======== Статистика каталога для оценки селективности фильтров ==========
+def title_letter(title):
+    """Первая буква названия для списка по алфавиту: артикли The/A в начале пропускаем."""
+    title = (title or "").strip()
+    for article in ("The ", "A "):
+        if title.startswith(article) and len(title) > len(article):
+            title = title[len(article):]
+            break
+    return title[:1].upper()
+
+class CatalogStats:
+    """Сколько дорам приходится на каждую страну, год, оценку и первую букву названия — по ним
+    планировщик выбирает фильтр."""
+    __slots__ = ("total", "countries", "years", "ratings", "letters")
+
+    def __init__(self):
+        self.total = 0
+        self.countries = Counter()
+        self.years = Counter()
+        self.ratings = Counter()
+        self.letters = Counter()  # (ru/en, буква) -> число дорам
+
+    def add(self, country, year, rating, title_ru, title_en, sign=1):
+        self.total += sign
+        self.countries[country] += sign
+        self.years[int(year)] += sign
+        self.ratings[int(rating)] += sign
+        self.letters["ru", title_letter(title_ru)] += sign
+        self.letters["en", title_letter(title_en)] += sign
+
+    def remove(self, country, year, rating, title_ru, title_en):
+        self.add(country, year, rating, title_ru, title_en, sign=-1)
+
+    def load(self, rows):
+        """Заполнение из строк (country, year, personal_rating, title_ru, title_en)."""
+        for row in rows:
+            self.add(*row)
+
+    def replace_with(self, other):
+        self.total, self.countries, self.years, self.ratings, self.letters = (
+            other.total, other.countries, other.years, other.ratings, other.letters
+        )
+
+catalog_stats = CatalogStats()
+
+async def build_catalog_stats():
+    async with connect_db(DB_PATH) as db:
+        async with db.execute("SELECT country, year, personal_rating, title_ru, title_en FROM doramas") as cursor:
+            rows = await cursor.fetchall()
+    stats = CatalogStats()
+    stats.load(rows)
+    catalog_stats.replace_with(stats)
+
+# ======== Комбинированный фильтр и планировщик запросов ==========
+class DoramaQuery:
+    """Набор фильтров по каталогу: страна, годы, оценка, люди, название, первая буква.
+
+    Каждый фильтр знает оценку числа подходящих дорам. Первым идёт самый
+    селективный (его индекс подсказывается SQLite через INDEXED BY, список id
+    из индекса в памяти подставляется как есть), остальные пересекаются с ним.
+    """
+    __slots__ = ("country", "year_from", "year_to", "rating", "min_rating", "people", "title", "letter", "language")
+
+    def __init__(self, country=None, year_from=None, year_to=None, rating=None, min_rating=None,
+                 people=None, title=None, letter=None, language="ru"):
+        self.country = country
+        self.year_from = year_from
+        self.year_to = year_to
+        self.rating = rating
+        self.min_rating = min_rating
+        self.people = dict(people or {})  # поле (lead_actor/lead_actress/director) -> имя
+        self.title = title
+        self.letter = letter
+        self.language = language
+
+    def facets(self):
+        """[(оценка числа дорам, SQL-условие, параметры, индекс или None)] по заданным фильтрам."""
+        facets = []
+        if self.title:
+            # Все совпадения, без TITLE_SEARCH_LIMIT: иначе «Всего» было бы не больше лимита.
+            # Список id передаём одним JSON-параметром — число ? в запросе ограничено
+            dorama_ids = title_index.search(self.title, limit=None)
+            facets.append((len(dorama_ids), "d.id IN (SELECT value FROM json_each(?))", [json.dumps(dorama_ids)], None))
+        if self.country:
+            facets.append((catalog_stats.countries[self.country], "d.country = ?", [self.country], "idx_country"))
+        if self.year_from is not None or self.year_to is not None:
+            low = self.year_from if self.year_from is not None else 0
+            high = self.year_to if self.year_to is not None else 9999
+            estimate = sum(count for year, count in catalog_stats.years.items() if low <= year <= high)
+            facets.append((estimate, "d.year BETWEEN ? AND ?", [low, high], "idx_year"))
+        if self.rating is not None:
+            rating = int(self.rating)
+            facets.append((catalog_stats.ratings[rating], "d.personal_rating = ?", [rating], "idx_personal_rating"))
+        elif self.min_rating is not None:
+            rating = int(self.min_rating)
+            estimate = sum(count for value, count in catalog_stats.ratings.items() if value >= rating)
+            facets.append((estimate, "d.personal_rating >= ?", [rating], "idx_personal_rating"))
+        for field, name in self.people.items():
+            if field not in PEOPLE_FIELDS:
+                continue
+            count = people_index.count(field, name)
+            if count:
+                # Имя записано ровно как в каталоге (выбрано из списка): фонетический ключ
+                # здесь не годится — «Пак Со Джун» и «Пак Со Джин» дают один и тот же ключ
+                facets.append((count, f"d.{field} = ?", [name], f"idx_{field}"))
+                continue
+            variants = name_key_variants(name)
+            # Индекс имён ищет по префиксу — это оценка сверху для точного совпадения ключа
+            estimate = sum(count for _, _, count in people_index.search(field, name)) if variants else 0
+            placeholders = ", ".join("?" for _ in variants)
+            facets.append((
+                estimate,
+                f"d.id IN (SELECT dorama_id FROM search_keys WHERE field = ? AND key IN ({placeholders}))",
+                [field, *variants],
+                None,
+            ))
+        if self.letter:
+            language = "ru" if self.language == "ru" else "en"
+            column = f"d.title_{language}"
+            letter = self.letter.upper()
+            # Диапазоны по префиксу вместо LIKE: каждый — поиск по idx_title_*, а не перебор.
+            # Артикли The/A в английских названиях пропускаем, как и в списке по буквам
+            ranges = []
+            params = []
+            for prefix in dict.fromkeys((letter, letter.lower(), f"The {letter}", f"A {letter}")):
+                condition = f"{column} >= ? AND {column} < ?"
+                if prefix in ("T", "t", "A", "a"):
+                    condition += f" AND {column} NOT LIKE 'The %' AND {column} NOT LIKE 'A %'"
+                ranges.append(f"({condition})")
+                params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+            facets.append((
+                catalog_stats.letters[language, letter], f"({' OR '.join(ranges)})", params, f"idx_title_{language}"
+            ))
+        return facets
+
+    def plan(self):
+        """Фильтры от самого селективного к наименее; None — если результат заведомо пуст."""
+        facets = sorted(self.facets(), key=lambda facet: facet[0])
+        if facets and facets[0][0] == 0:
+            return None
+        return facets
+
+    def statements(self, columns, order_by):
+        """(SELECT страницы, SELECT COUNT(*), параметры) или None для пустого результата."""
+        facets = self.plan()
+        if facets is None:
+            return None
+        source = "doramas d"
+        if facets and facets[0][3]:
+            source += f" INDEXED BY {facets[0][3]}"
+            # Унарный + запрещает сортировать обходом индекса: иначе при ORDER BY по столбцу
+            # того же индекса SQLite читает его целиком вместо поиска по условию
+            order_by = ", ".join(f"+{term.strip()}" for term in order_by.split(","))
+        where = " AND ".join(facet[1] for facet in facets) or "1"
+        params = [param for facet in facets for param in facet[2]]
+        return (
+            f"SELECT {columns} FROM {source} WHERE {where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            f"SELECT COUNT(*) FROM {source} WHERE {where}",
+            params,
+        )
+
+async def run_dorama_query(dorama_query, page=0, columns="d.id, d.title_ru, d.country, d.year", order_by="d.title_ru"):
+    """Общий исполнитель для всех списков: строки страницы и общее число дорам."""
+    await wait_for_catalog()
+    statements = dorama_query.statements(columns, order_by)
+    if statements is None:
+        return [], 0
+    select_sql, count_sql, params = statements
+    async with connect_db(DB_PATH) as db:
+        async with db.execute(count_sql, params) as cursor:
+            total = (await cursor.fetchone())[0]
+        if not total:
+            return [], 0
+        async with db.execute(select_sql, (*params, PAGE_SIZE, page * PAGE_SIZE)) as cursor:
+            rows = await cursor.fetchall()
+    return rows, total
+
 # ======== Преобразует ссылку Яндекс.Диска в прямую ссылку ==========    
 def get_yandex_disk_direct_link(yandex_url):
+    import requests  # Нужен только при добавлении дорамы
+
     try:
         base_api_url = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
-        response = requests.get(base_api_url, params={"public_key": yandex_url})
+        with metrics.timer("yandex", "download_link"):
+            response = requests.get(base_api_url, params={"public_key": yandex_url})
 
         if response.status_code == 200:
             return response.json().get("href", "")
         else:
             return ""
     except Exception as e:
-        logger.error(f"Ошибка при получении прямой ссылки: {e}")
+        logger.error("Ошибка при получении прямой ссылки: %s", e)
         return ""
 
 # ======== Унифицированная функция для отправки ответов пользователю ==========    
@@ -277,7 +1139,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Текущая временная метка
 
         # Логируем запуск команды /start и добавляем пользователя в базу, если его там нет
-        async with aiosqlite.connect(DB_PATH_2) as db:
+        async with connect_db(DB_PATH_2) as db:
             await db.execute('''
                 INSERT INTO users (user_id, username, first_seen, last_seen)
                 VALUES (?, ?, ?, ?)
@@ -319,7 +1181,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return SHOW_MENU
 
     except Exception as e:
-        logger.error(f"⚠️ Ошибка при обработке команды /start: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при обработке команды /start: %s", e, exc_info=True)
 
         if update.message:
             await update.message.reply_text("Произошла ошибка при обработке команды /start.")
@@ -332,7 +1194,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 # ========  Главное меню ==========
 async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logger.info("Функция show_menu вызвана!")  
+    logger.debug("Функция show_menu вызвана!")  
     query = update.callback_query
     reply_markup = create_main_menu_keyboard()
 
@@ -343,7 +1205,7 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             try:
                 await query.message.delete() # Попытка удалить старое сообщение
             except Exception as e:
-                logger.warning(f"Не удалось удалить старое сообщение: {e}", exc_info=True)
+                logger.warning("Не удалось удалить старое сообщение: %s", e, exc_info=True)
 
             await context.bot.send_message( # Отправляем новое сообщение
                 chat_id=query.message.chat_id,
@@ -356,7 +1218,7 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 reply_markup=reply_markup
             )
         else:
-            logger.warning(f"Неизвестный тип обновления в show_menu: {update}", exc_info=True) # Логируем тип обновления
+            logger.warning("Неизвестный тип обновления в show_menu: %s", update, exc_info=True) # Логируем тип обновления
 
             chat_id = None # Получаем chat_id
             if update.effective_chat:
@@ -374,7 +1236,7 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             return SHOW_MENU
 
     except Exception as e:
-        logger.error(f"Ошибка при отображении главного меню: {e}", exc_info=True)
+        logger.error("Ошибка при отображении главного меню: %s", e, exc_info=True)
 
         chat_id = None  # Получаем chat_id
         if update.message:
@@ -400,7 +1262,7 @@ async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     context.user_data.clear()
 
-    logger.info("Процесс поиска сброшен. Переход в главное меню.")
+    logger.debug("Процесс поиска сброшен. Переход в главное меню.")
     
     reply_markup = create_main_menu_keyboard()
 
@@ -415,7 +1277,7 @@ async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
 
                 raise
     except Exception as e:
-        logger.error(f"Ошибка при возврате в главное меню: {e}")
+        logger.error("Ошибка при возврате в главное меню: %s", e)
                      
     return ConversationHandler.END
 
@@ -423,7 +1285,7 @@ async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
 # ======== Очищает состояние и возвращает в главное меню ==========
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
-    logger.info("Процесс перезапуска. Все данные пользователя очищены.")
+    logger.debug("Процесс перезапуска. Все данные пользователя очищены.")
     
     reply_markup = create_main_menu_keyboard()
     
@@ -465,7 +1327,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 try:
                     await query.message.delete()
                 except Exception as delete_error:
-                    logger.warning(f"Ошибка при удалении сообщения: {delete_error}")
+                    logger.warning("Ошибка при удалении сообщения: %s", delete_error)
 
         # Очищаем данные пользователя, если они есть
         context.user_data.clear()  
@@ -473,7 +1335,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return ConversationHandler.END  # Завершаем диалог
 
     except Exception as e:
-        logger.error(f"Ошибка при возврате в главное меню: {e}", exc_info=True)
+        logger.error("Ошибка при возврате в главное меню: %s", e, exc_info=True)
         return ConversationHandler.END
 
 
@@ -526,10 +1388,11 @@ async def add_dorama(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     reply_markup = create_cancel_keyboard()
 
+    prompt = "🇷🇺 Введите название дорамы на русском языке:\n\n📝 Или отмените и пришлите всё одним сообщением: /add"
     if update.message:
-        await update.message.reply_text("🇷🇺 Введите название дорамы на русском языке:", reply_markup=reply_markup)
+        await update.message.reply_text(prompt, reply_markup=reply_markup)
     elif update.callback_query:
-        await update.callback_query.edit_message_text("🇷🇺 Введите название дорамы на русском языке:", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(prompt, reply_markup=reply_markup)
 
     return ADDING_TITLE_RU
 
@@ -786,6 +1649,7 @@ async def receive_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Шаг 11: Получаем постер
 async def receive_poster_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await wait_for_catalog()
     poster_url = update.message.text.strip()
 
     # Проверяем, что ссылка действительно с Яндекс.Диска
@@ -802,8 +1666,8 @@ async def receive_poster_url(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['poster_url'] = direct_link  # Сохраняем прямую ссылку
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
+        async with connect_db(DB_PATH) as db:
+            cursor = await db.execute(
                 '''
                 INSERT INTO doramas (title_ru, title_en, country, year, director, lead_actress, lead_actor, personal_rating, comment, plot, poster_url)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -819,11 +1683,48 @@ async def receive_poster_url(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     context.user_data['personal_rating'],
                     context.user_data['comment'],
                     context.user_data['plot'],
-                    context.user_data['poster_url'],  
+                    context.user_data['poster_url'],
+                ),
+            )
+            # Карточку и ключи поиска пишем в той же транзакции, что и саму дораму
+            await store_rendered_card(db, cursor.lastrowid)
+            await db.executemany(
+                'INSERT INTO search_keys (dorama_id, field, key) VALUES (?, ?, ?)',
+                search_key_rows(
+                    cursor.lastrowid,
+                    context.user_data['title_ru'],
+                    context.user_data['title_en'],
+                    context.user_data['director'],
+                    context.user_data['lead_actress'],
+                    context.user_data['lead_actor'],
                 ),
             )
             await db.commit()
 
+        # Добавляем новую дораму в индекс названий
+        title_index.add(
+            cursor.lastrowid,
+            context.user_data['title_ru'],
+            context.user_data['title_en'],
+            context.user_data['country'],
+            context.user_data['year'],
+        )
+        add_people_to_index(
+            context.user_data['director'],
+            context.user_data['lead_actress'],
+            context.user_data['lead_actor'],
+            context.user_data['country'],
+        )
+        catalog_stats.add(
+            context.user_data['country'],
+            context.user_data['year'],
+            context.user_data['personal_rating'],
+            context.user_data['title_ru'],
+            context.user_data['title_en'],
+        )
+        inline_result_cache.clear()
+        similarity_rebuilder.schedule()
+
         await update.message.reply_text("🎉 Дорама успешно добавлена!")
         # Очищаем user_data после успешного добавления
         context.user_data.clear()  # Очищаем все данные
@@ -831,11 +1732,11 @@ async def receive_poster_url(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END  
 
     except aiosqlite.Error as e:
-        logger.error(f"❌ Ошибка при добавлении дорамы в БД: {e}", exc_info=True)
+        logger.error("❌ Ошибка при добавлении дорамы в БД: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Ошибка при добавлении дорамы в БД: {e}")
         return ADDING_POSTER_URL # Или ConversationHandler.END, в зависимости от желаемого поведения
     except Exception as e:
-        logger.error(f"❌ Непредвиденная ошибка: {e}", exc_info=True)
+        logger.error("❌ Непредвиденная ошибка: %s", e, exc_info=True)
         await update.message.reply_text(f"❌ Произошла непредвиденная ошибка: {e}")
         return ADDING_POSTER_URL # Или ConversationHandler.END, в зависимости от желаемого поведения
         
@@ -890,6 +1791,7 @@ async def handle_delete_dorama(update: Update, context: ContextTypes.DEFAULT_TYP
 async def confirm_delete_dorama(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
+    await wait_for_catalog()
 
     if query.data == "confirm_delete":
         dorama_id = context.user_data.get('dorama_id_to_delete')
@@ -920,9 +1822,22 @@ async def confirm_delete_dorama(update: Update, context: ContextTypes.DEFAULT_TY
             return ConversationHandler.END
 
         try:
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute('DELETE FROM doramas WHERE id = ?', (dorama_id_int,))  
+            async with connect_db(DB_PATH) as db:
+                async with db.execute(
+                    'SELECT director, lead_actress, lead_actor, country, year, personal_rating, title_ru, title_en FROM doramas WHERE id = ?',
+                    (dorama_id_int,)
+                ) as cursor:
+                    deleted = await cursor.fetchone()
+                await db.execute('DELETE FROM doramas WHERE id = ?', (dorama_id_int,))
+                await db.execute('DELETE FROM search_keys WHERE dorama_id = ?', (dorama_id_int,))
+                await db.execute('DELETE FROM similar_doramas WHERE dorama_id = ?', (dorama_id_int,))
                 await db.commit()
+            title_index.remove(dorama_id_int)
+            if deleted:
+                remove_people_from_index(*deleted[:4])
+                catalog_stats.remove(*deleted[3:])
+            inline_result_cache.clear()
+            similarity_rebuilder.schedule()
             try:
 
                 await query.edit_message_text(f"Дорама с ID {dorama_id} успешно удалена!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("В главное меню 🌸", callback_data="return_to_main_menu")]]))
@@ -933,7 +1848,7 @@ async def confirm_delete_dorama(update: Update, context: ContextTypes.DEFAULT_TY
 
                     raise
         except aiosqlite.Error as e:
-            logger.error(f"Ошибка при удалении дорамы: {e}")
+            logger.error("Ошибка при удалении дорамы: %s", e)
             try:
 
                 await query.edit_message_text(f"Произошла ошибка при удалении дорамы: {e}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("В главное меню 🌸", callback_data="return_to_main_menu")]]))
@@ -974,22 +1889,20 @@ async def get_dorama_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
                 raise
     except Exception as e:
-        logger.error(f"⚠️ Ошибка при запросе ID дорамы: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при запросе ID дорамы: %s", e, exc_info=True)
         
     return GETTING_DORAMA_ID
 
 # Возвращает безопасное значение с экранированием.
 def safe_get(value):
-    logger.debug(f"Value received in safe_get: {value} (type: {type(value)})")
     if value is None:
         return "Не указано"
     if isinstance(value, str):
-        escaped_text = escape_markdown(prevent_hashtag_linking(value))
-        return remove_extra_escape(escaped_text)
+        return escape_markdown(value, CARD_ESCAPE)
     return "Не указано"
 
-# Возвращает строку с подробной информацией о дораме.
-async def get_dorama_details_text(row: aiosqlite.Row) -> str:
+# Собирает карточку дорамы. Вызывается при добавлении/изменении, готовый текст хранится в rendered_card.
+def render_dorama_card(row) -> str:
     title_ru = safe_get(row['title_ru'])
     title_en = safe_get(row['title_en'])
     plot = safe_get(row['plot'])  
@@ -1010,6 +1923,34 @@ async def get_dorama_details_text(row: aiosqlite.Row) -> str:
         
     )
 
+# Возвращает строку с подробной информацией о дораме.
+async def get_dorama_details_text(row: aiosqlite.Row) -> str:
+    # Карточка уже экранирована при сохранении; собираем её заново, только если колонку ещё не заполнили
+    return row['rendered_card'] or render_dorama_card(row)
+
+# Карточка, которая влезает в одно сообщение (для инлайн-ответа её не разбить на части).
+# Обрезаем сюжет или комментарий до экранирования: срез готового текста может разорвать *разметку*.
+def fit_dorama_card(row, max_length=4096) -> str:
+    text = row['rendered_card'] or render_dorama_card(row)
+    values = {**dict(row), 0: row['id']}
+    while len(text) > max_length:
+        field = max(("plot", "comment"), key=lambda name: len(values[name] or ""))
+        value = values[field] or ""
+        excess = (len(text) - max_length) * len(value) // max(len(safe_get(value)), 1) + 1  # Экранирование удлиняет текст
+        shortened = truncate_text(value, max(0, len(value) - excess - 3))
+        if len(shortened) >= len(value):
+            return split_message(text, max_length)[0]  # Длинные не сюжет с комментарием, а остальные поля
+        values[field] = shortened
+        text = render_dorama_card(values)
+    return text
+
+# Пересобирает и сохраняет карточку дорамы (в транзакции вызывающего кода).
+async def store_rendered_card(db, dorama_id: int):
+    async with db.execute(f"SELECT {CARD_COLUMNS} FROM doramas WHERE id = ?", (dorama_id,)) as cursor:
+        cursor.row_factory = aiosqlite.Row
+        row = await cursor.fetchone()
+    await db.execute("UPDATE doramas SET rendered_card = ? WHERE id = ?", (render_dorama_card(row), dorama_id))
+
 # Универсальная функция для отправки сообщений (текст или фото).
 async def _send_message(update: Update, text: str, photo: str = None, reply_markup: InlineKeyboardMarkup = None):
     try:
@@ -1024,18 +1965,21 @@ async def _send_message(update: Update, text: str, photo: str = None, reply_mark
             else:
                 await update.message.reply_text(text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
-        logger.error(f"Ошибка при отправке сообщения: {e}", exc_info=True)
+        logger.error("Ошибка при отправке сообщения: %s", e, exc_info=True)
 
 # Функция для отправки информации о дораме.
 async def send_dorama_details(update: Update, row: aiosqlite.Row, context: ContextTypes.DEFAULT_TYPE):
     details = await get_dorama_details_text(row)
-    poster_url = safe_get(row['poster_url'])  # Получаем ссылку
+    poster_url = row['poster_url'] or ""  # Получаем ссылку
+    reply_markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("🔁 Похожие", callback_data=f"similar:{row['id']}")]] + list(back_button.inline_keyboard)
+    )
 
     if poster_url.startswith("https://disk.yandex.ru/"):
         poster_download_url = get_yandex_disk_direct_link(poster_url)
-        await _send_message(update, details, photo=poster_download_url, reply_markup=back_button)
+        await _send_message(update, details, photo=poster_download_url, reply_markup=reply_markup)
     else:
-        await _send_message(update, details, reply_markup=back_button)
+        await _send_message(update, details, reply_markup=reply_markup)
 
 
 
@@ -1049,13 +1993,10 @@ async def receive_dorama_id(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return GETTING_DORAMA_ID
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connect_db(DB_PATH) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute(
-                """
-                SELECT id, title_ru, title_en, country, year, director, lead_actress, lead_actor, personal_rating, comment, plot, poster_url
-                FROM doramas WHERE id = ?
-                """, 
+                f"SELECT {CARD_COLUMNS}, rendered_card FROM doramas WHERE id = ?",
                 (dorama_id,)
             ) as cursor:
                 row = await cursor.fetchone()
@@ -1069,7 +2010,7 @@ async def receive_dorama_id(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
 
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ Ошибка при работе с базой данных: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при работе с базой данных: %s", e, exc_info=True)
         await update.message.reply_text("⚠️ Произошла ошибка при работе с базой данных.", reply_markup=back_button)
         return ConversationHandler.END
 
@@ -1086,8 +2027,7 @@ async def handle_show_dorama(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
 
     try:
-        start_time = asyncio.get_event_loop().time()
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with connect_db(DB_PATH) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute(
                 """
@@ -1102,16 +2042,14 @@ async def handle_show_dorama(update: Update, context: ContextTypes.DEFAULT_TYPE)
                        personal_rating AS personal_rating,
                        comment AS comment,
                        plot AS plot,
-                       poster_url AS poster_url
+                       poster_url AS poster_url,
+                       rendered_card AS rendered_card
                 FROM doramas WHERE id = ?
                 """,
                 (dorama_id,)
             ) as cursor:
                 row = await cursor.fetchone()
 
-        end_time = asyncio.get_event_loop().time()
-        logger.info(f"SQL query execution time: {end_time - start_time:.4f} seconds")
-
         if row:
             await send_dorama_details(update, row, context)
         else:
@@ -1120,11 +2058,168 @@ async def handle_show_dorama(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
 
     except Exception as e:
-        logger.error(f"⚠️ Ошибка при получении информации о дораме: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при получении информации о дораме: %s", e, exc_info=True)
         await _send_message(update, "⚠️ Произошла ошибка при получении информации о дораме. Попробуйте снова.", reply_markup=back_button)
         return ConversationHandler.END
 
 
+# ПОХОЖИЕ ДОРАМЫ
+# ======== Признаки дорамы для вектора похожести ==========
+def dorama_features(row):
+    """(признак, вес) для строки (id, title_ru, title_en, country, year, director, lead_actress, lead_actor, rating)."""
+    _, title_ru, title_en, country, year, director, lead_actress, lead_actor, rating = row
+    weights = SIMILARITY_WEIGHTS
+    yield f"country:{country}", weights["country"]
+    for kind, name in (("director", director), ("actress", lead_actress), ("actor", lead_actor)):
+        key = name_key(name)  # «Ли Мин Хо» и «Lee Min Ho» — один признак
+        if key:
+            yield f"{kind}:{key}", weights[kind]
+    # Соседние годы и оценки тоже немного похожи
+    for kind, value in (("year", int(year)), ("rating", int(rating))):
+        yield f"{kind}:{value}", weights[kind]
+        yield f"{kind}:{value - 1}", weights[kind] / 2
+        yield f"{kind}:{value + 1}", weights[kind] / 2
+    for word in set(re.findall(r"\w{3,}", f"{transliterate(title_ru)} {transliterate(title_en)}")):
+        yield f"title:{word}", weights["title"]
+
+# ======== Расчёт похожих дорам (выполняется в отдельном процессе) ==========
+def compute_similar_doramas(rows, top_k=SIMILAR_TOP_K):
+    """[(dorama_id, rank, similar_id, score)]: top-k по косинусной близости векторов признаков.
+
+    Признаки хешируются в вектор фиксированной длины, матрица близости
+    считается блоками, чтобы не держать в памяти N×N целиком.
+    """
+    import numpy as np  # Импортируется только в процессе пересчёта
+
+    if len(rows) < 2:
+        return []
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    features = np.zeros((len(rows), SIMILARITY_FEATURE_DIM), dtype=np.float32)
+    for i, row in enumerate(rows):
+        for feature, weight in dorama_features(row):
+            features[i, zlib.crc32(feature.encode()) % SIMILARITY_FEATURE_DIM] += weight
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    features /= np.where(norms == 0, 1, norms)
+
+    k = min(top_k, len(rows) - 1)
+    result = []
+    for start in range(0, len(rows), SIMILARITY_BLOCK_SIZE):
+        block = features[start:start + SIMILARITY_BLOCK_SIZE] @ features.T
+        block[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf  # Сама с собой не считается
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        for offset, (neighbours, neighbour_scores) in enumerate(zip(top, scores)):
+            dorama_id = int(ids[start + offset])
+            result.extend(
+                (dorama_id, rank, int(ids[neighbour]), float(score))
+                for rank, (neighbour, score) in enumerate(zip(neighbours, neighbour_scores))
+                if score > 0
+            )
+    return result
+
+class SimilarityRebuilder:
+    """Пересчитывает таблицу similar_doramas в пуле процессов, не блокируя бота.
+
+    Если во время пересчёта каталог снова изменился, после него запускается ещё один.
+    """
+    __slots__ = ("_executor", "_task", "_pending")
+
+    def __init__(self):
+        self._executor = None  # Пул создаётся при первом пересчёте
+        self._task = None
+        self._pending = False
+
+    def schedule(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._pending = True
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            self._pending = False
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error("⚠️ Ошибка при пересчёте похожих дорам: %s", e, exc_info=True)
+            if not self._pending:
+                return
+
+    async def rebuild(self) -> None:
+        started = time.perf_counter()
+        async with connect_db(DB_PATH) as db:
+            async with db.execute(
+                "SELECT id, title_ru, title_en, country, year, director, lead_actress, lead_actor, personal_rating FROM doramas"
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        if self._executor is None:
+            # spawn: не копируем в дочерний процесс потоки aiosqlite и цикл событий
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        pairs = await asyncio.get_running_loop().run_in_executor(self._executor, compute_similar_doramas, rows)
+
+        async with connect_db(DB_PATH) as db:
+            await db.execute("DELETE FROM similar_doramas")
+            await db.executemany(
+                "INSERT INTO similar_doramas (dorama_id, rank, similar_id, score) VALUES (?, ?, ?, ?)", pairs
+            )
+            await db.commit()
+        logger.info("🔁 Похожие дорамы пересчитаны: %s дорам за %.2f с.", len(rows), time.perf_counter() - started)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+similarity_rebuilder = SimilarityRebuilder()
+
+# ======== При запуске пересчитываем похожие, если таблица ещё пустая ==========
+async def ensure_similar_doramas():
+    async with connect_db(DB_PATH) as db:
+        async with db.execute(
+            "SELECT EXISTS (SELECT 1 FROM doramas) AND NOT EXISTS (SELECT 1 FROM similar_doramas)"
+        ) as cursor:
+            missing = (await cursor.fetchone())[0]
+    if missing:
+        similarity_rebuilder.schedule()
+
+# ======== Кнопка «Похожие» на карточке дорамы ==========
+async def handle_similar_doramas(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    _, _, dorama_id = query.data.partition(":")
+
+    try:
+        async with connect_db(DB_PATH) as db:
+            async with db.execute(
+                """
+                SELECT d.id, d.title_ru, d.year, d.country FROM similar_doramas s
+                JOIN doramas d ON d.id = s.similar_id
+                WHERE s.dorama_id = ? ORDER BY s.rank
+                """,
+                (int(dorama_id),)
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        if rows:
+            keyboard = [
+                [InlineKeyboardButton(f"🎬 {title_ru} ({year}) {COUNTRY_FLAGS.get(country, '🌍')}", callback_data=f"show_dorama:{similar_id}")]
+                for similar_id, title_ru, year, country in rows
+            ]
+            keyboard.append([InlineKeyboardButton("🌸 В главное меню", callback_data="return_to_main_menu")])
+            await query.message.reply_text("*🔁 Похожие дорамы:*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+        else:
+            await query.message.reply_text("🤷 Похожие дорамы пока не подобраны. Загляните чуть позже.", reply_markup=back_button)
+
+    except aiosqlite.Error as e:
+        logger.error("⚠️ Ошибка при получении похожих дорам: %s", e, exc_info=True)
+        await query.message.reply_text("⚠️ Произошла ошибка при поиске похожих дорам.", reply_markup=back_button)
+
+    return ConversationHandler.END
+
+
 # ФУНКЦИИ ДЛЯ ПОИСКА ДОРАМЫ ПО СТРАНЕ (с кнопочками)
 # Функция для поиска по стране
 async def search_by_country(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1155,7 +2250,7 @@ async def search_by_country(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("*🚩 Выберите страну для поиска:*", reply_markup=reply_markup, parse_mode='Markdown')
     except Exception as e:
         # Логируем все другие ошибки
-        logger.error(f"Ошибка при редактировании сообщения: {e}")
+        logger.error("Ошибка при редактировании сообщения: %s", e)
         await update.message.reply_text("❌ Произошла ошибка при обработке запроса.",
                                         reply_markup=InlineKeyboardMarkup([
                                             [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_actor")],
@@ -1197,64 +2292,53 @@ async def fetch_doramas_page(update: Update, context: ContextTypes.DEFAULT_TYPE,
     query = update.callback_query
 
     try:
-        # Подключаемся к базе данных
-        async with aiosqlite.connect(DB_PATH) as db:
-            # Получаем общее количество дорам для указанной страны
-            async with db.execute('SELECT COUNT(*) FROM doramas WHERE country LIKE ?', (f"%{country}%",)) as cursor:
-                total_results_country = (await cursor.fetchone())[0]
-
-            # Сохраняем количество результатов в контексте
-            context.user_data['total_results_country'] = total_results_country
-
-            if total_results_country == 0:
-                keyboard = [
-                    [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_country")],
-                    [InlineKeyboardButton("🌸 Главное меню", callback_data="return_to_main_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                try:
+        # Страница и общее число — через общий исполнитель фильтров
+        results, total_results_country = await run_dorama_query(
+            DoramaQuery(country=country), page, columns="d.id, d.title_ru, d.year"
+        )
 
-                    await query.edit_message_text(f"🚫 Дорамы из страны '{country}' не найдены.", reply_markup=reply_markup)
+        # Сохраняем количество результатов в контексте
+        context.user_data['total_results_country'] = total_results_country
 
-                except telegram.error.BadRequest as e:
+        if total_results_country == 0:
+            keyboard = [
+                [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_country")],
+                [InlineKeyboardButton("🌸 Главное меню", callback_data="return_to_main_menu")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            try:
 
-                    if 'Message is not modified' not in str(e):
+                await query.edit_message_text(f"🚫 Дорамы из страны '{country}' не найдены.", reply_markup=reply_markup)
 
-                        raise
-                return ConversationHandler.END
+            except telegram.error.BadRequest as e:
 
-            # Вычисляем смещение для текущей страницы
-            offset = page * PAGE_SIZE
+                if 'Message is not modified' not in str(e):
 
-            # Выполняем запрос с пагинацией и сортировкой по названию (по алфавиту)
-            async with db.execute(
-                'SELECT id, title_ru, year FROM doramas WHERE country LIKE ? ORDER BY title_ru ASC LIMIT ? OFFSET ?',
-                (f"%{country}%", PAGE_SIZE, offset)
-            ) as cursor:
-                results = await cursor.fetchall()
+                    raise
+            return ConversationHandler.END
 
-            # Создание кнопок с названиями дорам
-            dorama_buttons = [
-                [InlineKeyboardButton(f"🎬 {title_ru} ({year})", callback_data=f"show_dorama:{dorama_id}")]
-                for dorama_id, title_ru, year in results
-            ]
+        # Создание кнопок с названиями дорам
+        dorama_buttons = [
+            [InlineKeyboardButton(f"🎬 {title_ru} ({year})", callback_data=f"show_dorama:{dorama_id}")]
+            for dorama_id, title_ru, year in results
+        ]
 
-            pagination_keyboard = create_pagination_buttons("country", page=page, total_results=total_results_country).inline_keyboard
-            keyboard = dorama_buttons + list(pagination_keyboard)
-            keyboard.append([InlineKeyboardButton("🌸 В главное меню", callback_data="return_to_main_menu")])
+        pagination_keyboard = create_pagination_buttons("country", page=page, total_results=total_results_country).inline_keyboard
+        keyboard = dorama_buttons + list(pagination_keyboard)
+        keyboard.append([InlineKeyboardButton("🌸 В главное меню", callback_data="return_to_main_menu")])
 
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-            # Отправляем сообщение с кнопками
-            await query.edit_message_text(
-                f"*🚩 Найдено {total_results_country} дорам из страны {country}:*\n📄 Страница {page + 1} из {(total_results_country // PAGE_SIZE) + (1 if total_results_country % PAGE_SIZE else 0)}",
-                reply_markup=reply_markup, parse_mode="Markdown"
-            )
+        # Отправляем сообщение с кнопками
+        await query.edit_message_text(
+            f"*🚩 Найдено {total_results_country} дорам из страны {country}:*\n📄 Страница {page + 1} из {(total_results_country // PAGE_SIZE) + (1 if total_results_country % PAGE_SIZE else 0)}",
+            reply_markup=reply_markup, parse_mode="Markdown"
+        )
 
         return ConversationHandler.END
 
     except aiosqlite.Error as e:
-        logger.error(f"Ошибка базы данных: {e} | Пользователь: {update.effective_user.id}")
+        logger.error("Ошибка базы данных: %s | Пользователь: %s", e, update.effective_user.id)
         await query.edit_message_text("⚠️ Произошла внутренняя ошибка при поиске дорам.",
                                       reply_markup=InlineKeyboardMarkup([
                                           [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_country")],
@@ -1273,6 +2357,295 @@ def normalize_text(text):
     text = re.sub(r"\s+", " ", text)  # Убираем лишние пробелы
     return text.lower()  # Приводим к нижнему регистру без лишней обработки для кириллицы
 
+# --- Триграммный индекс названий ---
+def search_key(text):
+    """Ключ для сравнения названий: нормализованный текст без различия е/ё."""
+    return normalize_text(text).replace("ё", "е")
+
+# --- Транслитерация и ключи поиска для разных алфавитов ---
+CYRILLIC_RE = re.compile(r"[а-яё]")
+CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+# Созвучные в романизациях корейских/китайских/японских имён сочетания сводим к одной букве
+NAME_SOUNDS = {
+    "chzh": "j", "dzh": "j", "zh": "j", "ch": "j", "j": "j",
+    "sch": "s", "sh": "s", "x": "s",
+    "kh": "h", "h": "h",
+    "ts": "z", "tz": "z",
+    "ng": "n",
+    "g": "k", "k": "k", "c": "k", "q": "k",
+    "b": "p", "p": "p",
+    "d": "t", "t": "t",
+    "r": "l", "l": "l",
+    "w": "v", "v": "v",
+}
+NAME_SOUNDS_RE = re.compile("|".join(sorted(NAME_SOUNDS, key=len, reverse=True)))
+NAME_SILENT_RE = re.compile(r"(?<=[aeiou])[rh](?=[^aeiouy]|$)")  # Park -> Пак, Ahn -> Ан
+NAME_VOWELS_RE = re.compile(r"[aeiouy]+")
+NAME_REPEATS_RE = re.compile(r"(.)\1+")
+
+def transliterate(text):
+    """Ключ поиска в латинице: кириллица транслитерируется, регистр и е/ё не важны."""
+    return search_key(text).translate(CYRILLIC_TO_LATIN)
+
+def name_key(text):
+    """Фонетический ключ имени: «Ли Мин Хо», «ли мин хо» и «Lee Min Ho» дают один ключ.
+
+    Каждое слово сводится к первой букве и скелету из согласных, одинаковому
+    для кириллической записи и латинских романизаций.
+    """
+    words = []
+    for word in re.findall(r"[a-z0-9]+", transliterate(text)):
+        word = NAME_SILENT_RE.sub("", word)
+        word = NAME_SOUNDS_RE.sub(lambda match: NAME_SOUNDS[match.group()], word)
+        head = "a" if word[0] in "aeiouy" else word[0]
+        words.append(NAME_REPEATS_RE.sub(r"\1", head + NAME_VOWELS_RE.sub("", word[1:])))
+    return " ".join(words)
+
+def name_key_variants(text):
+    """Варианты ключа для запроса: как введено и с фамилией в конце (Min Ho Lee)."""
+    key = name_key(text)
+    if not key:
+        return []
+    words = key.split()
+    variants = [key]
+    surname_first = " ".join(words[-1:] + words[:-1])
+    if surname_first != key:
+        variants.append(surname_first)
+    return variants
+
+PEOPLE_FIELDS = ("lead_actor", "lead_actress", "director")
+
+def name_suffix_keys(name):
+    """Ключ имени, начиная с каждого слова: по фамилии или имени без фамилии ищем по префиксу."""
+    words = name_key(name).split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+def search_key_rows(dorama_id, title_ru, title_en, director, lead_actress, lead_actor):
+    """Строки для таблицы search_keys: (dorama_id, поле, ключ)."""
+    rows = {(dorama_id, "title", key) for key in title_keys(title_ru, title_en)}
+    for field, name in zip(PEOPLE_FIELDS, (lead_actor, lead_actress, director)):
+        rows.update((dorama_id, field, key) for key in name_suffix_keys(name))
+    return sorted(rows)
+
+def trigrams(text, pad=True):
+    if pad:
+        text = f" {text} "
+    if len(text) < 3:
+        return frozenset((text,)) if text.strip() else frozenset()
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+def title_keys(title_ru, title_en):
+    """Ключи названия для поиска: оба названия, приведённые к латинице.
+
+    Запрос тоже транслитерируется, поэтому «гоблин», «Goblin» и «Гоблин» сравниваются
+    в одном алфавите одной проверкой, без перебора вариантов.
+    """
+    return tuple(dict.fromkeys(key for key in (transliterate(title_ru), transliterate(title_en)) if key))
+
+class TitleIndex:
+    """Индекс триграмм по title_ru/title_en для нечёткого поиска без обращения к БД."""
+    __slots__ = ("_postings", "_grams", "_docs")
+
+    def __init__(self):
+        # триграмма -> [(число триграмм в ключе, id, номер ключа)], по возрастанию длины
+        self._postings: dict[str, list[tuple[int, int, int]]] = {}
+        # вхождение -> триграммы его ключа
+        self._grams: dict[tuple[int, int, int], frozenset] = {}
+        # id -> (ключи поиска через \x00, title_ru, title_en, country, year)
+        self._docs: dict[int, tuple] = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _store(self, dorama_id, title_ru, title_en, country, year):
+        keys = title_keys(title_ru, title_en)
+        key_grams = tuple(trigrams(key) for key in keys)
+        # Ключи склеены разделителем, которого нет в запросах: одна проверка `in` на все
+        self._docs[dorama_id] = ("\x00".join(keys), title_ru, title_en, country, year)
+        for number, grams in enumerate(key_grams):
+            self._grams[len(grams), dorama_id, number] = grams
+        return self._entries(dorama_id, key_grams)
+
+    @staticmethod
+    def _entries(dorama_id, key_grams):
+        """Пары (вхождение, триграмма): у каждого ключа своё вхождение с его длиной,
+        так suggest() считает общие триграммы с ключом прямо по спискам вхождений."""
+        return [
+            ((len(grams), dorama_id, number), gram)
+            for number, grams in enumerate(key_grams) for gram in grams
+        ]
+
+    def add(self, dorama_id, title_ru, title_en, country, year):
+        if dorama_id in self._docs:
+            self.remove(dorama_id)
+        for entry, gram in self._store(dorama_id, title_ru, title_en, country, year):
+            bisect.insort(self._postings.setdefault(gram, []), entry)
+
+    def load(self, rows):
+        """Массовое заполнение: добавляем всё подряд и сортируем списки вхождений один раз."""
+        for row in rows:
+            for entry, gram in self._store(*row):
+                self._postings.setdefault(gram, []).append(entry)
+        for posting in self._postings.values():
+            posting.sort()
+
+    def remove(self, dorama_id):
+        doc = self._docs.pop(dorama_id, None)
+        if doc is None:
+            return
+        key_grams = tuple(trigrams(key) for key in doc[0].split("\x00"))
+        for number, grams in enumerate(key_grams):
+            self._grams.pop((len(grams), dorama_id, number), None)
+        for entry, gram in self._entries(dorama_id, key_grams):
+            posting = self._postings.get(gram)
+            if posting is None:
+                continue
+            i = bisect.bisect_left(posting, entry)
+            if i < len(posting) and posting[i] == entry:
+                del posting[i]
+            if not posting:
+                del self._postings[gram]
+
+    def replace_with(self, other):
+        """Подменяет содержимое индекса целиком (после полной перестройки)."""
+        self._postings, self._grams, self._docs = other._postings, other._grams, other._docs
+
+    def get(self, dorama_id):
+        """Возвращает (id, title_ru, title_en, country, year) или None."""
+        doc = self._docs.get(dorama_id)
+        return (dorama_id, *doc[1:]) if doc else None
+
+    def search(self, query, limit=TITLE_SEARCH_LIMIT):
+        """ID дорам, в названии которых есть запрос, по убыванию похожести.
+
+        Все триграммы запроса есть в таком названии, поэтому похожесть по Жаккару
+        убывает с длиной названия: достаточно пройти самый короткий список
+        вхождений (он отсортирован по длине) и остановиться на limit совпадениях
+        (limit=None — все совпадения). Оба ключа названия могут быть в списке,
+        поэтому повторы пропускаем.
+        """
+        key = transliterate(query)
+        if not key:
+            return []
+        # Для подстроки внутри слова пробелы-границы в запросе не нужны
+        grams = trigrams(key, pad=len(key) < 3)
+        rarest = min((self._postings.get(gram, ()) for gram in grams), key=len)
+
+        found = []
+        seen = set()
+        for _, dorama_id, _ in rarest:
+            if dorama_id not in seen and key in self._docs[dorama_id][0]:
+                seen.add(dorama_id)
+                found.append(dorama_id)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def suggest(self, query, limit=FUZZY_SUGGESTIONS):
+        """ID дорам с похожими (но не содержащими запрос) названиями — для опечаток."""
+        key = transliterate(query)
+        if len(key) < 3:
+            return []  # По одной-двум буквам угадывать нечего
+        query_grams = trigrams(key, pad=False)
+        query_len = len(query_grams)
+
+        required = max(1, math.ceil(FUZZY_MIN_SIMILARITY * query_len))
+        # Списки вхождений от редких триграмм к частым; триграммы, которых нет ни в одном
+        # названии, совпасть не могут
+        by_rarity = sorted(
+            (self._postings[gram] for gram in query_grams if gram in self._postings), key=len
+        )
+        max_common = len(by_rarity)
+        if max_common < required:
+            return []
+
+        best = []  # min-куча (похожесть, id) размером не больше limit
+        positions = [0] * max_common
+        # Ключи берём группами одной длины, от коротких к длинным. Префиксная фильтрация:
+        # ключ, у которого с запросом не меньше need общих триграмм, обязательно есть в одном
+        # из max_common - need + 1 самых редких списков — кандидатов берём только оттуда,
+        # а остальные списки лишь досчитывают им совпадения (пересечение множеств на C).
+        # Когда top-k заполнен, need растёт с длиной ключа, и префикс становится короче.
+        while True:
+            heads = [posting[position][0] for posting, position in zip(by_rarity, positions) if position < len(posting)]
+            if not heads:
+                break
+            doc_len = min(heads)
+            need = required
+            if len(best) >= limit:
+                # Сколько общих триграмм нужно ключу такой длины, чтобы обойти худшего в top-k
+                threshold = best[0][0]
+                need = max(need, math.floor(threshold * (query_len + doc_len) / (1 + threshold)) + 1)
+                if need > max_common:
+                    break  # Дальше ключи только длиннее — нужно будет ещё больше совпадений
+
+            bound = (doc_len, math.inf)
+            ends = [bisect.bisect_right(posting, bound, position) for posting, position in zip(by_rarity, positions)]
+            prefix = max_common - need + 1
+            found = Counter()
+            for posting, start, end in zip(by_rarity[:prefix], positions, ends):
+                found.update(posting[start:end])
+            rest = sum(end - start for start, end in zip(positions[prefix:], ends[prefix:]))
+            if found and rest:
+                if len(found) * FUZZY_VERIFY_COST < rest:
+                    # Кандидатов мало: точное число общих триграмм — по множеству ключа
+                    entries = list(found)
+                    found = dict(zip(entries, map(len, map(
+                        query_grams.intersection, map(self._grams.__getitem__, entries)
+                    ))))
+                else:
+                    # Иначе досчитываем совпадения по остальным спискам группы
+                    candidates = set(found)
+                    for posting, start, end in zip(by_rarity[prefix:], positions[prefix:], ends[prefix:]):
+                        found.update(candidates.intersection(posting[start:end]))
+            positions = ends
+
+            scored = sorted(
+                (
+                    (common / (query_len + key_len - common), dorama_id)
+                    for (key_len, dorama_id, _), common in found.items() if common >= need
+                ),
+                reverse=True,
+            )
+            for similarity, dorama_id in scored:
+                if len(best) >= limit and similarity <= best[0][0]:
+                    break
+                if key in self._docs[dorama_id][0]:
+                    continue  # Точные совпадения отдаёт search()
+
+                # Второй ключ того же названия мог уже попасть в кучу — оставляем лучший
+                for i, (seen, seen_id) in enumerate(best):
+                    if seen_id == dorama_id:
+                        if similarity > seen:
+                            best[i] = (similarity, dorama_id)
+                            heapq.heapify(best)
+                        break
+                else:
+                    if len(best) < limit:
+                        heapq.heappush(best, (similarity, dorama_id))
+                    else:
+                        heapq.heapreplace(best, (similarity, dorama_id))
+
+        return [dorama_id for _, dorama_id in sorted(best, reverse=True)]
+
+title_index = TitleIndex()
+
+# ======== Строим индекс названий по всей таблице ==========
+async def build_title_index():
+    started = time.perf_counter()
+    async with connect_db(DB_PATH) as db:
+        async with db.execute("SELECT id, title_ru, title_en, country, year FROM doramas") as cursor:
+            rows = await cursor.fetchall()
+    index = TitleIndex()
+    await asyncio.to_thread(index.load, rows)  # Новый объект никто не видит до replace_with: строим вне цикла событий
+    title_index.replace_with(index)
+    search_logger.info("Индекс названий построен: %s дорам за %.3f с.", len(title_index), time.perf_counter() - started)
+
 
 # --- Поиск по названию ---
 # Хэндлер для поиска по названию
@@ -1303,14 +2676,14 @@ async def start_search_by_title(update: Update, context: ContextTypes.DEFAULT_TY
 
         # Очистка данных поиска из контекста (если это необходимо для нового поиска)
         context.user_data.clear()  # Сброс данных поиска
-        logger.info("Контекст очищен. Начинаем новый поиск по названию.")
+        search_logger.debug("Контекст очищен. Начинаем новый поиск по названию.")
         
         # Устанавливаем тип поиска
         context.user_data['search_type'] = 'title'
         return SEARCH_TITLE  # Переходим в ожидание текста
     
     except Exception as e:
-        logger.error(f"Ошибка в start_search_by_title: {e}")
+        logger.error("Ошибка в start_search_by_title: %s", e)
         if update.callback_query:
             await update.callback_query.answer()
             await update.callback_query.edit_message_text("⚠️ Произошла ошибка при обработке поиска.")
@@ -1325,7 +2698,7 @@ async def handle_search_by_title(update: Update, context: ContextTypes.DEFAULT_T
         if update.message:
             title = update.message.text.strip()  # Получаем текст сообщения
             normalized_title = normalize_text(title)  # Нормализуем и очищаем название
-            logger.info(f"Нормализованный заголовок: {normalized_title}")  # Логируем нормализованный заголовок
+            search_logger.debug("Нормализованный заголовок: %s", normalized_title)  # Логируем нормализованный заголовок
             context.user_data['normalized_title'] = normalized_title  # Сохраняем нормализованный заголовок в контексте
 
             # Проверка на пустой ввод
@@ -1340,11 +2713,11 @@ async def handle_search_by_title(update: Update, context: ContextTypes.DEFAULT_T
                 return SEARCH_TITLE  # Ожидаем текст заново
             
             # Загружаем первую страницу с результатами
-            logger.info(f"Ищем по названию: {normalized_title}")
+            search_logger.debug("Ищем по названию: %s", normalized_title)
             return await fetch_doramas_by_title_page(update, context, normalized_title, 0)
 
     except Exception as e:
-        logger.error(f"Ошибка в handle_search_by_title: {e}")
+        logger.error("Ошибка в handle_search_by_title: %s", e)
         await update.message.reply_text("⚠️ Произошла ошибка при обработке запроса. Попробуйте снова.", 
                                         reply_markup=InlineKeyboardMarkup([
                                         [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_title")],
@@ -1356,68 +2729,58 @@ async def handle_search_by_title(update: Update, context: ContextTypes.DEFAULT_T
 
 # Функция для поиска дорам по названию
 async def fetch_doramas_by_title_page(update: Update, context: ContextTypes.DEFAULT_TYPE, normalized_title: str, page: int) -> int:
-    logger.info(f"Запрос на страницы: {page}, с нормализованным названием: {normalized_title}")
+    await wait_for_catalog()
+    search_logger.debug("Запрос на страницы: %s, с нормализованным названием: %s", page, normalized_title)
     query = update.callback_query
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            # Получаем общее количество дорам для указанного названия
-            async with db.execute(
-                'SELECT COUNT(*) FROM doramas WHERE LOWER(title_ru) LIKE ? OR LOWER(title_en) LIKE ?', 
-                (f"%{normalized_title}%", f"%{normalized_title}%")
-            ) as cursor:
-                total_results_title = (await cursor.fetchone())[0] or 0  # Проверка на None
-            logger.info(f"Найдено результатов: {total_results_title}")
-
-            # Сохраняем количество результатов в контексте
-            context.user_data['total_results_title'] = total_results_title
-            
-            # Если результатов нет, показываем сообщение и завершаем диалог
-            if total_results_title == 0:
+        # Ищем по триграммному индексу: только названия, содержащие запрос, по убыванию похожести.
+        # Берём все совпадения, чтобы «Найдено» и число страниц были настоящими
+        found_ids = title_index.search(normalized_title, limit=None)
+        total_results_title = len(found_ids)
+        search_logger.debug("Найдено результатов: %s", total_results_title)
+
+        # Сохраняем количество результатов в контексте
+        context.user_data['total_results_title'] = total_results_title
+        
+        # Если результатов нет, предлагаем похожие названия и завершаем диалог
+        if total_results_title == 0:
+            text = f"🚫 Дорамы с названием '{normalized_title}' не найдены."
+            keyboard = []
+
+            suggestions = [title_index.get(dorama_id) for dorama_id in title_index.suggest(normalized_title)]
+            if suggestions:
+                text += "\n\n🤔 Возможно, вы имели в виду:"
                 keyboard = [
-                    [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_title")],
-                    [InlineKeyboardButton("🌸 Главное меню", callback_data="return_to_main_menu")]
+                    [InlineKeyboardButton(f"🎬 {title_ru} ({year}) {COUNTRY_FLAGS.get(country, country)}", callback_data=f"show_dorama:{dorama_id}")]
+                    for dorama_id, title_ru, _, country, year in suggestions
                 ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
 
-                if query:
-                    try:
+            keyboard.append([InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_title")])
+            keyboard.append([InlineKeyboardButton("🌸 Главное меню", callback_data="return_to_main_menu")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
 
-                        await query.edit_message_text(f"🚫 Дорамы с названием '{normalized_title}' не найдены.", reply_markup=reply_markup)
+            if query:
+                try:
 
-                    except telegram.error.BadRequest as e:
+                    await query.edit_message_text(text, reply_markup=reply_markup)
 
-                        if 'Message is not modified' not in str(e):
+                except telegram.error.BadRequest as e:
 
-                            raise
-                else:
-                    await update.message.reply_text(f"🚫 Дорамы с названием '{normalized_title}' не найдены.", reply_markup=reply_markup)
+                    if 'Message is not modified' not in str(e):
 
-                return ConversationHandler.END  # Завершаем диалог            
-            
-            # Вычисляем параметры пагинации
-            offset = page * PAGE_SIZE
-            max_pages = (total_results_title + PAGE_SIZE - 1) // PAGE_SIZE              
-            
-            logger.info(f"SQL-запрос: SELECT id, title_ru, title_en FROM doramas WHERE LOWER(title_ru) LIKE '%{normalized_title}%' COLLATE NOCASE")
+                        raise
+            else:
+                await update.message.reply_text(text, reply_markup=reply_markup)
 
-            # Выполняем запрос с пагинацией и сортировкой по названию (по алфавиту)
-            async with db.execute(
-                'SELECT id, title_ru, title_en, country, year FROM doramas '
-                'WHERE LOWER(title_ru) LIKE LOWER(?) COLLATE NOCASE ' 
-                'OR LOWER(title_en) LIKE LOWER(?) COLLATE NOCASE '
-                'ORDER BY title_ru ASC LIMIT ? OFFSET ?',
-                (f"%{normalized_title}%", f"%{normalized_title}%", PAGE_SIZE, offset)
-            ) as cursor:
-                results_title = await cursor.fetchall()
-                      
-            if not results_title:
-                # Формируем клавиатуру с кнопками "Новый поиск" и "Главное меню"
-                keyboard = [
-                    [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_by_title")],
-                    [InlineKeyboardButton("🌸 Главное меню", callback_data="return_to_main_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            return ConversationHandler.END  # Завершаем диалог            
+        
+        # Вычисляем параметры пагинации
+        offset = page * PAGE_SIZE
+        max_pages = (total_results_title + PAGE_SIZE - 1) // PAGE_SIZE              
+
+        # Данные для кнопок берём прямо из индекса, без запроса к БД
+        results_title = [title_index.get(dorama_id) for dorama_id in found_ids[offset:offset + PAGE_SIZE]]
 
         # Формируем ответ с результатами
         response = f"*🌸 Найдено {total_results_title} дорам по запросу '{normalized_title}':*\n\n"
@@ -1427,7 +2790,7 @@ async def fetch_doramas_by_title_page(update: Update, context: ContextTypes.DEFA
         seen_ids = set() # Множество для хранения уникальных идентификаторов
         
         # Определяем язык поиска
-        is_russian_search = any(char in normalized_title for char in "абвгдежзийклмнопрстуфхцчшщъыьэюя") 
+        is_russian_search = bool(CYRILLIC_RE.search(normalized_title))
 
         # Формируем кнопки для каждой найденной дорамы
         for row in results_title:
@@ -1451,15 +2814,15 @@ async def fetch_doramas_by_title_page(update: Update, context: ContextTypes.DEFA
                 button = InlineKeyboardButton(button_text, callback_data=f"show_dorama:{dorama_id}")
                 keyboard.append([button])  # Добавляем кнопку в список
 
-                logger.info(f"dorama_id: {dorama_id}, title_ru: {normalized_title_ru}, title_en: {title_en}, button_text: {button_text}")
+                click_logger.debug("dorama_id: %s, title_ru: %s, title_en: %s, button_text: %s", dorama_id, normalized_title_ru, title_en, button_text)
 
         # Добавляем кнопки пагинации
         keyboard.extend(create_pagination_buttons("title", page, total_results_title).inline_keyboard)
-        logger.info(f"Сформированная клавиатура перед отправкой: {keyboard}")
+        click_logger.debug("Сформированная клавиатура перед отправкой: %s", keyboard)
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        logger.info(f"Текст сообщения: {response}")
-        logger.info(f"Клавиатура: {reply_markup}")                
+        click_logger.debug("Текст сообщения: %s", response)
+        click_logger.debug("Клавиатура: %s", reply_markup)                
         
         # Отправляем результат
         if query:
@@ -1480,8 +2843,8 @@ async def fetch_doramas_by_title_page(update: Update, context: ContextTypes.DEFA
         
         return HANDLE_PAGINATION  # Продолжаем обработку пагинации
     
-    except aiosqlite.Error as e:
-        logger.error(f"Ошибка базы данных: {e}")
+    except Exception as e:
+        logger.error("Ошибка при поиске по названию: %s", e)
         logger.exception(e)  
 
         error_message = "⚠️ Произошла ошибка при поиске дорамы."
@@ -1501,6 +2864,258 @@ async def fetch_doramas_by_title_page(update: Update, context: ContextTypes.DEFA
         return ConversationHandler.END  
 
 
+# ======== Инлайн-режим: @бот <название> в любом чате ==========
+# Готовые ответы по ключу запроса, самые давние вытесняются; при изменении каталога сбрасываются
+inline_result_cache: OrderedDict[str, list] = OrderedDict()
+
+def inline_poster_thumbnail(poster_url):
+    # Страница Яндекс.Диска — не картинка, миниатюрой её показать нельзя
+    if poster_url and poster_url.startswith("https://") and not poster_url.startswith("https://disk.yandex.ru/"):
+        return poster_url
+    return None
+
+async def build_inline_results(text: str) -> list:
+    await wait_for_catalog()
+    dorama_ids = title_index.search(text, limit=INLINE_RESULTS_LIMIT) or title_index.suggest(text, limit=INLINE_RESULTS_LIMIT)
+    if not dorama_ids:
+        return []
+
+    placeholders = ", ".join("?" for _ in dorama_ids)
+    async with connect_db(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            f"SELECT {CARD_COLUMNS}, rendered_card FROM doramas WHERE id IN ({placeholders})",
+            dorama_ids
+        ) as cursor:
+            rows = {row['id']: row for row in await cursor.fetchall()}
+
+    results = []
+    for dorama_id in dorama_ids:  # Порядок — как у индекса, от самых похожих
+        row = rows.get(dorama_id)
+        if row is None:
+            continue
+        results.append(InlineQueryResultArticle(
+            id=str(dorama_id),
+            title=f"{row['title_ru']} ({row['year']})",
+            description=f"{row['title_en']} {COUNTRY_FLAGS.get(row['country'], '🌍')}",
+            thumbnail_url=inline_poster_thumbnail(row['poster_url']),
+            input_message_content=InputTextMessageContent(fit_dorama_card(row), parse_mode="Markdown"),
+        ))
+    return results
+
+async def inline_catalog_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    key = transliterate(inline_query.query)
+    if not key:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    try:
+        results = inline_result_cache.get(key)
+        if results is None:
+            results = await build_inline_results(inline_query.query)
+            inline_result_cache[key] = results
+            if len(inline_result_cache) > INLINE_CACHE_SIZE:
+                inline_result_cache.popitem(last=False)
+        else:
+            inline_result_cache.move_to_end(key)
+
+        # Ответ одинаков для всех пользователей — пусть Telegram тоже кеширует его для всех
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+    except Exception as e:
+        logger.error("Ошибка при инлайн-поиске '%s': %s", inline_query.query, e, exc_info=True)
+
+
+# ======== Индекс имён для автодополнения ==========
+class PeopleIndex:
+    """Имена актёров, актрис и режиссёров с числом дорам — в отсортированных массивах.
+
+    Поиск по префиксу фонетического ключа — bisect, ранжирование — по числу дорам,
+    поэтому подсказки и первый список выбора не обращаются к БД. Для коротких
+    префиксов, под которые подходят тысячи имён, top-k хранится готовым.
+    """
+    __slots__ = ("_keys", "_counts", "_countries", "_top")
+
+    def __init__(self):
+        # поле -> [(ключ, имя)] по возрастанию ключа
+        self._keys: dict[str, list[tuple[str, str]]] = {field: [] for field in PEOPLE_FIELDS}
+        # (поле, имя) -> число дорам и страны этих дорам (показывается самая частая)
+        self._counts: dict[tuple[str, str], int] = {}
+        self._countries: dict[tuple[str, str], Counter] = {}
+        # (поле, префикс ключа до PEOPLE_TOP_PREFIX символов) -> INLINE_PEOPLE_LIMIT самых популярных имён
+        self._top: dict[tuple[str, str], list[str]] = {}
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _forget_top(self, field, name):
+        # Число дорам изменилось — готовые top-k по префиксам этого имени устарели
+        for key in name_suffix_keys(name):
+            for length in range(1, PEOPLE_TOP_PREFIX + 1):
+                self._top.pop((field, key[:length]), None)
+
+    def add(self, field, name, country):
+        if not name:
+            return
+        person = (field, name)
+        count = self._counts.get(person, 0)
+        self._counts[person] = count + 1
+        self._forget_top(field, name)
+        if count:
+            self._countries[person][country] += 1
+            return
+        self._countries[person] = Counter((country,))
+        for key in name_suffix_keys(name):
+            bisect.insort(self._keys[field], (key, name))
+
+    def load(self, rows):
+        """Массовое заполнение из строк (director, lead_actress, lead_actor, country)."""
+        for director, lead_actress, lead_actor, country in rows:
+            for field, name in zip(PEOPLE_FIELDS, (lead_actor, lead_actress, director)):
+                if not name:
+                    continue
+                person = (field, name)
+                if person not in self._counts:
+                    self._countries[person] = Counter()
+                    self._keys[field].extend((key, name) for key in name_suffix_keys(name))
+                self._counts[person] = self._counts.get(person, 0) + 1
+                self._countries[person][country] += 1
+
+        # Сортируем один раз и сразу считаем top-k для всех коротких префиксов
+        for field, keys in self._keys.items():
+            keys.sort()
+            buckets = {}
+            for key, name in keys:
+                for length in range(1, min(len(key), PEOPLE_TOP_PREFIX) + 1):
+                    buckets.setdefault(key[:length], set()).add(name)
+            for prefix, names in buckets.items():
+                self._top[(field, prefix)] = self._ranked(field, names, INLINE_PEOPLE_LIMIT)
+
+    def country(self, field, name):
+        """Страна, в которой у человека больше всего дорам (при равенстве — добавленная раньше)."""
+        countries = self._countries[(field, name)]
+        return max(countries, key=countries.__getitem__) if countries else None
+
+    def count(self, field, name):
+        """Число дорам у человека с точно таким именем (0 — такого имени в каталоге нет)."""
+        return self._counts.get((field, name), 0)
+
+    def remove(self, field, name, country):
+        person = (field, name)
+        count = self._counts.get(person)
+        if not count:
+            return
+        self._forget_top(field, name)
+        if count > 1:
+            self._counts[person] = count - 1
+            countries = self._countries[person]
+            countries[country] -= 1
+            if countries[country] <= 0:
+                del countries[country]
+            return
+        del self._counts[person], self._countries[person]
+        keys = self._keys[field]
+        for key in name_suffix_keys(name):
+            i = bisect.bisect_left(keys, (key, name))
+            if i < len(keys) and keys[i] == (key, name):
+                del keys[i]
+
+    def replace_with(self, other):
+        """Подменяет содержимое индекса целиком (после полной перестройки)."""
+        self._keys, self._counts, self._countries, self._top = other._keys, other._counts, other._countries, other._top
+
+    def _ranked(self, field, names, limit=None):
+        rank = lambda name: (-self._counts[(field, name)], name)
+        return heapq.nsmallest(limit, names, key=rank) if limit else sorted(names, key=rank)
+
+    def _scan(self, field, prefix):
+        keys = self._keys.get(field, ())
+        names = set()
+        i = bisect.bisect_left(keys, (prefix,))
+        while i < len(keys) and keys[i][0].startswith(prefix):
+            names.add(keys[i][1])
+            i += 1
+        return names
+
+    def matches(self, field, text):
+        """Имена, в которых какое-то слово начинается так же, как запрос (в любом алфавите)."""
+        names = set()
+        for variant in name_key_variants(text):
+            names.update(self._scan(field, variant))
+        return names
+
+    def search(self, field, text, limit=None):
+        """[(имя, страна, число дорам)] — самые популярные первыми."""
+        if limit and limit <= INLINE_PEOPLE_LIMIT:
+            # top-k объединения входит в объединение top-k по каждому варианту ключа
+            names = set()
+            for variant in name_key_variants(text):
+                if len(variant) > PEOPLE_TOP_PREFIX:
+                    names.update(self._scan(field, variant))
+                    continue
+                top = self._top.get((field, variant))
+                if top is None:
+                    top = self._top[(field, variant)] = self._ranked(field, self._scan(field, variant), INLINE_PEOPLE_LIMIT)
+                names.update(top)
+        else:
+            names = self.matches(field, text)
+        return [
+            (name, self.country(field, name), self._counts[(field, name)])
+            for name in self._ranked(field, names, limit)
+        ]
+
+people_index = PeopleIndex()
+
+# ======== Строим индекс имён по всей таблице ==========
+async def build_people_index():
+    started = time.perf_counter()
+    async with connect_db(DB_PATH) as db:
+        async with db.execute("SELECT director, lead_actress, lead_actor, country FROM doramas") as cursor:
+            rows = await cursor.fetchall()
+    index = PeopleIndex()
+    await asyncio.to_thread(index.load, rows)  # Новый объект никто не видит до replace_with: строим вне цикла событий
+    people_index.replace_with(index)
+    search_logger.info("Индекс имён построен: %s человек за %.3f с.", len(people_index), time.perf_counter() - started)
+
+def add_people_to_index(director, lead_actress, lead_actor, country):
+    for field, name in zip(PEOPLE_FIELDS, (lead_actor, lead_actress, director)):
+        people_index.add(field, name, country)
+
+def remove_people_from_index(director, lead_actress, lead_actor, country):
+    for field, name in zip(PEOPLE_FIELDS, (lead_actor, lead_actress, director)):
+        people_index.remove(field, name, country)
+
+async def fetch_people(field: str, name: str, page: int) -> list:
+    """Страница (имя, страна) для выбора человека — из people_index, самые популярные первыми."""
+    await wait_for_catalog()
+    start_index = page * PAGE_SIZE
+    people = people_index.search(field, name, limit=start_index + PAGE_SIZE)[start_index:]
+    return [(person, country) for person, country, _ in people]
+
+async def count_people(field: str, name: str) -> int:
+    await wait_for_catalog()
+    return len(people_index.matches(field, name))
+
+# ======== Инлайн-подсказки имён: @бот актёр|актриса|режиссёр <начало имени> ==========
+async def inline_people_autocomplete(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await wait_for_catalog()
+    inline_query = update.inline_query
+    prefix, _, text = inline_query.query.partition(" ")
+    field = INLINE_PEOPLE_PREFIXES.get(prefix.lower())
+
+    results = []
+    if field and text.strip():
+        for i, (name, country, count) in enumerate(people_index.search(field, text, limit=INLINE_PEOPLE_LIMIT)):
+            # Выбранное имя уходит в чат обычным сообщением и попадает в открытый поиск
+            results.append(InlineQueryResultArticle(
+                id=str(i),
+                title=name,
+                description=f"{COUNTRY_FLAGS.get(country, '🌍')} Дорам в каталоге: {count}",
+                input_message_content=InputTextMessageContent(name),
+            ))
+
+    await inline_query.answer(results, cache_time=INLINE_PEOPLE_CACHE_TIME)
+
 # ФУНКЦИЯ ПОИСКА ПО АКТЁРУ
 # Сразу создадим клавиатуру
 def create_actor_keyboard(actors, actor_names_with_flags, total_actors, page=0):
@@ -1522,26 +3137,26 @@ async def search_by_actor(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         query = update.callback_query
         await query.answer()    
     
-        logger.info("Обработчик search_by_actor вызван!")
+        search_logger.debug("Обработчик search_by_actor вызван!")
     
-        reply_markup = create_cancel_keyboard()
+        reply_markup = create_people_prompt_keyboard("актёр")
     
         await query.edit_message_text(
-            "*🔎 Введите имя или фамилию актёра с заглавной буквы на русском языке:*", 
+            "*🔎 Введите имя или фамилию актёра на русском или английском языке:*", 
             reply_markup=reply_markup, 
             parse_mode='Markdown'
         )
 
         # Сбрасываем текущий поиск перед новым вводом
         context.user_data.clear()  # Очистка перед новым поиском    
-        logger.info("Контекст очищен. Начинаем новый поиск по названию.")
+        search_logger.debug("Контекст очищен. Начинаем новый поиск по названию.")
     
         # Устанавливаем тип поиска
         context.user_data['search_type'] = 'actor'
         return SEARCH_ACTOR
     
     except Exception as e:
-        logger.error(f"Ошибка в search_by_title: {e}")
+        logger.error("Ошибка в search_by_title: %s", e)
         await update.callback_query.answer()
         await update.callback_query.edit_message_text("⚠️ Произошла ошибка при обработке поиска.", reply_markup=back_button)
         return ConversationHandler.END
@@ -1551,7 +3166,7 @@ async def search_by_actor(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_search_by_actor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message:
         actor_name = update.message.text.strip()
-        logger.info(f"🔍 handle_search_by_actor вызван! Пользователь ввёл: {actor_name}")
+        search_logger.debug("🔍 handle_search_by_actor вызван! Пользователь ввёл: %s", actor_name)
         
         if not actor_name:
             await update.message.reply_text(
@@ -1565,8 +3180,11 @@ async def handle_search_by_actor(update: Update, context: ContextTypes.DEFAULT_T
         try:
             actors = await fetch_actors_from_db(actor_name, 0)
             total_actors = await get_total_actors(actor_name)
-            
-            if actors:
+
+            if total_actors == 1:
+                # Имя однозначное (например, выбрано из подсказок) — список выбора не нужен
+                actor_name = actors[0][0]
+            elif actors:
                 actor_names_with_flags = [
                     f"{actor[0]} {COUNTRY_FLAGS.get(actor[1], '🌍')}"
                     for actor in actors
@@ -1581,11 +3199,10 @@ async def handle_search_by_actor(update: Update, context: ContextTypes.DEFAULT_T
                 return CHOOSE_ACTOR
             
             # Если найдено только одно имя, показываем его дорамы
-            actor_name_without_flags = re.sub(r'[^\w\s]', '', actor_name)
-            await show_doramas_by_actor(update, context, actor_name_without_flags)
+            await show_doramas_by_actor(update, context, actor_name)
         
         except Exception as e:
-            logger.error(f"⚠️ Ошибка при поиске: {e}", exc_info=True)
+            logger.error("⚠️ Ошибка при поиске: %s", e, exc_info=True)
             await update.message.reply_text(
             f"⚠️ Произошла ошибка. Попробуйте позже. Детали: {e}", 
                 reply_markup=InlineKeyboardMarkup([
@@ -1598,22 +3215,11 @@ async def handle_search_by_actor(update: Update, context: ContextTypes.DEFAULT_T
 
 #  Получаем список актёров по имени актёра с пагинацией
 async def fetch_actors_from_db(actor_name: str, page: int) -> list:
-    start_index = page * PAGE_SIZE
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT DISTINCT lead_actor, country FROM doramas WHERE lead_actor LIKE ? LIMIT ?, ?",
-            (f"%{actor_name}%", start_index, PAGE_SIZE)
-        ) as cursor:
-            return await cursor.fetchall() 
+    return await fetch_people("lead_actor", actor_name, page)
 
 # Получаем общее количество актёров для пагинации
 async def get_total_actors(actor_name: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT COUNT(DISTINCT lead_actor) FROM doramas WHERE lead_actor LIKE ?",
-            (f"%{actor_name}%",)
-        ) as cursor:
-            return (await cursor.fetchone())[0]
+    return await count_people("lead_actor", actor_name)
 
 async def show_actors_list(update: Update, context: ContextTypes.DEFAULT_TYPE, actor_name: str, page: int) -> int:
     try:
@@ -1641,7 +3247,7 @@ async def show_actors_list(update: Update, context: ContextTypes.DEFAULT_TYPE, a
             await update.callback_query.message.edit_text("Актёры не найдены.")
     
     except Exception as e:
-        logger.error(f"Ошибка при получении списка актёров: {e}")
+        logger.error("Ошибка при получении списка актёров: %s", e)
         await update.callback_query.message.edit_text("Произошла ошибка при поиске актёров.")
     
     return CHOOSE_ACTOR        
@@ -1662,30 +3268,17 @@ async def handle_choose_actor(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return ConversationHandler.END
 
-    # Удаляем флаг из имени актёра
-    actor_name_without_flags = re.sub(r'[^\w\s]', '', actor_name)
+    # В callback_data имя без флага, ровно как в каталоге: по нему ищем точным совпадением
 
     # Показываем дорамы выбранного актёра с пагинацией
-    return await show_doramas_by_actor(update, context, actor_name_without_flags)
+    return await show_doramas_by_actor(update, context, actor_name)
 
 # Выводим список дорам по актёру
 async def show_doramas_by_actor(update: Update, context: ContextTypes.DEFAULT_TYPE, actor_name: str, page: int = 0) -> int:
     query = update.callback_query  
-    start_index = page * PAGE_SIZE 
     
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute(
-                "SELECT id, title_ru, country, year FROM doramas WHERE LOWER(lead_actor) LIKE LOWER(?) LIMIT ?, ?", 
-                ('%' + actor_name.strip() + '%', start_index, PAGE_SIZE)
-            ) as cursor:
-                results = await cursor.fetchall()
-                
-            async with db.execute(
-                "SELECT COUNT(*) FROM doramas WHERE LOWER(lead_actor) LIKE LOWER(?)", 
-                ('%' + actor_name.strip() + '%',)
-            ) as cursor:
-                total_doramas = (await cursor.fetchone())[0]
+        results, total_doramas = await run_dorama_query(DoramaQuery(people={"lead_actor": actor_name}), page, order_by="d.id")
                 
         # Сохраняем имя актёра и общее число дорам для пагинации
         context.user_data['search_actor_name'] = actor_name
@@ -1737,7 +3330,7 @@ async def show_doramas_by_actor(update: Update, context: ContextTypes.DEFAULT_TY
 
     except Exception as e:
         logger.error(
-            f"⚠️ Ошибка при поиске дорам по актёру: {e}", 
+            "⚠️ Ошибка при поиске дорам по актёру: %s", e,
             exc_info=True
         )
         await update.message.reply_text(
@@ -1771,26 +3364,26 @@ async def search_by_actress(update: Update, context: ContextTypes.DEFAULT_TYPE)
         query = update.callback_query
         await query.answer()    
     
-        logger.info("Обработчик search_by_actress вызван!")
+        search_logger.debug("Обработчик search_by_actress вызван!")
     
-        reply_markup = create_cancel_keyboard()
+        reply_markup = create_people_prompt_keyboard("актриса")
     
         await query.edit_message_text(
-            "*🔎 Введите имя или фамилию актрисы с заглавной буквы на русском языке:*", 
+            "*🔎 Введите имя или фамилию актрисы на русском или английском языке:*", 
             reply_markup=reply_markup, 
             parse_mode='Markdown'
         )
 
         # Сбрасываем текущий поиск перед новым вводом
         context.user_data.clear()  # Очистка перед новым поиском    
-        logger.info("Контекст очищен. Начинаем новый поиск по названию.")
+        search_logger.debug("Контекст очищен. Начинаем новый поиск по названию.")
     
         # Устанавливаем тип поиска
         context.user_data['search_type'] = 'actress'
         return SEARCH_ACTRESS
     
     except Exception as e:
-        logger.error(f"Ошибка в search_by_title: {e}")
+        logger.error("Ошибка в search_by_title: %s", e)
         await update.callback_query.answer()
         await update.callback_query.edit_message_text(
             "⚠️ Произошла ошибка при обработке поиска.", 
@@ -1805,7 +3398,7 @@ async def search_by_actress(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def handle_search_by_actress(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message:
         actress_name = update.message.text.strip()
-        logger.info(f"🔍 handle_search_by_actress вызван! Пользователь ввёл: {actress_name}")
+        search_logger.debug("🔍 handle_search_by_actress вызван! Пользователь ввёл: %s", actress_name)
         
         if not actress_name:
             await update.message.reply_text(
@@ -1822,8 +3415,11 @@ async def handle_search_by_actress(update: Update, context: ContextTypes.DEFAULT
         try:
             actresses = await fetch_actresses_from_db(actress_name, 0)
             total_actresses = await get_total_actresses(actress_name)
-            
-            if actresses:
+
+            if total_actresses == 1:
+                # Имя однозначное (например, выбрано из подсказок) — список выбора не нужен
+                actress_name = actresses[0][0]
+            elif actresses:
                 actress_names_with_flags = [
                     f"{actress[0]} {COUNTRY_FLAGS.get(actress[1], '🌍')}"
                     for actress in actresses
@@ -1838,12 +3434,11 @@ async def handle_search_by_actress(update: Update, context: ContextTypes.DEFAULT
                 return CHOOSE_ACTRESS
             
             # Если найдено только одно имя, показываем его дорамы
-            actress_name_without_flags = re.sub(r'[^\w\s]', '', actress_name)
-            await show_doramas_by_actress(update, context, actress_name_without_flags)
+            await show_doramas_by_actress(update, context, actress_name)
         
         except Exception as e:
             logger.error(
-                f"⚠️ Ошибка при поиске: {e}", 
+                "⚠️ Ошибка при поиске: %s", e,
                 exc_info=True
             )
             await update.message.reply_text(
@@ -1858,22 +3453,11 @@ async def handle_search_by_actress(update: Update, context: ContextTypes.DEFAULT
 
 # Получаем список актрис по имени актрисы с пагинацией
 async def fetch_actresses_from_db(actress_name: str, page: int) -> list:
-    start_index = page * PAGE_SIZE
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT DISTINCT lead_actress, country FROM doramas WHERE lead_actress LIKE ? LIMIT ?, ?",
-            (f"%{actress_name}%", start_index, PAGE_SIZE)
-        ) as cursor:
-            return await cursor.fetchall() 
+    return await fetch_people("lead_actress", actress_name, page)
 
 # Получаем общее количество актрис для пагинации
 async def get_total_actresses(actress_name: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT COUNT(DISTINCT lead_actress) FROM doramas WHERE lead_actress LIKE ?",
-            (f"%{actress_name}%",)
-        ) as cursor:
-            return (await cursor.fetchone())[0]
+    return await count_people("lead_actress", actress_name)
 
 #  Функция для отображения списка актрис с пагинацией
 async def show_actresses_list(update: Update, context: ContextTypes.DEFAULT_TYPE, actress_name: str, page: int) -> int:
@@ -1902,7 +3486,7 @@ async def show_actresses_list(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.callback_query.message.edit_text("Актрисы не найдены.")
     
     except Exception as e:
-        logger.error(f"Ошибка при получении списка актрис: {e}")
+        logger.error("Ошибка при получении списка актрис: %s", e)
         await update.callback_query.message.edit_text("Произошла ошибка при поиске актрис.")
     
     return CHOOSE_ACTRESS
@@ -1920,30 +3504,17 @@ async def handle_choose_actress(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return ConversationHandler.END
 
-    # Удаляем флаг из имени актрисы
-    actress_name_without_flags = re.sub(r'[^\w\s]', '', actress_name)
+    # В callback_data имя без флага, ровно как в каталоге: по нему ищем точным совпадением
 
     # Показываем дорамы выбранной актрисы с пагинацией
-    return await show_doramas_by_actress(update, context, actress_name_without_flags)
+    return await show_doramas_by_actress(update, context, actress_name)
 
 # Выводит список дорам по актрисе
 async def show_doramas_by_actress(update: Update, context: ContextTypes.DEFAULT_TYPE, actress_name: str, page: int = 0) -> int:
     query = update.callback_query  
-    start_index = page * PAGE_SIZE 
     
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute(
-                "SELECT id, title_ru, country, year FROM doramas WHERE LOWER(lead_actress) LIKE LOWER(?) LIMIT ?, ?", 
-                ('%' + actress_name.strip() + '%', start_index, PAGE_SIZE)
-            ) as cursor:
-                results = await cursor.fetchall()
-                
-            async with db.execute(
-                "SELECT COUNT(*) FROM doramas WHERE LOWER(lead_actress) LIKE LOWER(?)", 
-                ('%' + actress_name.strip() + '%',)
-            ) as cursor:
-                total_doramas = (await cursor.fetchone())[0]
+        results, total_doramas = await run_dorama_query(DoramaQuery(people={"lead_actress": actress_name}), page, order_by="d.id")
                 
         # Сохраняем имя актрисы и общее число дорам для пагинации
         context.user_data['search_actress_name'] = actress_name
@@ -1996,7 +3567,7 @@ async def show_doramas_by_actress(update: Update, context: ContextTypes.DEFAULT_
 
     except Exception as e:
         logger.error(
-            f"⚠️ Ошибка при поиске дорам по актрисе: {e}", 
+            "⚠️ Ошибка при поиске дорам по актрисе: %s", e,
             exc_info=True
         )
         await update.message.reply_text(
@@ -2026,26 +3597,26 @@ async def search_by_director(update: Update, context: ContextTypes.DEFAULT_TYPE)
         query = update.callback_query
         await query.answer()    
     
-        logger.info("Обработчик search_by_director вызван!")
+        search_logger.debug("Обработчик search_by_director вызван!")
     
-        reply_markup = create_cancel_keyboard()
+        reply_markup = create_people_prompt_keyboard("режиссёр")
     
         await query.edit_message_text(
-            "*🔎 Введите имя или фамилию режиссёра с заглавной буквы на русском языке:*", 
+            "*🔎 Введите имя или фамилию режиссёра на русском или английском языке:*", 
             reply_markup=reply_markup, 
             parse_mode='Markdown'
         )
 
         # Сбрасываем текущий поиск перед новым вводом
         context.user_data.clear()  # Очистка перед новым поиском    
-        logger.info("Контекст очищен. Начинаем новый поиск по названию.")
+        search_logger.debug("Контекст очищен. Начинаем новый поиск по названию.")
     
         # Устанавливаем тип поиска
         context.user_data['search_type'] = 'director'
         return SEARCH_DIRECTOR
     
     except Exception as e:
-        logger.error(f"Ошибка в search_by_title: {e}")
+        logger.error("Ошибка в search_by_title: %s", e)
         await update.callback_query.answer()
         await update.callback_query.edit_message_text(
             "⚠️ Произошла ошибка при обработке поиска.",
@@ -2061,7 +3632,7 @@ async def search_by_director(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def handle_search_by_director(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message:
         director_name = update.message.text.strip()
-        logger.info(f"🔍 handle_search_by_director вызван! Пользователь ввёл: {director_name}")
+        search_logger.debug("🔍 handle_search_by_director вызван! Пользователь ввёл: %s", director_name)
         
         if not director_name:
             await update.message.reply_text(
@@ -2078,8 +3649,11 @@ async def handle_search_by_director(update: Update, context: ContextTypes.DEFAUL
         try:
             directors = await fetch_directors_from_db(director_name, 0)
             total_directors = await get_total_directors(director_name)
-            
-            if directors:
+
+            if total_directors == 1:
+                # Имя однозначное (например, выбрано из подсказок) — список выбора не нужен
+                director_name = directors[0][0]
+            elif directors:
                 director_names_with_flags = [
                     f"{director[0]} {COUNTRY_FLAGS.get(director[1], '🌍')}"
                     for director in directors
@@ -2094,11 +3668,10 @@ async def handle_search_by_director(update: Update, context: ContextTypes.DEFAUL
                 return CHOOSE_DIRECTOR
             
             # Если найдено только одно имя, показываем его дорамы
-            director_name_without_flags = re.sub(r'[^\w\s]', '', director_name)
-            await show_doramas_by_director(update, context, director_name_without_flags)
+            await show_doramas_by_director(update, context, director_name)
         
         except Exception as e:
-            logger.error(f"⚠️ Ошибка при поиске: {e}", exc_info=True)
+            logger.error("⚠️ Ошибка при поиске: %s", e, exc_info=True)
             await update.message.reply_text(
                 f"⚠️ Произошла ошибка. Попробуйте позже. Детали: {e}", 
                 reply_markup=InlineKeyboardMarkup([
@@ -2111,22 +3684,11 @@ async def handle_search_by_director(update: Update, context: ContextTypes.DEFAUL
 
 # Получаем список режиссёров по имени режиссёра с пагинацией
 async def fetch_directors_from_db(director_name: str, page: int) -> list:
-    start_index = page * PAGE_SIZE
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT DISTINCT director, country FROM doramas WHERE director LIKE ? LIMIT ?, ?",
-            (f"%{director_name}%", start_index, PAGE_SIZE)
-        ) as cursor:
-            return await cursor.fetchall() 
+    return await fetch_people("director", director_name, page)
 
 # Получаем общее количество режиссёров для пагинации
 async def get_total_directors(director_name: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT COUNT(DISTINCT director) FROM doramas WHERE director LIKE ?",
-            (f"%{director_name}%",)
-        ) as cursor:
-            return (await cursor.fetchone())[0]
+    return await count_people("director", director_name)
         
 # Функция для отображения списка режиссёров с пагинацией
 async def show_directors_list(update: Update, context: ContextTypes.DEFAULT_TYPE, director_name: str, page: int) -> int:
@@ -2155,7 +3717,7 @@ async def show_directors_list(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.callback_query.message.edit_text("Режиссёры не найдены.")
     
     except Exception as e:
-        logger.error(f"Ошибка при получении списка режиссёров: {e}")
+        logger.error("Ошибка при получении списка режиссёров: %s", e)
         await update.callback_query.message.edit_text("Произошла ошибка при поиске режиссёров.")
     
     return CHOOSE_DIRECTOR
@@ -2176,31 +3738,18 @@ async def handle_choose_director(update: Update, context: ContextTypes.DEFAULT_T
         )
         return ConversationHandler.END
 
-    # Удаляем флаг из имени режиссёра
-    director_name_without_flags = re.sub(r'[^\w\s]', '', director_name)
+    # В callback_data имя без флага, ровно как в каталоге: по нему ищем точным совпадением
 
     # Показываем дорамы выбранного режиссёра с пагинацией
-    return await show_doramas_by_director(update, context, director_name_without_flags)
+    return await show_doramas_by_director(update, context, director_name)
 
 
 # Выводит список дорам по режиссёру
 async def show_doramas_by_director(update: Update, context: ContextTypes.DEFAULT_TYPE, director_name: str, page: int = 0) -> int:
     query = update.callback_query  
-    start_index = page * PAGE_SIZE 
     
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute(
-                "SELECT id, title_ru, country, year FROM doramas WHERE LOWER(director) LIKE LOWER(?) LIMIT ?, ?", 
-                ('%' + director_name.strip() + '%', start_index, PAGE_SIZE)
-            ) as cursor:
-                results = await cursor.fetchall()
-                
-            async with db.execute(
-                "SELECT COUNT(*) FROM doramas WHERE LOWER(director) LIKE LOWER(?)", 
-                ('%' + director_name.strip() + '%',)
-            ) as cursor:
-                total_doramas = (await cursor.fetchone())[0]
+        results, total_doramas = await run_dorama_query(DoramaQuery(people={"director": director_name}), page, order_by="d.id")
                 
         # Сохраняем имя режиссёра и общее число дорам для пагинации
         context.user_data['search_director_name'] = director_name
@@ -2252,7 +3801,7 @@ async def show_doramas_by_director(update: Update, context: ContextTypes.DEFAULT
         return ConversationHandler.END
 
     except Exception as e:
-        logger.error(f"⚠️ Ошибка при поиске дорам по режиссёру: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при поиске дорам по режиссёру: %s", e, exc_info=True)
         await update.message.reply_text(
             "⚠️ Произошла ошибка при поиске дорам. Попробуйте позже.",
             reply_markup=InlineKeyboardMarkup([
@@ -2299,9 +3848,9 @@ async def list_doramas_menu(update, context):
 
 # ========  Функция для получения общего количества дорам ======== 
 async def get_total_doramas_count():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT COUNT(*) FROM doramas") as cursor:
-            return (await cursor.fetchone())[0]
+    # COUNT(*) перебирает весь индекс — число дорам и так поддерживается в catalog_stats
+    await wait_for_catalog()
+    return catalog_stats.total
 
 # ========  Функция для выбора языка ======== 
 async def handle_language_choice(update, context): 
@@ -2344,18 +3893,15 @@ async def list_doramas_by_letter(update, context):
     # Инициализация текущей страницы
     initialize_page(context, "letter_page")
 
-    language = context.user_data.get("language", "ru")
-    column = "title_ru" if language == "ru" else "title_en"
+    language = "ru" if context.user_data.get("language", "ru") == "ru" else "en"
     prompt = "*Выберите первую букву названия: 🇷🇺*" if language == "ru" else "*Выберите первую букву названия: 🇬🇧*"
     
-    # Подключение к базе данных
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получение доступных букв
-        async with db.execute(f"SELECT DISTINCT substr({column}, 1, 1) FROM doramas WHERE {column} IS NOT NULL") as cursor:
-            available_letters = [row[0] for row in await cursor.fetchall()]
-
-    # Приведение к нижнему регистру для правильного сравнения
-    available_letters = list(set(letter.upper() for letter in available_letters if letter.strip()))
+    # Доступные буквы — из catalog_stats: SELECT DISTINCT substr(...) перебирал бы весь индекс
+    await wait_for_catalog()
+    available_letters = [
+        letter for (letters_language, letter), count in catalog_stats.letters.items()
+        if letters_language == language and count > 0 and letter.strip()
+    ]
 
     if language == "ru":
         russian_alphabet = "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
@@ -2402,36 +3948,15 @@ async def show_doramas_by_letter(update, context):
     else:
         letter = context.user_data["selected_letter"]
 
-    # Подключение к базе данных
-    column = "title_ru" if context.user_data.get("language", "ru") == "ru" else "title_en"
-    
-    async with aiosqlite.connect(DB_PATH) as db:
-        if letter.upper() in ['T', 'A']:
-            async with db.execute(f"""
-                SELECT id, {column}, country 
-                FROM doramas 
-                WHERE 
-                    ({column} LIKE ? AND {column} NOT LIKE 'The %' AND {column} NOT LIKE 'A %') 
-                    OR 
-                    ({column} LIKE 'The %' AND SUBSTR({column}, 5, 1) = ?) 
-                    OR 
-                    ({column} LIKE 'A %' AND SUBSTR({column}, 2, 1) = ?)
-                ORDER BY {column}
-            """, (letter + "%", letter.upper(), letter.upper())) as cursor:
-                rows = await cursor.fetchall()
-        else:
-            async with db.execute(f"""
-                SELECT id, {column}, country 
-                FROM doramas 
-                WHERE 
-                    ({column} LIKE ?) 
-                    OR 
-                    ({column} LIKE 'The %' AND SUBSTR({column}, 5, 1) = ?) 
-                    OR 
-                    ({column} LIKE 'A %' AND SUBSTR({column}, 2, 1) = ?)
-                ORDER BY {column}
-            """, (letter + "%", letter.upper(), letter.upper())) as cursor:
-                rows = await cursor.fetchall()
+    # Пагинация дорам по букве
+    initialize_page(context, "letter_doramas_page")
+    language = context.user_data.get("language", "ru")
+    column = "title_ru" if language == "ru" else "title_en"
+
+    rows, total = await run_dorama_query(
+        DoramaQuery(letter=letter, language=language), context.user_data["letter_doramas_page"],
+        columns=f"d.id, d.{column}, d.country", order_by=f"d.{column}"
+    )
 
     if not rows:
         try:
@@ -2446,21 +3971,15 @@ async def show_doramas_by_letter(update, context):
         return
 
 
-    # Пагинация дорам по букве
-    initialize_page(context, "letter_doramas_page")
-
-    start, end = context.user_data["letter_doramas_page"] * PAGE_SIZE, (context.user_data["letter_doramas_page"] + 1) * PAGE_SIZE
-    rows_to_show = rows[start:end]
-
     keyboard = [
         [InlineKeyboardButton(f"{row[1]} {COUNTRY_FLAGS.get(row[2], '🌍')}", callback_data=f"show_dorama:{row[0]}")] 
-        for row in rows_to_show
+        for row in rows
     ]
 
     pagination_buttons = []
     if context.user_data["letter_doramas_page"] > 0:
         pagination_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data="letter_doramas_page_back"))
-    if len(rows) > (context.user_data["letter_doramas_page"] + 1) * PAGE_SIZE:
+    if total > (context.user_data["letter_doramas_page"] + 1) * PAGE_SIZE:
         pagination_buttons.append(InlineKeyboardButton("➡️ Вперед", callback_data="letter_doramas_page_next"))
 
     if pagination_buttons:
@@ -2476,7 +3995,7 @@ async def show_doramas_by_letter(update, context):
     try:
 
 
-        await query.edit_message_text(f"Дорамы на букву {letter} (Всего: {len(rows)}):", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(f"Дорамы на букву {letter} (Всего: {total}):", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
     except telegram.error.BadRequest as e:
@@ -2505,13 +4024,9 @@ async def list_doramas_by_rating(update, context):
 
     initialize_page(context, "rating_page")
 
-    # Получение списка рейтингов
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT DISTINCT personal_rating FROM doramas ORDER BY personal_rating DESC") as cursor:
-        
-            rows = await cursor.fetchall()
-            
-    ratings = [str(row[0]) for row in rows if row[0] is not None]
+    # Получение списка рейтингов (из catalog_stats, без перебора индекса)
+    await wait_for_catalog()
+    ratings = [str(rating) for rating, count in sorted(catalog_stats.ratings.items(), reverse=True) if count > 0]
 
     # Формируем клавиатуру для рейтингов, добавляем звездочку к каждому рейтингу
     keyboard = [
@@ -2547,37 +4062,27 @@ async def show_doramas_by_rating(update, context):
     else:
         rating = context.user_data["selected_rating"]
 
-    # Получаем количество дорам с этим рейтингом
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT COUNT(*) FROM doramas WHERE personal_rating = ?", (rating,)) as cursor:
-            count_row = await cursor.fetchone()
-            count = count_row[0] if count_row else 0
+    # Пагинация дорам по рейтингу
+    initialize_page(context, "rating_doramas_page")
 
-    # Получаем дорамы с этим рейтингом
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT id, title_ru, country FROM doramas WHERE personal_rating = ? ORDER BY title_ru", (rating,)) as cursor:
-            rows = await cursor.fetchall()
+    rows, count = await run_dorama_query(
+        DoramaQuery(rating=rating), context.user_data["rating_doramas_page"], columns="d.id, d.title_ru, d.country"
+    )
             
     if not rows:
         await query.edit_message_text(f"Нет дорам с рейтингом {rating}.", 
                                       reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="list_doramas_by_rating")]]))
         return            
 
-    # Пагинация дорам по рейтингу
-    initialize_page(context, "rating_doramas_page")
-
-    start, end = context.user_data["rating_doramas_page"] * PAGE_SIZE, (context.user_data["rating_doramas_page"] + 1) * PAGE_SIZE
-    rows_to_show = rows[start:end]
-    
     keyboard = [
         [InlineKeyboardButton(f"{row[1]} {COUNTRY_FLAGS.get(row[2], '🌍')}", callback_data=f"show_dorama:{row[0]}")] 
-        for row in rows_to_show
+        for row in rows
     ]
 
     pagination_buttons = []
     if context.user_data["rating_doramas_page"] > 0:
         pagination_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data="rating_doramas_page_back"))
-    if len(rows) > (context.user_data["rating_doramas_page"] + 1) * PAGE_SIZE:
+    if count > (context.user_data["rating_doramas_page"] + 1) * PAGE_SIZE:
         pagination_buttons.append(InlineKeyboardButton("➡️ Вперед", callback_data="rating_doramas_page_next"))
 
     if pagination_buttons:
@@ -2592,7 +4097,7 @@ async def show_doramas_by_rating(update, context):
     try:
 
 
-        await query.edit_message_text(f"Дорамы с рейтингом {rating} (Всего: {len(rows)}):", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(f"Дорамы с рейтингом {rating} (Всего: {count}):", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
     except telegram.error.BadRequest as e:
@@ -2616,14 +4121,14 @@ async def handle_rating_doramas_pagination(update, context):
 
 # ======== Обработчик текстовых сообщений ==========
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Обработчик текстовых сообщений вызван.")
+    activity_logger.debug("Обработчик текстовых сообщений вызван.")
     
     await log_user_activity(update, context)
-    logger.info("Функция log_user_activity вызвана.")  # Добавьте этот лог
+    activity_logger.debug("Функция log_user_activity вызвана.")  # Добавьте этот лог
 
     if update.effective_message.text:
         await update.message.reply_text(DEFAULT_MESSAGE, reply_markup=back_button)
-        logger.info(f"Пользователь {update.effective_user.id} ввел текстовое сообщение.")
+        activity_logger.debug("Пользователь %s ввел текстовое сообщение.", update.effective_user.id)
         
         
 
@@ -2640,7 +4145,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
             button_text = query.data
             
             # Логируем данные перед сохранением
-            logger.info(f"Попытка сохранения callback_data: {button_text} для пользователя {user_id}")
+            click_logger.debug("Попытка сохранения callback_data: %s для пользователя %s", button_text, user_id)
             
         # Обработка callback-запросов
         if query.data == "list_by_letter":
@@ -2685,26 +4190,26 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         elif query.data.startswith("select_country:"):
             await log_user_activity(update, context)  # Логируем действие пользователя
             country = query.data.split(":")[1]
-            logger.info(f"Выбрана страна: {country}")
+            click_logger.debug("Выбрана страна: %s", country)
             await show_doramas_by_country(update, context, country)
 
         elif query.data == "search_by_actor":
-            logger.info("Нажата кнопка 'актер'")
+            click_logger.debug("Нажата кнопка 'актер'")
             await log_user_activity(update, context)  # Логируем действие пользователя
             await query.message.reply_text("Пожалуйста, введите фамилию или имя актера:")
 
         elif query.data == "search_by_actress":
-            logger.info("Нажата кнопка 'актриса'")
+            click_logger.debug("Нажата кнопка 'актриса'")
             await log_user_activity(update, context)  # Логируем действие пользователя
             await query.message.reply_text("Пожалуйста, введите фамилию или имя актрисы:")
 
         elif query.data == "search_by_director":
-            logger.info("Нажата кнопка 'режиссер'")
+            click_logger.debug("Нажата кнопка 'режиссер'")
             await log_user_activity(update, context)  # Логируем действие пользователя
             await query.message.reply_text("Пожалуйста, введите фамилию или имя режиссёра:")
 
         elif query.data == "back":
-            logger.info("Нажата кнопка назад")
+            click_logger.debug("Нажата кнопка назад")
             await log_user_activity(update, context)  # Логируем действие пользователя
             await update.callback_query.answer()
             await update.callback_query.edit_message_text("Вы вернулись назад.")
@@ -2734,24 +4239,16 @@ async def list_years(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             page = 0  # Страница по умолчанию
 
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT COUNT(DISTINCT year) FROM doramas") as cursor:
-                total_years = (await cursor.fetchone())[0]
-                
-            if total_years is None:
-                total_years = 0  # Если по какой-то причине данных нет
-
-            # Подсчёт страниц
-            max_pages = (total_years + PAGE_SIZE - 1) // PAGE_SIZE
-            page = min(page, max_pages - 1)  # Убедитесь, что страница не выходит за пределы
-            offset = page * PAGE_SIZE
+        # Годы — из catalog_stats: DISTINCT year по таблице перебирал бы весь индекс
+        await wait_for_catalog()
+        all_years = [(year,) for year, count in sorted(catalog_stats.years.items(), reverse=True) if count > 0]
+        total_years = len(all_years)
 
-
-            async with db.execute(
-                "SELECT DISTINCT year FROM doramas ORDER BY year DESC LIMIT ? OFFSET ?",
-                (PAGE_SIZE, offset)
-            ) as cursor:
-                years = await cursor.fetchall()
+        # Подсчёт страниц
+        max_pages = (total_years + PAGE_SIZE - 1) // PAGE_SIZE
+        page = min(page, max_pages - 1)  # Убедитесь, что страница не выходит за пределы
+        offset = page * PAGE_SIZE
+        years = all_years[max(offset, 0):offset + PAGE_SIZE]
 
         if not years:
             try:
@@ -2788,15 +4285,15 @@ async def list_years(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                     raise
         except BadRequest as e:
-            logger.error(f"Ошибка при редактировании сообщения: {e}")
+            logger.error("Ошибка при редактировании сообщения: %s", e)
             if "message is not modified" in str(e):
-                logger.info("Сообщение не было изменено.")
+                logger.debug("Сообщение не было изменено.")
             else:
                 # Логируем дополнительные детали ошибки
                 logger.exception("Детали ошибки: ", exc_info=True)
     
     except Exception as e:
-        logger.error(f"Неизвестная ошибка: {e}")
+        logger.error("Неизвестная ошибка: %s", e)
         try:
 
             await query.edit_message_text("🚨 Произошла ошибка при загрузке годов. Попробуйте снова позже.")
@@ -2844,33 +4341,25 @@ async def list_doramas_by_year(update: Update, context: ContextTypes.DEFAULT_TYP
         
         year = int(year)  # Преобразуем в число
         
-        # Подключаемся к базе данных
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT COUNT(*) FROM doramas WHERE year = ?", (year,)) as cursor:
-                total_doramas = (await cursor.fetchone())[0]
+        # Страница и общее число — через общий исполнитель фильтров
+        doramas, total_doramas = await run_dorama_query(
+            DoramaQuery(year_from=year, year_to=year), page, columns="d.id, d.title_ru, d.country"
+        )
 
-            if total_doramas == 0:
-                try:
+        if total_doramas == 0:
+            try:
 
-                    await query.edit_message_text(f"🚫 В {year} году дорам нет.", reply_markup=back_button)
+                await query.edit_message_text(f"🚫 В {year} году дорам нет.", reply_markup=back_button)
 
-                except telegram.error.BadRequest as e:
+            except telegram.error.BadRequest as e:
 
-                    if 'Message is not modified' not in str(e):
+                if 'Message is not modified' not in str(e):
 
-                        raise
-                return
+                    raise
+            return
 
-            # Подсчёт страниц
-            total_pages = (total_doramas // PAGE_SIZE) + (1 if total_doramas % PAGE_SIZE else 0)
-            offset = page * PAGE_SIZE
-
-            # Запрос списка дорам с пагинацией
-            async with db.execute(
-                "SELECT id, title_ru, country FROM doramas WHERE year = ? ORDER BY title_ru LIMIT ? OFFSET ?",
-                (year, PAGE_SIZE, offset)
-            ) as cursor:
-                doramas = await cursor.fetchall()
+        # Подсчёт страниц
+        total_pages = (total_doramas // PAGE_SIZE) + (1 if total_doramas % PAGE_SIZE else 0)
 
         # Формируем заголовок
         response = f"📅 *Дорамы {year} года ({total_doramas} всего):*\n\n"
@@ -2905,7 +4394,7 @@ async def list_doramas_by_year(update: Update, context: ContextTypes.DEFAULT_TYP
                 raise
 
     except Exception as e:
-        logger.error(f"Ошибка при получении списка дорам за {year}: {e}")
+        logger.error("Ошибка при получении списка дорам за %s: %s", year, e)
         try:
 
             await query.edit_message_text("⚠️ Ошибка при загрузке списка дорам.", reply_markup=back_button)
@@ -2916,6 +4405,151 @@ async def list_doramas_by_year(update: Update, context: ContextTypes.DEFAULT_TYP
 
                 raise
 
+
+# КОМБИНИРОВАННЫЙ ФИЛЬТР
+# ======== Подпись диапазона лет ==========
+def format_year_range(year_range):
+    low, high = year_range
+    if low is None:
+        return f"до {high + 1}"
+    if high is None:
+        return f"с {low}"
+    return f"{low}–{high}"
+
+# Следующее значение по кругу: None -> первый вариант -> ... -> последний -> None
+def next_filter_option(options, current):
+    if current not in options:
+        return options[0]
+    i = options.index(current) + 1
+    return options[i] if i < len(options) else None
+
+# ======== Собираем DoramaQuery из выбранных условий ==========
+def build_filter_query(user_data) -> DoramaQuery:
+    year_from, year_to = user_data.get('filter_years') or (None, None)
+    director = user_data.get('filter_director')
+    return DoramaQuery(
+        country=user_data.get('filter_country'),
+        year_from=year_from,
+        year_to=year_to,
+        min_rating=user_data.get('filter_min_rating'),
+        people={"director": director} if director else None,
+    )
+
+# ======== Меню фильтра с текущими условиями ==========
+def create_filter_keyboard(user_data) -> InlineKeyboardMarkup:
+    country = user_data.get('filter_country')
+    years = user_data.get('filter_years')
+    min_rating = user_data.get('filter_min_rating')
+    director = user_data.get('filter_director')
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"🌏 Страна: {country or 'любая'}", callback_data="filter:country")],
+        [InlineKeyboardButton(f"📅 Годы: {format_year_range(years) if years else 'любые'}", callback_data="filter:years")],
+        [InlineKeyboardButton(f"⭐ Оценка: {f'от {min_rating}' if min_rating else 'любая'}", callback_data="filter:rating")],
+        [InlineKeyboardButton(f"🎬 Режиссёр: {director or 'любой'}", callback_data="filter:director")],
+        [InlineKeyboardButton("🔍 Показать дорамы", callback_data="filter:page:0")],
+        [InlineKeyboardButton("♻️ Сбросить", callback_data="filter:reset"),
+         InlineKeyboardButton("🌸 В главное меню", callback_data="return_to_main_menu")],
+    ])
+
+async def start_combined_filter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    try:
+
+        await query.edit_message_text("*🎛 Выберите условия поиска:*", reply_markup=create_filter_keyboard(context.user_data), parse_mode="Markdown")
+
+    except telegram.error.BadRequest as e:
+
+        if 'Message is not modified' not in str(e):
+
+            raise
+    return FILTER_MENU
+
+# ======== Обработка кнопок фильтра ==========
+async def handle_filter_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    action = query.data.split(":")[1]
+
+    if action == "page":
+        await query.answer()
+        return await show_filter_results(update, context, int(query.data.split(":")[2]))
+
+    if action == "director":
+        await query.answer()
+        await query.edit_message_text(
+            "*🔎 Введите имя режиссёра на русском или английском языке:*",
+            reply_markup=create_people_prompt_keyboard("режиссёр"), parse_mode="Markdown"
+        )
+        return FILTER_DIRECTOR
+
+    if action == "country":
+        context.user_data['filter_country'] = next_filter_option(COUNTRIES, context.user_data.get('filter_country'))
+    elif action == "years":
+        # После восстановления из persistence (JSON) диапазон приходит списком
+        years = context.user_data.get('filter_years')
+        context.user_data['filter_years'] = next_filter_option(FILTER_YEAR_RANGES, tuple(years) if years else None)
+    elif action == "rating":
+        context.user_data['filter_min_rating'] = next_filter_option(FILTER_MIN_RATINGS, context.user_data.get('filter_min_rating'))
+    elif action == "reset":
+        for key in ('filter_country', 'filter_years', 'filter_min_rating', 'filter_director'):
+            context.user_data.pop(key, None)
+
+    return await start_combined_filter(update, context)
+
+# ======== Ввод режиссёра для фильтра ==========
+async def receive_filter_director(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await wait_for_catalog()
+    director = update.message.text.strip()
+    # Если имя однозначно, сохраняем его так, как оно записано в каталоге
+    people = people_index.search("director", director, limit=2)
+    context.user_data['filter_director'] = people[0][0] if len(people) == 1 else director
+    await update.message.reply_text(
+        "*🎛 Выберите условия поиска:*", reply_markup=create_filter_keyboard(context.user_data), parse_mode="Markdown"
+    )
+    return FILTER_MENU
+
+# ======== Результаты фильтра с пагинацией ==========
+async def show_filter_results(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int) -> int:
+    query = update.callback_query
+    try:
+        rows, total = await run_dorama_query(build_filter_query(context.user_data), page)
+
+        keyboard = [
+            [InlineKeyboardButton(f"🎬 {title_ru} ({year}) {COUNTRY_FLAGS.get(country, '🌍')}", callback_data=f"show_dorama:{dorama_id}")]
+            for dorama_id, title_ru, country, year in rows
+        ]
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"filter:page:{page - 1}"))
+        if (page + 1) * PAGE_SIZE < total:
+            navigation.append(InlineKeyboardButton("➡️ Вперед", callback_data=f"filter:page:{page + 1}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("🎛 Изменить условия", callback_data="filter:menu")])
+        keyboard.append([InlineKeyboardButton("🌸 В главное меню", callback_data="return_to_main_menu")])
+
+        if total:
+            total_pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+            text = f"*🎛 Найдено {total} дорам:*\n📄 Страница {page + 1} из {total_pages}"
+        else:
+            text = "🚫 По выбранным условиям дорам не найдено."
+        try:
+
+            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+
+        except telegram.error.BadRequest as e:
+
+            if 'Message is not modified' not in str(e):
+
+                raise
+
+    except aiosqlite.Error as e:
+        logger.error("Ошибка при поиске по фильтру: %s", e, exc_info=True)
+        await query.edit_message_text("⚠️ Произошла ошибка при поиске дорам.", reply_markup=back_button)
+        return ConversationHandler.END
+
+    return FILTER_MENU
+
               
 # УНИВАРСАЛЬНЫЙ ХЭНДЛЕР ПАГИНАЦИИ        
 # ========  Универсальная функция для создания кнопок пагинации  ==========
@@ -2968,7 +4602,7 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         # Разбираем callback_data
-        logger.info(f"Received callback_data: {query.data}")
+        click_logger.debug("Received callback_data: %s", query.data)
         data_parts = query.data.split(":")
         
         if len(data_parts) < 2:
@@ -2985,24 +4619,24 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         prefix, page_str = data_parts[0], data_parts[-1]  # Берем последние данные как страницу
         page = int(page_str)
-        logger.info(f"Получен запрос с callback_data: {query.data} (prefix: {prefix}, page: {page})")  # Логируем запрос
+        click_logger.debug("Получен запрос с callback_data: %s (prefix: %s, page: %s)", query.data, prefix, page)  # Логируем запрос
 
             # Обработка пагинации в зависимости от префикса
         if prefix == "country":
             country = context.user_data['country']
             total_results_country = context.user_data.get('total_results_country', 0)
-            logger.info(f"Количество результатов для страны {country}: {total_results_country}")
+            search_logger.debug("Количество результатов для страны %s: %s", country, total_results_country)
             return await fetch_doramas_page(update, context, country, page)
             
         elif prefix == "title":
             normalized_title = context.user_data.get('normalized_title')  
             total_results_title = context.user_data.get('total_results_title', 0)
-            logger.info(f"Количество результатов для {normalized_title}: {total_results_title}")
+            search_logger.debug("Количество результатов для %s: %s", normalized_title, total_results_title)
             return await fetch_doramas_by_title_page(update, context, normalized_title, page)
             
         elif prefix == "actor":
             actor_name = context.user_data.get('search_actor_name', '')
-            logger.info(f"Пагинация по актёру: {actor_name}, страница {page}")
+            search_logger.debug("Пагинация по актёру: %s, страница %s", actor_name, page)
             if not actor_name:
                 logger.error("❌ Ошибка: `search_actor_name` отсутствует в `context.user_data`!")
                 try:
@@ -3020,7 +4654,7 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         elif prefix == "actress":
             actress_name = context.user_data.get('search_actress_name', '')
-            logger.info(f"Пагинация по актёру: {actress_name}, страница {page}")
+            search_logger.debug("Пагинация по актёру: %s, страница %s", actress_name, page)
             if not actress_name:
                 logger.error("❌ Ошибка: `search_actress_name` отсутствует в `context.user_data`!")
                 try:
@@ -3038,7 +4672,7 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         elif prefix == "director":
             director_name = context.user_data.get('search_director_name', '')
-            logger.info(f"Пагинация по актёру: {director_name}, страница {page}")
+            search_logger.debug("Пагинация по актёру: %s, страница %s", director_name, page)
             if not director_name:
                 logger.error("❌ Ошибка: `search_director_name` отсутствует в `context.user_data`!")
                 try:
@@ -3099,7 +4733,7 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
 
     except (ValueError, IndexError) as ve:
-        logger.error(f"Ошибка обработки callback: {ve}")
+        logger.error("Ошибка обработки callback: %s", ve)
         try:
 
             await query.edit_message_text(f"⚠️ Произошла ошибка: {ve}", reply_markup=back_button)
@@ -3119,7 +4753,7 @@ async def handle_button_press(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Отправка сообщения пользователю
     await update.effective_message.reply_text("😔 Пожалуйста, используйте кнопки для навигации. Ввод команд словами не поддерживается.", reply_markup=back_button)
-    logger.info(f"Пользователь {update.effective_user.id} ввел неизвестную команду.")
+    logger.info("Пользователь %s ввел неизвестную команду.", update.effective_user.id)
 
 # ======== Хэндлер ошибок ==========
 async def error_handler(update: object | None, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -3149,37 +4783,1175 @@ async def error_handler(update: object | None, context: ContextTypes.DEFAULT_TYP
         for admin_id in ADMINS:
             try:
                 await context.bot.send_message(chat_id=admin_id, text=error_message)
-                logger.info(f"Сообщение об ошибке отправлено администратору с ID {admin_id}")
+                logger.info("Сообщение об ошибке отправлено администратору с ID %s", admin_id)
             except Exception as e:
-                logger.warning(f"Не удалось отправить сообщение об ошибке администратору с ID {admin_id}: {e}")
+                logger.warning("Не удалось отправить сообщение об ошибке администратору с ID %s: %s", admin_id, e)
 
 
 # ======== Инициализация БД ==========
-async def init_user_db():
-    async with aiosqlite.connect(DB_PATH_2) as db:
-        await db.executescript('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_seen TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_seen TEXT DEFAULT NULL,
-                last_message TEXT DEFAULT NULL,
-                last_callback_data TEXT DEFAULT NULL
-            );
-            CREATE TABLE IF NOT EXISTS user_actions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action_type TEXT, 
-                action_data TEXT, 
-                message_id INTEGER, 
-                callback_query_id TEXT,
-                timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-            CREATE INDEX IF NOT EXISTS idx_user_actions_user_id ON user_actions (user_id);
-        ''')
-        await db.commit()
-        logger.info("✅ База данных пользователей успешно инициализирована.")
+# --- Миграции doramas_users.db ---
+async def migrate_users_base(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_seen TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_seen TEXT DEFAULT NULL,
+            last_message TEXT DEFAULT NULL,
+            last_callback_data TEXT DEFAULT NULL
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action_type TEXT,
+            action_data TEXT,
+            message_id INTEGER,
+            callback_query_id TEXT,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_user_actions_user_id ON user_actions (user_id)')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        )
+    ''')
+
+async def migrate_users_actions_by_time(db):
+    # /get_user_actions берёт последние действия пользователя: с (user_id, timestamp) без сортировки.
+    # user_actions растёт с каждым нажатием, поэтому на живой базе индекс строится в фоне
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_user_actions_user_time ON user_actions (user_id, timestamp)')
+    await db.execute('DROP INDEX IF EXISTS idx_user_actions_user_id')  # Покрывается новым индексом
+
+async def migrate_users_conversation_time(db):
+    # Таймауты диалогов — задачи JobQueue, они не переживают перезапуск. По времени записи
+    # состояния get_conversations отбрасывает диалоги, которые успели истечь. У старых записей
+    # времени нет (0) — их тоже считаем истёкшими
+    await db.execute('ALTER TABLE persisted_conversations ADD COLUMN updated_at REAL NOT NULL DEFAULT 0')
+
+USER_MIGRATIONS = [
+    Migration(1, "пользователи, действия, состояние диалогов", migrate_users_base),
+    Migration(2, "индекс действий по пользователю и времени", migrate_users_actions_by_time, background=True),
+    Migration(3, "время записи состояния диалогов", migrate_users_conversation_time),
+]
+
+async def init_user_db(background: bool = True):
+    await run_migrations(DB_PATH_2, USER_MIGRATIONS, background)
+    logger.info("✅ База данных пользователей успешно инициализирована.")
+
+# ======== Обслуживание SQLite по расписанию ==========
+async def run_pragma(db: aiosqlite.Connection, sql: str) -> list:
+    # PRAGMA optimize и wal_checkpoint делают работу, пока из них читают строки
+    async with db.execute(sql) as cursor:
+        return await cursor.fetchall()
+
+async def maintain_optimize(db) -> str:
+    await run_pragma(db, "PRAGMA optimize")
+    return ""
+
+async def maintain_analyze(db) -> str:
+    # Без статистики планировщик выбирает между idx_title_ru, idx_country и др. наугад
+    await run_pragma(db, f"PRAGMA analysis_limit = {ANALYZE_LIMIT}")
+    await db.execute("ANALYZE")
+    await db.commit()
+    return ""
+
+async def maintain_vacuum(db) -> str:
+    (mode,), = await run_pragma(db, "PRAGMA auto_vacuum")
+    if mode != 2:
+        # Режим INCREMENTAL включается только полным VACUUM — один раз на файл
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+        return "включён auto_vacuum=INCREMENTAL (полный VACUUM)"
+    (free_pages,), = await run_pragma(db, "PRAGMA freelist_count")
+    if not free_pages:
+        return "свободных страниц нет"
+    # Через execute модуль sqlite3 делает один шаг и освобождает одну страницу; executescript — до конца
+    await db.executescript("PRAGMA incremental_vacuum;")
+    return f"возвращено страниц: {free_pages}"
+
+async def maintain_checkpoint(db) -> str:
+    (journal_mode,), = await run_pragma(db, "PRAGMA journal_mode")
+    if journal_mode != "wal":
+        return f"журнал {journal_mode}, не требуется"
+    (busy, wal_pages, checkpointed), = await run_pragma(db, "PRAGMA wal_checkpoint(TRUNCATE)")
+    return f"перенесено страниц: {checkpointed} из {wal_pages}" + (", мешали читатели" if busy else "")
+
+MAINTENANCE_TASKS = {
+    "optimize": maintain_optimize,
+    "analyze": maintain_analyze,
+    "vacuum": maintain_vacuum,
+    "checkpoint": maintain_checkpoint,
+}
+maintenance_last_run: dict = {}  # (файл, задача) -> time.monotonic() последнего запуска
+
+def database_size(path: str) -> int:
+    return sum(os.path.getsize(file) for file in (path, f"{path}-wal") if os.path.exists(file))
+
+def in_maintenance_window(hour: int) -> bool:
+    start, _, end = MAINTENANCE_WINDOW.partition("-")
+    start, end = int(start), int(end)
+    # Окно может переходить через полночь, например 23-5
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+async def run_maintenance_task(path: str, name: str) -> None:
+    size_before = database_size(path)
+    started = time.perf_counter()
+    try:
+        async with connect_db(path) as db:
+            note = await MAINTENANCE_TASKS[name](db)
+    except aiosqlite.Error as e:
+        db_logger.warning("🧹 %s: %s не выполнено: %s", os.path.basename(path), name, e)
+        return
+    size_after = database_size(path)
+    db_logger.info(
+        "🧹 %s: %s за %.2f с, размер %.1f → %.1f МБ%s",
+        os.path.basename(path), name, time.perf_counter() - started,
+        size_before / 2**20, size_after / 2**20, f" ({note})" if note else "",
+    )
+
+async def run_maintenance(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача JobQueue: выполняет задачи, чей период истёк, если сейчас окно обслуживания и бот простаивает."""
+    if not in_maintenance_window(datetime.now().hour):
+        return
+    for path in (DB_PATH, DB_PATH_2):
+        for name, period in MAINTENANCE_PERIODS.items():
+            last_run = maintenance_last_run.get((path, name))
+            if last_run is not None and time.monotonic() - last_run < period:
+                continue
+            # Проверяем простой перед каждой задачей: пользователь мог прийти посреди обслуживания
+            if health.last_update_at is not None and time.monotonic() - health.last_update_at < MAINTENANCE_IDLE_SECONDS:
+                db_logger.debug("Обслуживание отложено: бот не простаивает")
+                return
+            await run_maintenance_task(path, name)
+            maintenance_last_run[(path, name)] = time.monotonic()
+
+# ======== Резервное копирование баз ==========
+backup_lock = asyncio.Lock()  # Одновременно делается только одна копия
+
+def backup_files(stem: str) -> list:
+    """Снимки одного файла базы, от новых к старым."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    # Точный шаблон: префикс «doramas_» подошёл бы и к снимкам doramas_users.db
+    pattern = re.compile(rf"{re.escape(stem)}_\d{{8}}_\d{{6}}\.db\.gz")
+    names = [name for name in os.listdir(BACKUP_DIR) if pattern.fullmatch(name)]
+    return sorted((os.path.join(BACKUP_DIR, name) for name in names), reverse=True)
+
+def rotate_backups(stem: str) -> list:
+    """Удаляет снимки сверх BACKUP_KEEP (самые старые); возвращает удалённые файлы."""
+    removed = backup_files(stem)[BACKUP_KEEP:]
+    for old_backup in removed:
+        os.remove(old_backup)
+    return removed
+
+def verify_and_compress(copy_path: str, target_path: str) -> None:
+    """Проверяет копию PRAGMA integrity_check и сжимает её. Выполняется в отдельном потоке."""
+    with sqlite3.connect(copy_path) as copy:
+        result = [row[0] for row in copy.execute("PRAGMA integrity_check")]
+    copy.close()
+    if result != ["ok"]:
+        raise sqlite3.DatabaseError(f"копия не прошла integrity_check: {'; '.join(result[:5])}")
+    partial_path = f"{target_path}.part"
+    with open(copy_path, "rb") as source, gzip.open(partial_path, "wb", compresslevel=6) as target:
+        shutil.copyfileobj(source, target, length=1024 * 1024)
+    os.replace(partial_path, target_path)  # Недописанный архив никогда не выглядит как готовый снимок
+
+def pause_between_backup_steps(status, remaining, total):
+    # progress-колбэк Connection.backup: вызывается в потоке соединения после шага, когда источник
+    # уже отпущен. Сам backup между удачными шагами не ждёт — его sleep только для BUSY/LOCKED
+    if remaining:
+        time.sleep(BACKUP_STEP_PAUSE)
+
+async def backup_database(path: str) -> tuple[str, int, float]:
+    """Снимок базы через backup API: (файл снимка, размер, секунды)."""
+    started = time.perf_counter()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    target_path = os.path.join(BACKUP_DIR, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db.gz")
+    copy_path = os.path.join(BACKUP_DIR, f".{stem}.copy")
+    try:
+        # Копирование идёт шагами в потоке соединения: цикл событий свободен, между шагами база доступна для записи
+        target = sqlite3.connect(copy_path, check_same_thread=False)
+        try:
+            async with connect_db(path) as db:
+                await db.backup(
+                    target, pages=BACKUP_PAGES_PER_STEP, progress=pause_between_backup_steps, sleep=BACKUP_BUSY_SLEEP
+                )
+        finally:
+            target.close()
+        await asyncio.to_thread(verify_and_compress, copy_path, target_path)
+    finally:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+
+    rotate_backups(stem)
+    size = os.path.getsize(target_path)
+    db_logger.info("💾 %s: снимок %s (%.1f МБ) за %.2f с", os.path.basename(path), target_path, size / 2**20, time.perf_counter() - started)
+    return target_path, size, time.perf_counter() - started
+
+async def backup_all() -> list:
+    """[(база, файл снимка или None, размер, секунды, ошибка или None)] для обеих баз."""
+    results = []
+    async with backup_lock:
+        for path in (DB_PATH, DB_PATH_2):
+            try:
+                results.append((path, *await backup_database(path), None))
+            except (sqlite3.Error, OSError) as e:
+                logger.error("⚠️ Не удалось сделать резервную копию %s: %s", path, e, exc_info=True)
+                results.append((path, None, 0, 0.0, str(e)))
+    return results
+
+async def run_backups(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if backup_lock.locked():
+        return
+    await backup_all()
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMINS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    if backup_lock.locked():
+        await update.message.reply_text("⏳ Резервное копирование уже идёт.")
+        return
+
+    await update.message.reply_text("💾 Делаю резервные копии...")
+    lines = []
+    for path, backup_path, size, seconds, error in await backup_all():
+        if error:
+            lines.append(f"⚠️ {os.path.basename(path)}: {error}")
+        else:
+            kept = len(backup_files(os.path.splitext(os.path.basename(path))[0]))
+            lines.append(f"✅ {os.path.basename(path)} → {os.path.basename(backup_path)}, {size / 2**20:.1f} МБ, {seconds:.1f} с (хранится {kept})")
+    await update.message.reply_text("\n".join(lines))
+
+# ======== Массовый импорт дорам из CSV/JSONL ==========
+IMPORT_FIELDS = (
+    "title_ru", "title_en", "country", "year", "director", "lead_actress", "lead_actor",
+    "personal_rating", "comment", "plot", "poster_url",
+)
+IMPORT_REQUIRED_FIELDS = ("title_ru", "title_en", "director", "lead_actress", "lead_actor", "plot", "comment")
+YANDEX_DIRECT_LINK_PREFIX = "https://downloader.disk.yandex.ru/"  # Уже полученная прямая ссылка (например, из /export)
+import_lock = asyncio.Lock()  # Одновременно идёт только один импорт
+
+class ImportRow:
+    """Строка файла импорта и её судьба: new -> added, duplicate или error."""
+    __slots__ = ("line", "values", "keys", "status", "reason", "dorama_id")
+
+    def __init__(self, line: int, values: dict | None = None, status: str = "new", reason: str = ""):
+        self.line = line
+        self.values = values
+        self.keys = ()
+        self.status = status
+        self.reason = reason
+        self.dorama_id = None
+
+    def fail(self, status: str, reason: str) -> None:
+        self.status = status
+        self.reason = reason
+
+    def describe(self) -> str:
+        title = f" «{self.values['title_ru']}»" if self.values else ""
+        if self.status == "added":
+            return f"строка {self.line}{title}: ✅ добавлена, ID {self.dorama_id}"
+        if self.status == "duplicate":
+            return f"строка {self.line}{title}: 🔁 дубликат ({self.reason})"
+        return f"строка {self.line}{title}: ⚠️ {self.reason}"
+
+def iter_import_records(data: bytes, file_name: str):
+    """(номер строки, поля или None, ошибка) — записи читаются по одной, без разбора файла целиком."""
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    if file_name.lower().endswith(".jsonl"):
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, None, f"некорректный JSON: {e.msg}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "ожидался объект JSON"
+                continue
+            yield line_number, record, None
+        return
+
+    reader = csv.DictReader(text)
+    missing = [field for field in IMPORT_FIELDS if field not in (reader.fieldnames or ()) and field != "poster_url"]
+    if missing:
+        raise ValueError(f"в заголовке CSV нет колонок: {', '.join(missing)}")
+    for record in reader:
+        yield reader.line_num, record, None
+
+def match_country(text: str) -> str | None:
+    """Страна из COUNTRIES по названию или его части без учёта регистра: «корея» -> «Южная Корея»."""
+    wanted = search_key(text)
+    if not wanted:
+        return None
+    return next((country for country in COUNTRIES if wanted in search_key(country)), None)
+
+def validate_import_record(record: dict, labels: dict | None = None) -> tuple[dict | None, str]:
+    """Те же проверки, что и при добавлении дорамы через диалог: (значения, "") или (None, причина).
+
+    labels — как называть поля в сообщении об ошибке (по умолчанию — именами колонок).
+    """
+    values = {}
+    for field in IMPORT_FIELDS:
+        value = record.get(field)
+        values[field] = "" if value is None else str(value).strip()
+    for field in IMPORT_REQUIRED_FIELDS:
+        if not values[field]:
+            return None, f"пустое поле {(labels or {}).get(field, field)}"
+    if values["country"] not in COUNTRIES:
+        return None, f"неизвестная страна «{values['country']}» (допустимы: {', '.join(COUNTRIES)})"
+    if not values["year"].isdigit() or not (1900 <= int(values["year"]) <= 2100):
+        return None, f"год должен быть числом 1900-2100, а не «{values['year']}»"
+    if not values["personal_rating"].isdigit() or not (1 <= int(values["personal_rating"]) <= 10):
+        return None, f"оценка должна быть от 1 до 10, а не «{values['personal_rating']}»"
+    if values["poster_url"] and not values["poster_url"].startswith(("https://disk.yandex.ru/", YANDEX_DIRECT_LINK_PREFIX)):
+        return None, "постер должен быть ссылкой с Яндекс.Диска"
+    values["year"] = int(values["year"])
+    values["personal_rating"] = int(values["personal_rating"])
+    values["poster_url"] = values["poster_url"] or None
+    return values, ""
+
+def read_import_rows(data: bytes, file_name: str) -> list[ImportRow]:
+    """Разбирает и проверяет файл; повторы внутри файла отмечаются сразу."""
+    rows = []
+    seen = {}  # ключ названия -> строка, где он встретился первым
+    for line_number, record, error in iter_import_records(data, file_name):
+        if error:
+            rows.append(ImportRow(line_number, status="error", reason=error))
+            continue
+        values, error = validate_import_record(record)
+        row = ImportRow(line_number, values)
+        rows.append(row)
+        if error:
+            row.fail("error", error)
+            continue
+        row.keys = title_keys(values["title_ru"], values["title_en"])
+        first = next((seen[key] for key in row.keys if key in seen), None)
+        if first is not None:
+            row.fail("duplicate", f"повтор строки {first}")
+            continue
+        seen.update(dict.fromkeys(row.keys, line_number))
+    return rows
+
+async def mark_existing_duplicates(rows: list[ImportRow]) -> None:
+    """Отмечает строки, чьё нормализованное название уже есть в каталоге (по индексу search_keys)."""
+    keys = list({key for row in rows for key in row.keys})
+    existing = set()
+    async with connect_db(DB_PATH) as db:
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            async with db.execute(
+                f"SELECT key FROM search_keys WHERE field = 'title' AND key IN ({placeholders})", chunk
+            ) as cursor:
+                existing.update(key for key, in await cursor.fetchall())
+    for row in rows:
+        if any(key in existing for key in row.keys):
+            row.fail("duplicate", "уже есть в каталоге")
+
+async def resolve_import_posters(rows: list[ImportRow]) -> None:
+    """Прямые ссылки на постеры: запросы к Яндекс.Диску идут параллельно, но не больше IMPORT_POSTER_CONCURRENCY."""
+    semaphore = asyncio.Semaphore(IMPORT_POSTER_CONCURRENCY)
+
+    async def resolve(row: ImportRow) -> None:
+        async with semaphore:
+            direct_link = await asyncio.to_thread(get_yandex_disk_direct_link, row.values["poster_url"])
+        if direct_link:
+            row.values["poster_url"] = direct_link
+        else:
+            row.fail("error", "не удалось получить прямую ссылку на постер")
+
+    await asyncio.gather(*(
+        resolve(row) for row in rows
+        if row.values["poster_url"] and not row.values["poster_url"].startswith(YANDEX_DIRECT_LINK_PREFIX)
+    ))
+
+async def insert_imported_rows(rows: list[ImportRow]) -> None:
+    """Вставляет строки одной транзакцией вместе с карточками и ключами поиска."""
+    async with connect_db(DB_PATH) as db:
+        await db.execute("BEGIN IMMEDIATE")  # Пока транзакция открыта, новые id идут подряд за MAX(id)
+        try:
+            async with db.execute("SELECT COALESCE(MAX(id), 0) FROM doramas") as cursor:
+                last_id = (await cursor.fetchone())[0]
+            await db.executemany(
+                f"INSERT INTO doramas ({', '.join(IMPORT_FIELDS)}) VALUES ({', '.join('?' * len(IMPORT_FIELDS))})",
+                [tuple(row.values[field] for field in IMPORT_FIELDS) for row in rows],
+            )
+            async with db.execute(f"SELECT {CARD_COLUMNS} FROM doramas WHERE id > ? ORDER BY id", (last_id,)) as cursor:
+                cursor.row_factory = aiosqlite.Row
+                inserted = await cursor.fetchall()
+            await db.executemany(
+                "UPDATE doramas SET rendered_card = ? WHERE id = ?",
+                [(render_dorama_card(card), card["id"]) for card in inserted],
+            )
+            await db.executemany(
+                "INSERT INTO search_keys (dorama_id, field, key) VALUES (?, ?, ?)",
+                [
+                    key_row
+                    for card in inserted
+                    for key_row in search_key_rows(
+                        card["id"], card["title_ru"], card["title_en"], card["director"], card["lead_actress"], card["lead_actor"]
+                    )
+                ],
+            )
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    for row, card in zip(rows, inserted):
+        row.dorama_id = card["id"]
+        row.status = "added"
+
+def add_imported_to_indexes(rows: list[ImportRow]) -> None:
+    for row in rows:
+        values = row.values
+        title_index.add(row.dorama_id, values["title_ru"], values["title_en"], values["country"], values["year"])
+        add_people_to_index(values["director"], values["lead_actress"], values["lead_actor"], values["country"])
+        catalog_stats.add(values["country"], values["year"], values["personal_rating"], values["title_ru"], values["title_en"])
+    inline_result_cache.clear()
+    similarity_rebuilder.schedule()
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if update.effective_user.id not in ADMINS:
+        await message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await message.reply_text(
+            "📥 Пришлите файл .csv или .jsonl с подписью /import или ответьте /import на сообщение с файлом.\n"
+            f"Поля: {', '.join(IMPORT_FIELDS)} (poster_url — ссылка с Яндекс.Диска, можно пустую). Подходит и файл из /export."
+        )
+        return
+    file_name = document.file_name or ""
+    if not file_name.lower().endswith((".csv", ".jsonl")):
+        await message.reply_text("⚠️ Поддерживаются только файлы .csv и .jsonl.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply_text(f"⚠️ Файл больше {IMPORT_MAX_BYTES // 2**20} МБ, разбейте его на части.")
+        return
+    if import_lock.locked():
+        await message.reply_text("⏳ Импорт уже идёт.")
+        return
+
+    await wait_for_catalog()  # Индексы должны быть построены до вставки, иначе новые строки попадут в них дважды
+    async with import_lock:
+        started = time.perf_counter()
+        await message.reply_text(f"📥 Импортирую {file_name}...")
+        data = await (await document.get_file()).download_as_bytearray()
+        try:
+            rows = read_import_rows(bytes(data), file_name)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            await message.reply_text(f"⚠️ Не удалось прочитать файл: {e}")
+            return
+
+        await mark_existing_duplicates([row for row in rows if row.status == "new"])
+        await resolve_import_posters([row for row in rows if row.status == "new"])
+        new_rows = [row for row in rows if row.status == "new"]
+        if new_rows:
+            try:
+                await insert_imported_rows(new_rows)
+            except aiosqlite.Error as e:
+                logger.error("❌ Ошибка при импорте дорам: %s", e, exc_info=True)
+                await message.reply_text(f"❌ Ошибка при записи в БД, ничего не добавлено: {e}")
+                return
+            add_imported_to_indexes(new_rows)
+
+    counts = Counter(row.status for row in rows)
+    summary = (
+        f"📥 {file_name}: строк {len(rows)}, добавлено {counts['added']}, "
+        f"дубликатов {counts['duplicate']}, ошибок {counts['error']} за {time.perf_counter() - started:.1f} с"
+    )
+    logger.info("%s", summary)
+    report = "\n".join(row.describe() for row in rows)
+    if len(rows) <= IMPORT_REPORT_INLINE_ROWS:
+        for part in split_message(f"{summary}\n\n{report}" if report else summary):
+            await message.reply_text(part)
+    else:
+        await message.reply_document(
+            report.encode("utf-8"), filename=f"{os.path.splitext(file_name)[0]}_report.txt", caption=summary
+        )
+
+# ======== Выгрузка каталога в CSV/JSONL ==========
+EXPORT_COLUMNS = ("id", *IMPORT_FIELDS)  # Файл выгрузки можно снова загрузить через /import
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_USAGE = (
+    "Использование: /export [csv|jsonl] [страна] [год или годы 2015-2020] [оценка: 8 или 8+]\n"
+    "Например: /export jsonl корея 2018-2022 8+"
+)
+
+def parse_export_args(args: list[str]) -> tuple[str, DoramaQuery, str]:
+    """(формат, фильтры, их описание для подписи) из аргументов /export; ValueError — непонятный аргумент."""
+    export_format = "csv"
+    query = DoramaQuery()
+    country_words = []
+    for arg in args:
+        if arg.lower() in EXPORT_FORMATS:
+            export_format = arg.lower()
+        elif match := re.fullmatch(r"(\d{4})(?:-(\d{4}))?", arg):
+            query.year_from = int(match.group(1))
+            query.year_to = int(match.group(2) or match.group(1))
+        elif match := re.fullmatch(r"(\d{1,2})(\+?)", arg):
+            if match.group(2):
+                query.min_rating = int(match.group(1))
+            else:
+                query.rating = int(match.group(1))
+        else:
+            country_words.append(arg.lower())
+    if country_words:
+        query.country = match_country(" ".join(country_words))
+        if query.country is None:
+            raise ValueError(f"неизвестная страна «{' '.join(country_words)}»")
+
+    filters_text = []
+    if query.country:
+        filters_text.append(query.country)
+    if query.year_from is not None:
+        filters_text.append(str(query.year_from) if query.year_from == query.year_to else f"{query.year_from}-{query.year_to}")
+    if query.rating is not None:
+        filters_text.append(f"оценка {query.rating}")
+    elif query.min_rating is not None:
+        filters_text.append(f"оценка от {query.min_rating}")
+    return export_format, query, ", ".join(filters_text) or "весь каталог"
+
+async def iter_export_chunks(query: DoramaQuery):
+    """Строки выгрузки пачками по EXPORT_FETCH_ROWS прямо из курсора, без чтения всей таблицы в память."""
+    statements = query.statements(", ".join(f"d.{column}" for column in EXPORT_COLUMNS), "d.id")
+    if statements is None:
+        return
+    select_sql, _, params = statements
+    async with connect_db(DB_PATH) as db:
+        async with db.execute(select_sql, (*params, -1, 0)) as cursor:
+            while rows := await cursor.fetchmany(EXPORT_FETCH_ROWS):
+                yield rows
+
+def write_export_chunk(text, export_format: str, rows) -> None:
+    # Выполняется в отдельном потоке: форматирование и сжатие не держат цикл событий
+    if export_format == "csv":
+        csv.writer(text).writerows(rows)
+    else:
+        text.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+
+async def export_catalog(query: DoramaQuery, export_format: str, file_name: str):
+    """Пишет выгрузку в сжатый временный файл: (файл, открытый на чтение с начала, число строк)."""
+    output = tempfile.TemporaryFile()
+    count = 0
+    try:
+        with gzip.GzipFile(filename=file_name, mode="wb", fileobj=output, compresslevel=6) as archive:
+            with io.TextIOWrapper(archive, encoding="utf-8", newline="") as text:
+                if export_format == "csv":
+                    csv.writer(text).writerow(EXPORT_COLUMNS)
+                async for rows in iter_export_chunks(query):
+                    await asyncio.to_thread(write_export_chunk, text, export_format, rows)
+                    count += len(rows)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output, count
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMINS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    try:
+        export_format, query, filters_text = parse_export_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ {str(e).capitalize()}.\n{EXPORT_USAGE}")
+        return
+
+    await wait_for_catalog()
+    started = time.perf_counter()
+    file_name = f"doramas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    try:
+        output, count = await export_catalog(query, export_format, file_name)
+    except (aiosqlite.Error, OSError) as e:
+        logger.error("❌ Ошибка при выгрузке каталога: %s", e, exc_info=True)
+        await update.message.reply_text(f"❌ Не удалось выгрузить каталог: {e}")
+        return
+    with output:
+        if not count:
+            await update.message.reply_text(f"🔍 Ничего не найдено ({filters_text}).")
+            return
+        size = os.fstat(output.fileno()).st_size
+        seconds = time.perf_counter() - started
+        summary = f"📤 {filters_text}: {count} дорам, {size / 1024:.0f} КБ в gzip за {seconds:.2f} с"
+        logger.info("%s", summary)
+        await update.message.reply_document(output, filename=f"{file_name}.gz", caption=summary)
+
+# ======== Добавление дорамы одним сообщением (/add) ==========
+# Поле -> подпись в шаблоне. Вместо одиннадцати вопросов диалога — одно сообщение и одно подтверждение
+FORM_LABELS = {
+    "title_ru": "Название",
+    "title_en": "Английское название",
+    "country": "Страна",
+    "year": "Год",
+    "director": "Режиссёр",
+    "lead_actress": "Актриса",
+    "lead_actor": "Актёр",
+    "personal_rating": "Оценка",
+    "plot": "Сюжет",
+    "comment": "Комментарий",
+    "poster_url": "Постер",
+}
+# Ключ строки формы (подпись или имя колонки, без учёта регистра и е/ё) -> поле
+FORM_KEYS = {**{search_key(label): field for field, label in FORM_LABELS.items()}, **{field: field for field in FORM_LABELS}}
+FORM_LINE_RE = re.compile(r"^\s*([^:]{1,40}?)\s*:\s*(.*)$")
+FORM_TEMPLATE = "\n".join(f"{label}: " for label in FORM_LABELS.values())
+
+def parse_dorama_form(text: str) -> tuple[dict, list[str]]:
+    """Поля из строк «Подпись: значение» (первая строка — сама команда) и список непонятых строк.
+
+    Строка без известной подписи продолжает предыдущее поле: сюжет и комментарий
+    можно писать в несколько абзацев.
+    """
+    record = {}
+    unknown = []
+    field = None
+    for line in text.splitlines()[1:]:
+        match = FORM_LINE_RE.match(line)
+        if match and search_key(match.group(1)) in FORM_KEYS:
+            field = FORM_KEYS[search_key(match.group(1))]
+            record[field] = match.group(2).strip()
+        elif field is not None:
+            record[field] = f"{record[field]}\n{line.strip()}".strip()
+        elif line.strip():
+            unknown.append(line.strip())
+    if "country" in record:
+        record["country"] = match_country(record["country"]) or record["country"]
+    return record, unknown
+
+# Кнопки привязаны к своей форме: у админа может висеть несколько предпросмотров сразу
+def create_form_confirm_keyboard(token: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Добавить", callback_data=f"form_add:confirm:{token}")],
+        [InlineKeyboardButton("Отмена", callback_data=f"form_add:cancel:{token}")],
+    ])
+
+async def add_dorama_form(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if update.effective_user.id not in ADMINS:
+        await message.reply_text("❌ У вас нет прав для добавления дорам.")
+        return
+
+    record, unknown = parse_dorama_form(message.text)
+    if not record:
+        await message.reply_text(
+            "📝 Скопируйте шаблон, заполните и отправьте одним сообщением (первая строка — /add):\n\n"
+            f"/add\n{FORM_TEMPLATE}\n\n"
+            f"Страна: {', '.join(COUNTRIES)}. Год: 1900-2100. Оценка: 1-10. Постер — ссылка с Яндекс.Диска, можно пустую."
+        )
+        return
+    values, error = validate_import_record(record, FORM_LABELS)
+    if unknown:
+        error = f"непонятная строка «{truncate_text(unknown[0], 40)}»"
+    if error:
+        await message.reply_text(f"⚠️ Не добавлено: {error}. Исправьте сообщение и отправьте /add ещё раз.")
+        return
+
+    row = ImportRow(1, values)
+    row.keys = title_keys(values["title_ru"], values["title_en"])
+    await mark_existing_duplicates([row])
+    if values["poster_url"] and not values["poster_url"].startswith(YANDEX_DIRECT_LINK_PREFIX):
+        await resolve_import_posters([row])
+        if row.status == "error":
+            await message.reply_text("⚠️ Не удалось получить прямую ссылку на постер. Проверьте ссылку и отправьте /add ещё раз.")
+            return
+
+    # Ключ — строка: user_data сохраняется в JSON
+    token = str(message.message_id)
+    pending = context.user_data.setdefault("pending_forms", {})
+    pending[token] = values
+    while len(pending) > FORM_PENDING_LIMIT:
+        del pending[next(iter(pending))]  # Самая старая форма устаревает
+    warning = "\n⚠️ Дорама с таким названием уже есть в каталоге." if row.status == "duplicate" else ""
+    # ID появится после вставки: в карточке на его месте прочерк
+    card = render_dorama_card({**values, 0: "—"})
+    await message.reply_text(
+        f"{card}{warning}\nДобавить?", parse_mode="Markdown", reply_markup=create_form_confirm_keyboard(token)
+    )
+
+async def confirm_dorama_form(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMINS:
+        await query.answer()
+        return
+    _, action, *token = query.data.split(":")
+    token = token[0] if token else None  # У кнопок, отправленных до появления номера формы, его нет
+    pending = context.user_data.get("pending_forms") or {}
+    values = pending.pop(token, None)
+    if values is None:
+        await query.answer("Форма устарела")
+        await query.edit_message_text("⚠️ Форма устарела или уже обработана. Отправьте /add ещё раз.")
+        return
+    await query.answer()
+    if action == "cancel":
+        await query.edit_message_text("Добавление отменено.", reply_markup=create_main_menu_keyboard())
+        return
+
+    await wait_for_catalog()
+    row = ImportRow(1, values)
+    try:
+        await insert_imported_rows([row])
+    except aiosqlite.Error as e:
+        logger.error("❌ Ошибка при добавлении дорамы в БД: %s", e, exc_info=True)
+        context.user_data.setdefault("pending_forms", {})[token] = values  # Можно нажать «Добавить» ещё раз
+        await query.edit_message_text(f"❌ Ошибка при добавлении дорамы в БД: {e}", reply_markup=create_form_confirm_keyboard(token))
+        return
+    add_imported_to_indexes([row])
+    logger.info("Дорама %s добавлена формой пользователем %s", row.dorama_id, update.effective_user.id)
+    await query.edit_message_text(
+        f"🎉 Дорама успешно добавлена! ID {row.dorama_id}", reply_markup=create_main_menu_keyboard()
+    )
+
+# ======== Правка дорамы на месте (/edit) ==========
+# Какие поля влияют на производные данные: обновляется только то, что затронуто правкой
+TITLE_INDEX_FIELDS = frozenset(("title_ru", "title_en", "country", "year"))
+CATALOG_STATS_FIELDS = ("country", "year", "personal_rating", "title_ru", "title_en")  # в порядке CatalogStats.add
+SIMILARITY_FIELDS = frozenset(("title_ru", "title_en", "country", "year", "director", "lead_actress", "lead_actor", "personal_rating"))
+SEARCH_KEY_FIELDS = {"title_ru": "title", "title_en": "title", **{field: field for field in PEOPLE_FIELDS}}  # поле -> search_keys.field
+
+class DoramaChange:
+    """Событие «у дорамы изменились поля»: значения до и после и список изменённых полей."""
+    __slots__ = ("dorama_id", "before", "after", "fields")
+
+    def __init__(self, dorama_id: int, before: dict, after: dict):
+        self.dorama_id = dorama_id
+        self.before = before
+        self.after = after
+        self.fields = frozenset(field for field in after if after[field] != before[field])
+
+    def touches(self, fields) -> bool:
+        return not self.fields.isdisjoint(fields)
+
+async def update_dorama_fields(dorama_id: int, updates: dict) -> DoramaChange | None:
+    """Меняет поля дорамы одной транзакцией вместе с её карточкой и затронутыми ключами поиска.
+
+    None — дорамы с таким ID нет.
+    """
+    async with connect_db(DB_PATH) as db:
+        await db.execute("BEGIN IMMEDIATE")  # Значения «до» не могут измениться до конца правки
+        try:
+            async with db.execute(f"SELECT {CARD_COLUMNS} FROM doramas WHERE id = ?", (dorama_id,)) as cursor:
+                cursor.row_factory = aiosqlite.Row
+                row = await cursor.fetchone()
+            if row is None:
+                await db.rollback()
+                return None
+            before = {field: row[field] for field in IMPORT_FIELDS}
+            change = DoramaChange(dorama_id, before, {**before, **updates})
+            if not change.fields:
+                await db.rollback()
+                return change
+
+            fields = sorted(change.fields)
+            await db.execute(
+                f"UPDATE doramas SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+                (*(change.after[field] for field in fields), dorama_id),
+            )
+            await store_rendered_card(db, dorama_id)
+            key_fields = sorted({SEARCH_KEY_FIELDS[field] for field in change.fields if field in SEARCH_KEY_FIELDS})
+            if key_fields:
+                after = change.after
+                placeholders = ", ".join("?" * len(key_fields))
+                await db.execute(
+                    f"DELETE FROM search_keys WHERE dorama_id = ? AND field IN ({placeholders})", (dorama_id, *key_fields)
+                )
+                await db.executemany(
+                    "INSERT INTO search_keys (dorama_id, field, key) VALUES (?, ?, ?)",
+                    [
+                        key_row
+                        for key_row in search_key_rows(
+                            dorama_id, after["title_ru"], after["title_en"], after["director"], after["lead_actress"], after["lead_actor"]
+                        )
+                        if key_row[1] in key_fields
+                    ],
+                )
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    return change
+
+# --- Подписчики на DoramaChange: каждый обновляет свою структуру, только если правка её касается ---
+def refresh_title_index(change: DoramaChange) -> bool:
+    if not change.touches(TITLE_INDEX_FIELDS):
+        return False
+    after = change.after
+    title_index.add(change.dorama_id, after["title_ru"], after["title_en"], after["country"], after["year"])
+    return True
+
+def refresh_people_index(change: DoramaChange) -> bool:
+    # Страна хранится при каждом имени, поэтому при её смене перекладываем всех людей дорамы
+    fields = [field for field in PEOPLE_FIELDS if field in change.fields or "country" in change.fields]
+    for field in fields:
+        people_index.remove(field, change.before[field], change.before["country"])
+        people_index.add(field, change.after[field], change.after["country"])
+    return bool(fields)
+
+def refresh_catalog_stats(change: DoramaChange) -> bool:
+    if not change.touches(CATALOG_STATS_FIELDS):
+        return False
+    catalog_stats.remove(*(change.before[field] for field in CATALOG_STATS_FIELDS))
+    catalog_stats.add(*(change.after[field] for field in CATALOG_STATS_FIELDS))
+    return True
+
+def refresh_inline_results(change: DoramaChange) -> bool:
+    """Убирает из кеша инлайн-поиска только ответы, которые могли измениться.
+
+    Это ответы, где дорама уже есть (в них её карточка и постер), а при смене названия —
+    ещё и запросы, которые теперь её найдут: подстроки нового названия и запросы,
+    на которые отвечали похожими названиями.
+    """
+    stale = [key for key, results in inline_result_cache.items() if any(result.id == str(change.dorama_id) for result in results)]
+    if change.touches(("title_ru", "title_en")):
+        new_keys = "\x00".join(title_keys(change.after["title_ru"], change.after["title_en"]))
+        stale.extend(key for key in inline_result_cache if key in new_keys or not title_index.search(key, limit=1))
+    for key in stale:
+        inline_result_cache.pop(key, None)
+    return bool(stale)
+
+def refresh_similar_doramas(change: DoramaChange) -> bool:
+    if not change.touches(SIMILARITY_FIELDS):
+        return False
+    similarity_rebuilder.schedule()
+    return True
+
+# Подписчик -> что он обновляет (для ответа администратору)
+DORAMA_CHANGE_HANDLERS = (
+    (refresh_title_index, "индекс названий"),
+    (refresh_people_index, "индекс имён"),
+    (refresh_catalog_stats, "счётчики фильтров"),
+    (refresh_inline_results, "кеш инлайн-поиска"),
+    (refresh_similar_doramas, "похожие дорамы"),
+)
+
+def emit_dorama_change(change: DoramaChange) -> list[str]:
+    """Рассылает событие подписчикам; возвращает, что было обновлено."""
+    return [description for handler, description in DORAMA_CHANGE_HANDLERS if handler(change)]
+
+def format_form(command: str, values: dict) -> str:
+    """Текущие значения в виде формы, которую можно поправить и отправить обратно."""
+    lines = [command]
+    for field, label in FORM_LABELS.items():
+        value = values[field]
+        lines.append(f"{label}: {'' if value is None else value}")
+    return "\n".join(lines)
+
+async def edit_dorama_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if update.effective_user.id not in ADMINS:
+        await message.reply_text("❌ У вас нет прав для изменения дорам.")
+        return
+    if not context.args or not context.args[0].isdigit():
+        await message.reply_text(
+            "✏️ Использование: /edit ID — текущие значения в виде формы.\n"
+            "Поправьте нужные строки (остальные можно удалить) и отправьте:\n/edit ID\nАктёр: Ли Мин Хо"
+        )
+        return
+    dorama_id = int(context.args[0])
+
+    record, unknown = parse_dorama_form(message.text)
+    if not record:
+        async with connect_db(DB_PATH) as db:
+            async with db.execute(f"SELECT {CARD_COLUMNS} FROM doramas WHERE id = ?", (dorama_id,)) as cursor:
+                cursor.row_factory = aiosqlite.Row
+                row = await cursor.fetchone()
+        if row is None:
+            await message.reply_text(f"🚫 Дорама с ID {dorama_id} не найдена.")
+            return
+        await message.reply_text(format_form(f"/edit {dorama_id}", row))
+        return
+    if unknown:
+        await message.reply_text(f"⚠️ Не изменено: непонятная строка «{truncate_text(unknown[0], 40)}».")
+        return
+
+    async with connect_db(DB_PATH) as db:
+        async with db.execute(f"SELECT {', '.join(IMPORT_FIELDS)} FROM doramas WHERE id = ?", (dorama_id,)) as cursor:
+            cursor.row_factory = aiosqlite.Row
+            current = await cursor.fetchone()
+    if current is None:
+        await message.reply_text(f"🚫 Дорама с ID {dorama_id} не найдена.")
+        return
+    # Проверяем дораму целиком, как при добавлении; старый постер остаётся как есть, если его не меняют
+    merged = {**dict(current), "poster_url": "", **record}
+    values, error = validate_import_record(merged, FORM_LABELS)
+    if error:
+        await message.reply_text(f"⚠️ Не изменено: {error}.")
+        return
+    updates = {field: values[field] for field in record}
+    if updates.get("poster_url") and not updates["poster_url"].startswith(YANDEX_DIRECT_LINK_PREFIX):
+        row = ImportRow(1, updates)
+        await resolve_import_posters([row])
+        if row.status == "error":
+            await message.reply_text("⚠️ Не удалось получить прямую ссылку на постер. Проверьте ссылку.")
+            return
+
+    await wait_for_catalog()
+    try:
+        change = await update_dorama_fields(dorama_id, updates)
+    except aiosqlite.Error as e:
+        logger.error("❌ Ошибка при изменении дорамы %s: %s", dorama_id, e, exc_info=True)
+        await message.reply_text(f"❌ Ошибка при изменении дорамы в БД: {e}")
+        return
+    if change is None:
+        await message.reply_text(f"🚫 Дорама с ID {dorama_id} не найдена.")
+        return
+    if not change.fields:
+        await message.reply_text("Ничего не изменилось: значения совпадают с текущими.")
+        return
+
+    refreshed = ["карточка", *emit_dorama_change(change)]
+    if change.touches(SEARCH_KEY_FIELDS):
+        refreshed.insert(1, "ключи поиска")
+    logger.info("Дорама %s изменена пользователем %s: %s", dorama_id, update.effective_user.id, ", ".join(sorted(change.fields)))
+    lines = [
+        f"{FORM_LABELS[field]}: «{truncate_text(str(change.before[field]), 60)}» → «{truncate_text(str(change.after[field]), 60)}»"
+        for field in FORM_LABELS if field in change.fields
+    ]
+    await message.reply_text(
+        f"✏️ Дорама {dorama_id} изменена, ID прежний.\n" + "\n".join(lines) + f"\n\nОбновлено: {', '.join(refreshed)}."
+    )
+
+# ======== Хранение состояния диалогов и user_data в SQLite ==========
+class SQLitePersistence(BasePersistence):
+    """Persistence для user_data и ConversationHandler в doramas_users.db.
+
+    Изменения копятся в памяти и пишутся одной транзакцией, user_data
+    пользователя читается из БД только при первом обращении к нему.
+    Задачи conversation_timeout не сохраняются, поэтому при загрузке диалоги,
+    состояние которых не менялось дольше conversation_timeout, отбрасываются,
+    а для остальных schedule_restored_conversation_timeouts заводит таймауты заново.
+    Вытеснение по лимиту сессий (evict_user) освобождает только память: запись в БД
+    остаётся и подгрузится при следующем обновлении пользователя.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH_2,
+        update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+        conversation_timeout: float = CONVERSATION_TIMEOUT,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db_path = db_path
+        self.conversation_timeout = conversation_timeout
+        self.restored_conversations: dict[str, dict[tuple, float]] = {}  # имя -> ключ -> время записи состояния
+        self._loaded_users: set[int] = set()
+        self._evicted_users: set[int] = set()  # drop_user_data от PTB для них не удаляет запись
+        self._dirty_users: dict[int, str | None] = {}  # None — удалить запись
+        self._dirty_conversations: dict[tuple[str, str], tuple[str | None, float]] = {}  # (состояние, время записи)
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    # --- Чтение ---
+    async def get_user_data(self) -> dict:
+        # Данные пользователей подгружаются лениво в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+
+        if user_id in self._dirty_users:
+            raw = self._dirty_users[user_id]
+        else:
+            async with connect_db(self.db_path) as db:
+                async with db.execute("SELECT data FROM persisted_user_data WHERE user_id = ?", (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+            raw = row[0] if row else None
+
+        if raw:
+            for key, value in json.loads(raw).items():
+                # Поля, которых больше нет в сессии, просто пропускаем
+                if key in _SESSION_FIELD_SET and key not in user_data:
+                    user_data[key] = value
+
+    async def get_conversations(self, name: str) -> dict:
+        expired = time.time() - self.conversation_timeout
+        async with connect_db(self.db_path) as db:
+            # Таймаут такого диалога уже сработал бы, а восстановленный диалог висел бы до следующего ответа
+            await db.execute("DELETE FROM persisted_conversations WHERE name = ? AND updated_at <= ?", (name, expired))
+            await db.commit()
+            async with db.execute("SELECT key, state, updated_at FROM persisted_conversations WHERE name = ?", (name,)) as cursor:
+                rows = await cursor.fetchall()
+        self.restored_conversations[name] = {tuple(json.loads(key)): updated_at for key, _, updated_at in rows}
+        return {tuple(json.loads(key)): json.loads(state) for key, state, _ in rows}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Запись ---
+    async def update_user_data(self, user_id: int, data) -> None:
+        self._loaded_users.add(user_id)
+        self._dirty_users[user_id] = json.dumps(dict(data), ensure_ascii=False)
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._evicted_users:
+            self._evicted_users.discard(user_id)
+            return
+        # Сессия истекла (её диалоги sweep_sessions завершает сам) — запись больше не нужна
+        self._loaded_users.discard(user_id)
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def evict_user(self, user_id: int, data) -> None:
+        """Вытеснение из памяти перед Application.drop_user_data: несохранённое пишем, запись оставляем."""
+        if data is not None:
+            await self.update_user_data(user_id, data)  # PTB не сохранит изменения пользователя, которого удаляют
+        self._loaded_users.discard(user_id)  # Вернётся — refresh_user_data прочитает запись заново
+        self._evicted_users.add(user_id)
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        state = None if new_state is None else json.dumps(new_state)
+        self._dirty_conversations[(name, json.dumps(list(key)))] = (state, time.time())
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    # --- Сброс на диск ---
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        try:
+            await asyncio.sleep(PERSISTENCE_FLUSH_DELAY)
+        except asyncio.CancelledError:
+            return
+        # Начатую запись не прерываем, даже если задачу отменили
+        await asyncio.shield(self._write_dirty())
+
+    async def _write_dirty(self) -> None:
+        async with self._flush_lock:
+            users, self._dirty_users = self._dirty_users, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            if not users and not conversations:
+                return
+
+            try:
+                async with connect_db(self.db_path) as db:
+                    await db.executemany(
+                        "INSERT OR REPLACE INTO persisted_user_data (user_id, data) VALUES (?, ?)",
+                        [(user_id, data) for user_id, data in users.items() if data is not None],
+                    )
+                    await db.executemany(
+                        "DELETE FROM persisted_user_data WHERE user_id = ?",
+                        [(user_id,) for user_id, data in users.items() if data is None],
+                    )
+                    await db.executemany(
+                        "INSERT OR REPLACE INTO persisted_conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)",
+                        [(name, key, state, at) for (name, key), (state, at) in conversations.items() if state is not None],
+                    )
+                    await db.executemany(
+                        "DELETE FROM persisted_conversations WHERE name = ? AND key = ?",
+                        [(name, key) for (name, key), (state, at) in conversations.items() if state is None],
+                    )
+                    await db.commit()
+                logger.debug("Persistence: записано пользователей %s, диалогов %s.", len(users), len(conversations))
+            except aiosqlite.Error as e:
+                # Возвращаем несохранённое обратно, не затирая более свежие изменения
+                for user_id, data in users.items():
+                    self._dirty_users.setdefault(user_id, data)
+                for key, entry in conversations.items():
+                    self._dirty_conversations.setdefault(key, entry)
+                logger.error("⚠️ Ошибка при сохранении состояния пользователей: %s", e, exc_info=True)
+
+    async def flush(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_dirty()
+
+# ======== Завершение диалогов вне ConversationHandler ==========
+# Публичного способа завершить диалог извне у ConversationHandler нет. Делаем то же, что его
+# собственный таймаут: _update_state(END), удаление уходит в persistence при update_persistence
+def conversation_handlers(application: Application) -> list[ConversationHandler]:
+    return [
+        handler
+        for handlers in application.handlers.values()
+        for handler in handlers
+        if isinstance(handler, ConversationHandler) and handler.persistent
+    ]
+
+def end_conversation(handler: ConversationHandler, key: tuple) -> None:
+    job = handler.timeout_jobs.pop(key, None)
+    if job is not None:
+        job.schedule_removal()
+    handler._update_state(ConversationHandler.END, key)
+
+def end_user_conversations(application: Application, user_id: int) -> None:
+    for handler in conversation_handlers(application):
+        for key in [key for key in handler._conversations if key[-1] == user_id]:  # Ключ — (chat_id, user_id)
+            end_conversation(handler, key)
+
+# ======== Таймауты диалогов, восстановленных после перезапуска ==========
+def schedule_restored_conversation_timeouts(application: Application) -> None:
+    """Заводит таймауты для диалогов из persistence: PTB ставит их только после ответа пользователя.
+
+    Вызывается после application.initialize(), когда диалоги уже загружены.
+    """
+    persistence = application.persistence
+    if not isinstance(persistence, SQLitePersistence) or application.job_queue is None:
+        return
+    now = time.time()
+    for handler in conversation_handlers(application):
+        if not handler.conversation_timeout:
+            continue
+        for key, updated_at in persistence.restored_conversations.pop(handler.name, {}).items():
+            application.job_queue.run_once(
+                end_restored_conversation,
+                max(0.0, updated_at + handler.conversation_timeout - now),
+                data=(handler, key),
+            )
+
+async def end_restored_conversation(context: ContextTypes.DEFAULT_TYPE) -> None:
+    handler, key = context.job.data
+    if key in handler.timeout_jobs:  # Пользователь ответил после перезапуска — таймаут уже ведёт сам PTB
+        return
+    end_conversation(handler, key)
+    logger.info("Диалог %s %s завершён по таймауту после перезапуска.", handler.name, key)
 
 # ======== Логирование действий пользователей ==========
 async def log_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3216,7 +5988,7 @@ async def log_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        async with aiosqlite.connect(DB_PATH_2) as db:
+        async with connect_db(DB_PATH_2) as db:
             # Запись действия в таблицу user_actions
             await db.execute("""
                 INSERT INTO user_actions (user_id, action_type, action_data, message_id, callback_query_id, timestamp)
@@ -3238,10 +6010,10 @@ async def log_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             await db.commit()
             
-        logger.info(f"💾 Данные пользователя {user_id} обновлены! Тип действия: {action_type}, Данные: {action_data}")
+        activity_logger.debug("💾 Данные пользователя %s обновлены! Тип действия: %s, Данные: %s", user_id, action_type, action_data)
 
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ Ошибка при логировании активности пользователя {user_id}: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при логировании активности пользователя %s: %s", user_id, e, exc_info=True)
 
 async def update_last_actions(db: aiosqlite.Connection, user_id: int, action_type: str, action_data: str, message_id: int, callback_query_id: str, timestamp: str) -> None:
     """Записывает действие пользователя в таблицу user_actions."""
@@ -3251,16 +6023,16 @@ async def update_last_actions(db: aiosqlite.Connection, user_id: int, action_typ
             VALUES (?, ?, ?, ?, ?, ?)
         """
         log_data = (user_id, action_type, action_data, message_id, callback_query_id, timestamp)
-        logger.info(f"SQL-запрос: {sql_query}, Данные: {log_data}")  # Добавьте этот лог
+        db_logger.debug("SQL-запрос: %s, Данные: %s", sql_query, log_data)  # Добавьте этот лог
         await db.execute(sql_query, log_data)
-        logger.info(f"✅ {timestamp} Действие для пользователя {user_id} записано: {action_type} - {action_data}")
+        activity_logger.debug("✅ %s Действие для пользователя %s записано: %s - %s", timestamp, user_id, action_type, action_data)
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ {timestamp} Ошибка при логировании действия для пользователя {user_id}: {e}", exc_info=True)
+        logger.error("⚠️ %s Ошибка при логировании действия для пользователя %s: %s", timestamp, user_id, e, exc_info=True)
 
 # ======== Получение списка пользователей ==========
 async def get_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        async with aiosqlite.connect(DB_PATH_2) as db:
+        async with connect_db(DB_PATH_2) as db:
             async with db.execute("""
                 SELECT u.user_id, u.username, u.first_seen, u.last_seen
                 FROM users u
@@ -3276,11 +6048,157 @@ async def get_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
             for u in users
         ])
         
-        safe_user_info = escape_markdown_v2(user_info)
+        safe_user_info = escape_markdown(user_info, MARKDOWN_V2_ESCAPE)
         await update.message.reply_text(f"👥 *Список пользователей:*\n{safe_user_info}", parse_mode='MarkdownV2')
 
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ Ошибка при получении списка пользователей: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при получении списка пользователей: %s", e, exc_info=True)
+
+# ======== Статистика SQL-запросов (для админов) ==========
+async def show_sql_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMINS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+
+    # Без parse_mode: в тексте запросов много спецсимволов Markdown
+    for part in split_message(sql_tracer.report()):
+        await update.message.reply_text(part)
+
+# ======== Профилирование на живом процессе (для админов) ==========
+class SamplingProfiler:
+    """Раз в interval снимает стек потока с циклом событий из отдельного потока.
+
+    Сам цикл событий не замедляется: нет sys.setprofile, только чтение кадров.
+    Результат — свёрнутые стеки в формате flamegraph.pl / speedscope.
+    """
+
+    __slots__ = ("thread_id", "interval", "stacks", "samples", "_stop", "_thread")
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # (кадр от корня, ..., лист) -> число выборок
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = PROFILE_TOP) -> str:
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        samples = max(1, self.samples)
+        lines = [f"Выборок: {self.samples}, шаг {self.interval * 1000:.0f} мс", "", "Собственное время:"]
+        lines += [f"{count * 100 / samples:5.1f}%  {function}" for function, count in own.most_common(top)]
+        lines += ["", "С вложенными вызовами:"]
+        lines += [f"{count * 100 / samples:5.1f}%  {function}" for function, count in total.most_common(top)]
+        return "\n".join(lines)
+
+class ProfileSession:
+    """Один запуск /profile: выборка стеков и снимки tracemalloc до и после."""
+
+    __slots__ = ("chat_id", "seconds", "profiler", "snapshot", "owns_tracemalloc", "task", "started_at")
+
+    def __init__(self, chat_id: int, seconds: int):
+        self.chat_id = chat_id
+        self.seconds = seconds
+        self.profiler = SamplingProfiler(threading.get_ident())
+        self.owns_tracemalloc = not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.task: asyncio.Task | None = None
+        self.started_at = datetime.now()
+        self.profiler.start()
+
+    def finish(self) -> tuple[str, str, str]:
+        """Останавливает профилирование; возвращает сводку, свёрнутые стеки и разницу выделений памяти."""
+        self.profiler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+        # Выделения самого tracemalloc в разницу не берём
+        exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = snapshot.filter_traces(exclude).compare_to(self.snapshot.filter_traces(exclude), "lineno")
+        memory = "\n".join(str(stat) for stat in diff[:PROFILE_TOP * 2])
+        return self.profiler.summary(), self.profiler.collapsed(), memory
+
+profile_session: ProfileSession | None = None
+
+async def finish_profile(bot: telegram.Bot, session: ProfileSession) -> None:
+    global profile_session
+    profile_session = None
+    # Снимок и сравнение памяти занимают время, цикл событий не держим
+    summary, collapsed, memory = await asyncio.to_thread(session.finish)
+    stamp = session.started_at.strftime("%Y%m%d_%H%M%S")
+    await bot.send_message(session.chat_id, f"Профиль за {session.seconds} с\n\n{summary}"[:4096])
+    await bot.send_document(session.chat_id, collapsed.encode("utf-8"), filename=f"profile_{stamp}.collapsed.txt")
+    await bot.send_document(
+        session.chat_id, (memory or "Нет изменений").encode("utf-8"), filename=f"tracemalloc_{stamp}.txt",
+        caption="Рост памяти за время профилирования (tracemalloc, по строкам)",
+    )
+
+async def run_profile(bot: telegram.Bot, session: ProfileSession) -> None:
+    try:
+        await asyncio.sleep(session.seconds)
+    except asyncio.CancelledError:
+        pass  # /profile_stop — отправляем то, что успели собрать
+    try:
+        await finish_profile(bot, session)
+    except Exception as e:
+        logger.error("⚠️ Ошибка при отправке профиля: %s", e, exc_info=True)
+
+async def start_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global profile_session
+    if update.effective_user.id not in ADMINS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    if profile_session is not None:
+        await update.message.reply_text("⏳ Профилирование уже идёт. Остановить раньше: /profile_stop")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("Использование: /profile [секунды]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    profile_session = ProfileSession(update.effective_chat.id, seconds)
+    profile_session.task = asyncio.create_task(run_profile(context.bot, profile_session))
+    logger.info("Профилирование на %s с запущено пользователем %s", seconds, update.effective_user.id)
+    await update.message.reply_text(f"🔬 Профилирую {seconds} с. Остановить раньше: /profile_stop")
+
+async def stop_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMINS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    if profile_session is None:
+        await update.message.reply_text("Профилирование не запущено.")
+        return
+    profile_session.task.cancel()
 
 # ======== Получение истории действий ==========
 async def get_user_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3290,13 +6208,13 @@ async def get_user_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = user.id
     try:
-        async with aiosqlite.connect(DB_PATH_2) as db:
+        async with connect_db(DB_PATH_2) as db:
             sql_query = "SELECT action_type, action_data, timestamp FROM user_actions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10"
-            logger.info(f"Выполняемый SQL-запрос: {sql_query}, user_id: {user_id}")  # Добавьте этот лог
+            db_logger.debug("Выполняемый SQL-запрос: %s, user_id: %s", sql_query, user_id)  # Добавьте этот лог
             async with db.execute(sql_query, (user_id,)) as cursor:
                 actions = await cursor.fetchall()
         
-        logger.info(f"Результаты запроса: {actions}")  # Добавьте этот лог
+        db_logger.debug("Результаты запроса: %s", actions)  # Добавьте этот лог
 
         if not actions:
             await send_reply(update, "📭 Нет последних действий.")
@@ -3306,7 +6224,7 @@ async def get_user_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_reply(update, f"📝 Последние действия:\n{actions_text}")
 
     except aiosqlite.Error as e:
-        logger.error(f"⚠️ Ошибка при получении истории действий пользователя {user_id}: {e}", exc_info=True)
+        logger.error("⚠️ Ошибка при получении истории действий пользователя %s: %s", user_id, e, exc_info=True)
 
 
     
@@ -3321,6 +6239,8 @@ get_dorama_handler = ConversationHandler(
         CallbackQueryHandler(handle_back_to_menu, pattern="^return_to_main_menu$"),
     ],
     name="get_dorama",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )        
         
 # Хэндлер для поиска по стране
@@ -3344,6 +6264,8 @@ search_country_handler = ConversationHandler(
         CallbackQueryHandler(handle_back_to_menu, pattern="^return_to_main_menu$"),
     ],
     name="search_by_country",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
 
 
@@ -3368,6 +6290,8 @@ search_title_handler = ConversationHandler(
         CallbackQueryHandler(handle_back_to_menu, pattern="^return_to_main_menu$"),
     ],
     name="search_by_title",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
 
 # Хэндлер поиска по актеру
@@ -3386,6 +6310,8 @@ search_actor_handler = ConversationHandler(
         CallbackQueryHandler(cancel, pattern="^cancel$")
     ],
     name="search_by_actor",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
 
 
@@ -3405,6 +6331,8 @@ search_actress_handler = ConversationHandler(
         CallbackQueryHandler(cancel, pattern="^cancel$"),
     ],
     name="search_by_actress",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
 
 # Хэндлер поиска по режиссеру
@@ -3423,6 +6351,24 @@ search_director_handler = ConversationHandler(
         CallbackQueryHandler(cancel, pattern="^cancel$"),
     ],
     name="search_by_director",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
+)
+
+# Хэндлер комбинированного фильтра
+combined_filter_handler = ConversationHandler(
+    entry_points=[CallbackQueryHandler(start_combined_filter, pattern="^combined_filter$")],
+    states={
+        FILTER_MENU: [CallbackQueryHandler(handle_filter_choice, pattern="^filter:")],
+        FILTER_DIRECTOR: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_filter_director)],
+    },
+    fallbacks=[
+        CallbackQueryHandler(handle_back_to_menu, pattern="^return_to_main_menu$"),
+        CallbackQueryHandler(cancel, pattern="^cancel$"),
+    ],
+    name="combined_filter",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
 
 # Хэндлер для удаления дорамы
@@ -3437,6 +6383,8 @@ delete_dorama_handler = ConversationHandler(
     },
     fallbacks=[CallbackQueryHandler(cancel, pattern="^cancel$")],
     name="delete_dorama",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
   
 # Хэндлер добавления дорамы
@@ -3489,6 +6437,8 @@ add_dorama_handler = ConversationHandler(
     },
     fallbacks=[CallbackQueryHandler(cancel, pattern="^cancel$")],
     name="add_dorama",
+    conversation_timeout=CONVERSATION_TIMEOUT,
+    persistent=True,
 )
 
 def stop_application():
@@ -3501,7 +6451,239 @@ signal.signal(signal.SIGINT, lambda sig, frame: stop_application())
 signal.signal(signal.SIGTERM, lambda sig, frame: stop_application())
 
 # ======== Функция для регистрации обработчиков ==========
+# МЕТРИКИ ОБРАБОТЧИКОВ
+# ======== Действие пользователя для метки verb ==========
+# Команды из CommandHandler (заполняется в instrument_handlers). Остальное, что начинается с «/»,
+# идёт под одной меткой: иначе любой пользователь заводил бы новые гистограммы без ограничений
+registered_commands: set[str] = set()
+
+def update_verb(update) -> str:
+    """Префикс callback_data без номеров страниц и ID, команда или тип сообщения."""
+    if not isinstance(update, Update):
+        return "other"
+    if update.callback_query:
+        verb = re.match(r"[A-Za-z_]*", update.callback_query.data or "").group().rstrip("_")
+        return verb or "callback"
+    if update.inline_query:
+        return "inline"
+    if update.message and update.message.text:
+        if update.message.text.startswith("/"):
+            command = update.message.text.split()[0].split("@")[0].lower()  # PTB сравнивает команды без учёта регистра
+            return command if command[1:] in registered_commands else "unknown_command"
+        return "text"
+    return "other"
+
+# ======== Оборачиваем колбэк обработчика замером времени ==========
+def instrument_handler(handler, wrapped: set) -> None:
+    if isinstance(handler, ConversationHandler):
+        for inner in itertools.chain(handler.entry_points, *handler.states.values(), handler.fallbacks):
+            instrument_handler(inner, wrapped)
+        return
+    if isinstance(handler, CommandHandler):
+        registered_commands.update(handler.commands)
+    if id(handler) in wrapped:  # Один и тот же обработчик может стоять в нескольких состояниях
+        return
+    wrapped.add(id(handler))
+    callback = handler.callback
+    name = callback.__name__
+
+    @wraps(callback)
+    async def timed_callback(update, context):
+        verb = update_verb(update)
+        metrics.in_flight[name] += 1
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            metrics.in_flight[name] -= 1
+            metrics.observe_handler(name, verb, time.perf_counter() - started, failed)
+
+    handler.callback = timed_callback
+
+def instrument_handlers(application: Application) -> None:
+    wrapped = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler, wrapped)
+
+# ======== Время запросов к Bot API ==========
+class MeteredRequest(HTTPXRequest):
+    async def do_request(self, url, method, *args, **kwargs):
+        # Последняя часть URL — метод API, без токена. У скачивания файла это имя файла:
+        # все такие запросы идут под одной меткой, иначе меток было бы столько же, сколько файлов
+        endpoint = "file_download" if "/file/" in url else url.rsplit("/", 1)[-1]
+        with metrics.timer("bot_api", endpoint):
+            return await super().do_request(url, method, *args, **kwargs)
+
+# ======== Задержка цикла событий ==========
+class LoopLagMonitor:
+    """Меряет, насколько позже срока просыпается задача в цикле событий.
+
+    Если цикл не отвечает дольше threshold, сторожевой поток пишет в лог стек того,
+    что его держит (синхронный requests.get, тяжёлый расчёт и т.п.).
+    """
+
+    __slots__ = ("interval", "threshold", "recent", "heartbeat", "thread_id", "_task", "_stop", "_watchdog")
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.recent = deque(maxlen=LOOP_LAG_WINDOW)  # Задержки последних замеров, сек
+        self.heartbeat = time.monotonic()
+        self.thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.heartbeat = time.monotonic()
+            self.recent.append(lag)
+            if lag > self.threshold:
+                logger.warning("⏱ Цикл событий был заблокирован %.0f мс", lag * 1000)
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue  # Один стек на одну блокировку
+            reported = True
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                logger.warning(
+                    "⏱ Цикл событий не отвечает уже %.0f мс, сейчас выполняется:\n%s",
+                    stalled * 1000, "".join(traceback.format_stack(frame)),
+                )
+
+    def stats(self) -> dict:
+        current = max(0.0, time.monotonic() - self.heartbeat - self.interval)
+        return {
+            "lag_ms": round(max(current, self.recent[-1] if self.recent else 0.0) * 1000, 1),
+            "max_lag_ms": round(max(self.recent, default=0.0) * 1000, 1),
+        }
+
+loop_monitor = LoopLagMonitor()
+
+# ======== Состояние процесса для /healthz ==========
+class HealthState:
+    __slots__ = ("last_update_at", "queues", "catalog_error")
+
+    def __init__(self):
+        self.last_update_at: float | None = None  # time.monotonic() последнего обновления от Telegram
+        self.queues = {"log": log_listener.queue}  # Имя -> очередь с qsize(); очередь обновлений добавляет main()
+        self.catalog_error: str | None = None  # Последняя ошибка прогрева индексов каталога
+
+health = HealthState()
+
+async def check_database(path: str) -> str | None:
+    """None, если база отвечает, иначе текст ошибки."""
+    try:
+        async def ping():
+            async with connect_db(path) as db:
+                await db.execute("SELECT 1")
+        await asyncio.wait_for(ping(), timeout=HEALTH_DB_TIMEOUT)
+        return None
+    except asyncio.TimeoutError:
+        return f"нет ответа за {HEALTH_DB_TIMEOUT} с"
+    except Exception as e:
+        return str(e)
+
+async def health_report() -> tuple[int, str, str]:
+    databases = {os.path.basename(path): await check_database(path) for path in (DB_PATH, DB_PATH_2)}
+    update_age = None if health.last_update_at is None else time.monotonic() - health.last_update_at
+    problems = [f"{name}: {error}" for name, error in databases.items() if error]
+    if HEALTH_MAX_UPDATE_AGE and update_age is not None and update_age > HEALTH_MAX_UPDATE_AGE:
+        problems.append(f"нет обновлений {update_age:.0f} с")
+    if health.catalog_error:
+        # Индексы в памяти пусты: поиск и списки каталога ничего не найдут
+        problems.append(f"индексы каталога: {health.catalog_error}")
+    report = {
+        "status": "fail" if problems else "ok",
+        "problems": problems,
+        "loop": loop_monitor.stats(),
+        "databases": {name: error or "ok" for name, error in databases.items()},
+        "catalog": health.catalog_error or ("ok" if catalog_warmup is not None and catalog_warmup.done() else "warming"),
+        "queues": {name: pending.qsize() for name, pending in health.queues.items()},
+        "handlers_in_flight": sum(metrics.in_flight.values()),
+        "last_update_age_s": None if update_age is None else round(update_age, 1),
+    }
+    return 503 if problems else 200, "application/json; charset=utf-8", json.dumps(report, ensure_ascii=False) + "\n"
+
+# ======== Локальный HTTP-сервер для /metrics и /healthz ==========
+# Обработчик маршрута возвращает (статус, Content-Type, тело) или корутину с таким результатом
+HTTP_ROUTES = {
+    "/metrics": lambda: (200, "text/plain; version=0.0.4; charset=utf-8", metrics.render()),
+    "/healthz": health_report,
+}
+
+async def handle_http_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = (await asyncio.wait_for(reader.readline(), timeout=5)).decode("latin-1")
+        method, _, rest = request_line.partition(" ")
+        path = rest.split(" ", 1)[0].split("?", 1)[0]
+        route = HTTP_ROUTES.get(path)
+        if method != "GET" or route is None:
+            status, content_type, body = 404, "text/plain; charset=utf-8", "Not found\n"
+        else:
+            result = route()
+            status, content_type, body = await result if asyncio.iscoroutine(result) else result
+        payload = body.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + payload
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug("HTTP-запрос к серверу метрик прерван: %s", e)
+    finally:
+        writer.close()
+
+async def start_http_server():
+    if not METRICS_PORT:
+        return None
+    server = await asyncio.start_server(handle_http_request, METRICS_HOST, METRICS_PORT)
+    logger.info("📈 Метрики и проверка здоровья: http://%s:%s/metrics, /healthz", METRICS_HOST, METRICS_PORT)
+    return server
+
+
 def setup_handlers(application: Application):
+
+    # Отслеживаем активность пользователей до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
+    if application.job_queue:
+        application.job_queue.run_repeating(sweep_sessions, interval=SESSION_SWEEP_INTERVAL, first=SESSION_SWEEP_INTERVAL)
+        application.job_queue.run_repeating(run_maintenance, interval=MAINTENANCE_CHECK_INTERVAL, first=MAINTENANCE_CHECK_INTERVAL)
+        if BACKUP_INTERVAL:
+            application.job_queue.run_repeating(run_backups, interval=BACKUP_INTERVAL, first=BACKUP_FIRST_DELAY)
+    else:
+        logger.warning("JobQueue недоступна: неактивные сессии не будут очищаться, обслуживание баз не запустится.")
     
     # Установим обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -3510,6 +6692,15 @@ def setup_handlers(application: Application):
     application.add_handler(CommandHandler("search_by_title", start_search_by_title))
     application.add_handler(CommandHandler("users", get_users))
     application.add_handler(CommandHandler("get_user_actions", get_user_actions))
+    application.add_handler(CommandHandler("sql_stats", show_sql_stats))
+    application.add_handler(CommandHandler("profile", start_profile))
+    application.add_handler(CommandHandler("profile_stop", stop_profile))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("add", add_dorama_form))
+    application.add_handler(CommandHandler("edit", edit_dorama_command))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/import(@\w+)?(\s|$)"), import_command))
     application.add_handler(CallbackQueryHandler(show_menu, pattern="^show_menu$"))
     application.add_handler(CallbackQueryHandler(handle_back_to_menu, pattern="^return_to_main_menu$"))
 
@@ -3524,6 +6715,11 @@ def setup_handlers(application: Application):
     application.add_handler(search_actor_handler)  # Хэндлер для поиска по актеру
     application.add_handler(search_actress_handler)  # Хэндлер для поиска по актрисе
     application.add_handler(search_director_handler)  # Хэндлер для поиска по режиссеру
+    application.add_handler(combined_filter_handler)  # Хэндлер комбинированного фильтра
+    application.add_handler(InlineQueryHandler(
+        inline_people_autocomplete, pattern=rf"(?i)^({'|'.join(INLINE_PEOPLE_PREFIXES)}) "
+    ))  # Инлайн-подсказки имён
+    application.add_handler(InlineQueryHandler(inline_catalog_search))  # Инлайн-поиск по каталогу
 
     # Установим обработчики для списков дорам и фильтров
     application.add_handler(CallbackQueryHandler(list_doramas_menu, pattern="^list_doramas$"))
@@ -3553,6 +6749,8 @@ def setup_handlers(application: Application):
     # Установим обработчики для пагинации
     application.add_handler(CallbackQueryHandler(handle_pagination, pattern="^(country|title|actor|actress|director):\d+$"))
     application.add_handler(CallbackQueryHandler(handle_show_dorama, pattern="^show_dorama:"))
+    application.add_handler(CallbackQueryHandler(handle_similar_doramas, pattern=r"^similar:\d+$"))
+    application.add_handler(CallbackQueryHandler(confirm_dorama_form, pattern=r"^form_add:(confirm|cancel)(:\d+)?$"))
     
     #Определяем callback_handler
     application.add_handler(CallbackQueryHandler(handle_callback_query))
@@ -3560,33 +6758,135 @@ def setup_handlers(application: Application):
     application.add_handler(MessageHandler(filters.COMMAND, unknown))  
     application.add_error_handler(error_handler)
 
+    # Замеряем время всех зарегистрированных обработчиков
+    instrument_handlers(application)
+
+
+def build_application(base_url: str | None = None, persistence_path: str | None = None) -> Application:
+    """Собирает Application; base_url — адрес Bot API вместо api.telegram.org (к нему дописывается токен)."""
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .context_types(ContextTypes(user_data=UserSession))
+        .persistence(SQLitePersistence(persistence_path or DB_PATH_2))
+        .request(MeteredRequest())
+    )
+    if base_url:
+        # Файлы (для /import) скачиваются с того же сервера: .../bot -> .../file/bot
+        builder = builder.base_url(base_url).base_file_url(base_url.removesuffix("bot") + "file/bot")
+    return builder.build()
+
+
+# ======== Запуск: отчёт о времени и прогрев кэшей ==========
+class StartupTimer:
+    """Длительность фаз запуска от старта процесса — для одной строки в логе."""
+    __slots__ = ("phases", "_last")
+
+    def __init__(self):
+        self.phases = []
+        self._last = PROCESS_STARTED
+
+    def lap(self, name: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        phases = ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.phases)
+        return f"{self._last - PROCESS_STARTED:.2f} с ({phases})"
+
+catalog_warmup: asyncio.Task | None = None  # Построение индексов в памяти после запуска
+
+async def wait_for_catalog() -> None:
+    """Обработчики, которым нужны индексы в памяти, дожидаются окончания прогрева."""
+    if catalog_warmup is not None and not catalog_warmup.done():
+        await asyncio.shield(catalog_warmup)
+
+async def warm_up_catalog() -> None:
+    """Строит индексы в памяти. При ошибке (например, база занята) повторяет с растущей паузой;
+    пока индексы не построены, /healthz отвечает 503 — иначе поиск молча ничего бы не находил."""
+    started = time.perf_counter()
+    for attempt in range(1, CATALOG_WARMUP_ATTEMPTS + 1):
+        try:
+            # Дожидаемся всех построений, чтобы следующая попытка не шла параллельно с остатками этой
+            results = await asyncio.gather(
+                build_title_index(), build_people_index(), build_catalog_stats(), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            break
+        except Exception as e:
+            health.catalog_error = f"попытка {attempt} из {CATALOG_WARMUP_ATTEMPTS}: {e}"
+            logger.error("⚠️ Ошибка при прогреве индексов каталога (%s)", health.catalog_error, exc_info=True)
+            if attempt == CATALOG_WARMUP_ATTEMPTS:
+                return
+            await asyncio.sleep(CATALOG_WARMUP_BACKOFF * 2 ** (attempt - 1))
+    health.catalog_error = None
+    logger.info(
+        "🔥 Индексы каталога прогреты за %.2f с (%.2f с от запуска процесса)",
+        time.perf_counter() - started, time.perf_counter() - PROCESS_STARTED,
+    )
+    try:
+        await ensure_similar_doramas()
+    except Exception as e:
+        logger.error("⚠️ Ошибка при подготовке похожих дорам: %s", e, exc_info=True)
+
 
 # --- Главная функция ---
 # Основная функция запуска бота
 async def main():
-    application = Application.builder().token(TOKEN).build()
+    timer = StartupTimer()
+    timer.lap("импорт")
+    application = build_application(BOT_API_URL)
+    timer.lap("Application")
 
-    # Инициализация базы данных
+    # Инициализация баз данных: файлы независимы, миграции идут одновременно
     try:
-        await init_db()
-        await init_user_db()
+        await asyncio.gather(init_db(), init_user_db())
     except Exception as e:
-        logger.error(f"Ошибка при инициализации БД: {e}", exc_info=True)
+        logger.error("Ошибка при инициализации БД: %s", e, exc_info=True)
         return  # Прерываем запуск бота, если не удалось инициализировать БД
-    
+    timer.lap("базы данных")
+
     setup_handlers(application)
+    health.queues["updates"] = application.update_queue
+    loop_monitor.start()
+    try:
+        http_server = await start_http_server()
+    except OSError as e:
+        # Порт занят или адрес недоступен: бот работает и без /metrics и /healthz
+        logger.error("⚠️ Не удалось запустить HTTP-сервер метрик на %s:%s: %s", METRICS_HOST, METRICS_PORT, e)
+        http_server = None
+    timer.lap("обработчики")
+
+    async def after_initialize(application: Application) -> None:
+        # getMe выполнен, дальше PTB сразу начинает опрос: индексы строим уже параллельно с ним
+        global catalog_warmup
+        timer.lap("Bot API")
+        schedule_restored_conversation_timeouts(application)
+        logger.info("🚀 Бот готов принимать обновления через %s", timer.report())
+        catalog_warmup = asyncio.create_task(warm_up_catalog())
+
+    application.post_init = after_initialize
 
     # Запуск бота
     try:
-        logger.info("Бот успешно запущен.")
         await application.run_polling()
     except RuntimeError as e:
         if "Cannot close a running event loop" in str(e):
             pass
+    finally:
+        loop_monitor.stop()
+        similarity_rebuilder.shutdown()
+        if http_server is not None:
+            http_server.close()
     
 
 # --- Запуск программы ---
 if __name__ == "__main__":
+    import nest_asyncio
+
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     nest_asyncio.apply()
     asyncio.run(main())
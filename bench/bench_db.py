@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Бенчмарк всех путей запросов каталога на сгенерированных базах (generate_catalog.py).
+# Обработчики вызываются целиком, с поддельными Update/CallbackQuery вместо Telegram,
+# поэтому в замер попадают и SQL, и сборка клавиатур. Результат — JSON.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/bench_db.py bench/data/doramas_10k.db bench/data/doramas_100k.db --output bench/results.json
+#     python bench/bench_db.py bench/data/doramas_100k.db --baseline bench/results.json  # код 1 при регрессии
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from bench_title_index import percentile  # noqa: E402
+
+# ======== Поддельные объекты Telegram: ответы бота просто отбрасываются ==========
+class FakeMessage:
+    async def reply_text(self, *args, **kwargs):
+        return self
+
+    async def reply_photo(self, *args, **kwargs):
+        return self
+
+    async def delete(self):
+        return True
+
+class FakeCallbackQuery:
+    def __init__(self, data, user):
+        self.data = data
+        self.from_user = user
+        self.message = FakeMessage()
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, *args, **kwargs):
+        return self.message
+
+def fake_update(data):
+    user = SimpleNamespace(id=1, username="bench", first_name="Bench")
+    return SimpleNamespace(
+        callback_query=FakeCallbackQuery(data, user), message=None, inline_query=None,
+        effective_user=user, effective_chat=SimpleNamespace(id=1),
+    )
+
+def fake_context():
+    return SimpleNamespace(user_data=bot.UserSession(), bot=None)
+
+# ======== Пути запросов: (название, фабрика корутины по образцу дорамы) ==========
+def query_paths(rnd, years, letters):
+    def by_country(sample):
+        return bot.fetch_doramas_page(fake_update("country"), fake_context(), sample["country"], rnd.randint(0, 5))
+
+    def by_title(sample):
+        word = rnd.choice(sample["title_ru"].split())
+        return bot.fetch_doramas_by_title_page(fake_update("title:0"), fake_context(), word, 0)
+
+    def actors(sample):
+        return bot.fetch_actors_from_db(sample["lead_actor"][:rnd.randint(2, 6)], 0)
+
+    def by_letter(sample):
+        context = fake_context()
+        context.user_data["language"] = rnd.choice(("ru", "en"))
+        return bot.show_doramas_by_letter(fake_update(f"filter_by_letter_{rnd.choice(letters)}"), context)
+
+    def by_rating(sample):
+        return bot.show_doramas_by_rating(fake_update(f"filter_by_rating_{sample['personal_rating']}"), fake_context())
+
+    def year_list(sample):
+        return bot.list_years(fake_update(f"list_years:{rnd.randint(0, 2)}"), fake_context())
+
+    def by_year(sample):
+        return bot.list_doramas_by_year(fake_update(f"list_doramas_year_{rnd.choice(years)}_{rnd.randint(0, 5)}"), fake_context())
+
+    def show_dorama(sample):
+        return bot.handle_show_dorama(fake_update(f"show_dorama:{sample['id']}"), fake_context())
+
+    return {
+        "fetch_doramas_page": by_country,
+        "fetch_doramas_by_title_page": by_title,
+        "fetch_actors_from_db": actors,
+        "show_doramas_by_letter": by_letter,
+        "show_doramas_by_rating": by_rating,
+        "list_years": year_list,
+        "list_doramas_by_year": by_year,
+        "handle_show_dorama": show_dorama,
+    }
+
+def summarize(timings):
+    return {
+        "calls": len(timings),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+async def bench_database(path, iterations, seed):
+    bot.DB_PATH = path
+    startup = {}
+    for name, build in (
+        ("build_title_index", bot.build_title_index),
+        ("build_people_index", bot.build_people_index),
+        ("build_catalog_stats", bot.build_catalog_stats),
+    ):
+        started = time.perf_counter()
+        await build()
+        startup[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    with sqlite3.connect(path) as db:
+        db.row_factory = sqlite3.Row
+        rows = db.execute("SELECT COUNT(*) FROM doramas").fetchone()[0]
+        samples = db.execute(
+            "SELECT id, title_ru, country, year, lead_actor, personal_rating FROM doramas WHERE id IN "
+            "(SELECT abs(random()) % ? + 1 FROM doramas LIMIT ?)",
+            (rows, iterations),
+        ).fetchall()
+        years = [year for (year,) in db.execute("SELECT DISTINCT year FROM doramas")]
+        letters = [letter for (letter,) in db.execute("SELECT DISTINCT substr(title_ru, 1, 1) FROM doramas")]
+
+    rnd = random.Random(seed)
+    paths = {}
+    for name, make_call in query_paths(rnd, years, letters).items():
+        timings = []
+        for sample in samples:
+            call = make_call(sample)
+            started = time.perf_counter()
+            await call
+            timings.append((time.perf_counter() - started) * 1000)
+        paths[name] = summarize(timings)
+        print(f"  {name:<28} p50={paths[name]['p50_ms']:8.3f} мс  p99={paths[name]['p99_ms']:8.3f} мс", file=sys.stderr)
+    return {"rows": rows, "startup_ms": startup, "paths": paths}
+
+def find_regressions(results, baseline, tolerance):
+    """(база, путь, было, стало) для путей, чьё p99 выросло больше чем в tolerance раз."""
+    regressions = []
+    for name, result in results["databases"].items():
+        before = baseline.get("databases", {}).get(name)
+        if not before:
+            continue
+        for path, stats in result["paths"].items():
+            old = before["paths"].get(path)
+            if old and stats["p99_ms"] > old["p99_ms"] * tolerance:
+                regressions.append((name, path, old["p99_ms"], stats["p99_ms"]))
+    return regressions
+
+async def main_async(args):
+    results = {"python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version, "databases": {}}
+    for path in args.databases:
+        print(f"{path}:", file=sys.stderr)
+        results["databases"][os.path.basename(path)] = await bench_database(path, args.iterations, args.seed)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов каталога")
+    parser.add_argument("databases", nargs="+", help="Файлы баз из generate_catalog.py")
+    parser.add_argument("--iterations", type=int, default=200, help="Вызовов каждого пути на базу")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Куда записать JSON (по умолчанию — stdout)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Во сколько раз p99 может вырасти без ошибки")
+    args = parser.parse_args()
+
+    # Медленные запросы здесь ожидаемы, в stderr оставляем только ошибки
+    logging.getLogger("dorama").setLevel(logging.ERROR)
+    results = asyncio.run(main_async(args))
+
+    report = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for name, path, old, new in regressions:
+            print(f"РЕГРЕССИЯ {name} {path}: p99 {old} мс -> {new} мс", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Микробенчмарк экранирования Markdown: прежние функции против escape_markdown с таблицами замен.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/bench_markdown_escape.py --cards 5000
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NeZabuDrama import escape_markdown, safe_get, render_dorama_card, MARKDOWN_V2_ESCAPE, CARD_ESCAPE  # noqa: E402
+from bench_title_index import WORDS_RU, WORDS_EN, percentile  # noqa: E402
+
+# ======== Прежние реализации (для сравнения) ==========
+def legacy_prevent_hashtag_linking(text):
+    return text.replace("#", "#\u200b")
+
+def legacy_escape_markdown(text):
+    for char in "*[]()~`>#+-=|{}.!":
+        text = text.replace(char, "\\" + char)
+    return text
+
+def legacy_escape_markdown_v2(text):
+    escape_chars = r"_*[]()~`>#+-=|{}.!"
+    return "".join("\\" + char if char in escape_chars else char for char in text)
+
+def legacy_remove_extra_escape(text):
+    for char in ".!~\\-":
+        text = text.replace("\\" + char, char)
+    return text
+
+def legacy_safe_get(value):
+    if value is None:
+        return "Не указано"
+    if isinstance(value, str):
+        return legacy_remove_extra_escape(legacy_escape_markdown(legacy_prevent_hashtag_linking(value)))
+    return "Не указано"
+
+def legacy_render_card(row):
+    return "".join((
+        f"*🇷🇺 {legacy_safe_get(row['title_ru'])}*\n",
+        f"*🇬🇧 {legacy_safe_get(row['title_en'])}*\n\n",
+        f"*🌏Страна:* {legacy_safe_get(row['country'])}\n",
+        f"*📅Год:* {legacy_safe_get(str(row['year']))}\n\n",
+        f"*🎬Режиссер:* {legacy_safe_get(row['director'])}\n",
+        f"*👸🏻Главная актриса:* {legacy_safe_get(row['lead_actress'])}\n",
+        f"*🤴🏻Главный актер:* {legacy_safe_get(row['lead_actor'])}\n\n",
+        f"*🎞️Сюжет:* {legacy_safe_get(row['plot'])}\n\n",
+        f"*⭐Личная оценка:* {legacy_safe_get(str(row['personal_rating']))}\n",
+        f"*💬Комментарий:* {legacy_safe_get(row['comment'])}\n",
+        f"*ID* {(row[0])}\n",
+    ))
+
+# ======== Тестовые данные ==========
+PUNCTUATION = list("*[]()~`>#+-=|{}.!_,:?")
+
+def make_text(rnd, words, size):
+    parts = []
+    for _ in range(size):
+        parts.append(rnd.choice(words))
+        if rnd.random() < 0.3:
+            parts.append(rnd.choice(PUNCTUATION))
+    return " ".join(parts)
+
+class CardRow(dict):
+    """Строка как у aiosqlite.Row: доступ и по имени колонки, и по номеру (row[0] — id)."""
+    def __getitem__(self, key):
+        return dict.__getitem__(self, "id" if key == 0 else key)
+
+def make_rows(count, seed=42):
+    rnd = random.Random(seed)
+    for dorama_id in range(1, count + 1):
+        yield CardRow(
+            id=dorama_id,
+            title_ru=make_text(rnd, WORDS_RU, 3).capitalize(),
+            title_en=make_text(rnd, WORDS_EN, 3).title(),
+            country="Южная Корея",
+            year=rnd.randint(1995, 2025),
+            director="Ли Мин Хо",
+            lead_actress="Пак Шин Хе",
+            lead_actor="Ким Су Хён",
+            personal_rating=rnd.randint(1, 10),
+            comment=make_text(rnd, WORDS_RU, 30),
+            plot=make_text(rnd, WORDS_RU, 120),
+            poster_url=None,
+        )
+
+def measure(function, items, repeat):
+    timings = []
+    for item in items:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            function(item)
+        timings.append((time.perf_counter() - started) * 1_000_000 / repeat)
+    return timings
+
+def report(name, timings):
+    print(f"{name:<24} p50={statistics.median(timings):7.2f} мкс  p99={percentile(timings, 0.99):7.2f} мкс")
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк экранирования Markdown")
+    parser.add_argument("--cards", type=int, default=5_000, help="Количество карточек")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов на одну карточку")
+    args = parser.parse_args()
+
+    rows = list(make_rows(args.cards))
+    texts = [row["plot"] for row in rows]
+
+    # Новые функции должны давать тот же текст, что и старые
+    for row in rows:
+        assert render_dorama_card(row) == legacy_render_card(row), row["id"]
+    for text in texts:
+        assert escape_markdown(text) == legacy_escape_markdown(text)
+        assert escape_markdown(text, MARKDOWN_V2_ESCAPE) == legacy_escape_markdown_v2(text)
+        assert safe_get(text) == escape_markdown(text, CARD_ESCAPE) == legacy_safe_get(text)
+
+    print(f"Карточек: {args.cards}, средняя длина сюжета: {statistics.mean(map(len, texts)):.0f} символов")
+    results = {}
+    for name, function, items in (
+        ("escape (старая)", legacy_escape_markdown, texts),
+        ("escape (таблица)", escape_markdown, texts),
+        ("escape_v2 (посимвольно)", legacy_escape_markdown_v2, texts),
+        ("escape_v2 (таблица)", lambda text: escape_markdown(text, MARKDOWN_V2_ESCAPE), texts),
+        ("card (старая)", legacy_render_card, rows),
+        ("card (новая)", render_dorama_card, rows),
+    ):
+        results[name] = measure(function, items, args.repeat)
+        report(name, results[name])
+
+    speedup = statistics.median(results["card (старая)"]) / statistics.median(results["card (новая)"])
+    print(f"Сборка карточки быстрее в {speedup:.1f} раза; при показе карточки экранирования больше нет (rendered_card)")
+    sys.exit(1 if speedup < 1 else 0)
+
+if __name__ == "__main__":
+    main()
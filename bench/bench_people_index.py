@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Бенчмарк индекса имён (PeopleIndex) для автодополнения.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/bench_people_index.py --size 50000
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NeZabuDrama import PeopleIndex, PEOPLE_FIELDS, COUNTRIES, INLINE_PEOPLE_LIMIT  # noqa: E402
+from bench_title_index import SYLLABLES, percentile  # noqa: E402
+
+def make_name(rnd):
+    # Корейское имя: фамилия из одного слога и имя из двух
+    return " ".join(rnd.choice(SYLLABLES).capitalize() for _ in range(3))
+
+def make_rows(size, seed=42):
+    rnd = random.Random(seed)
+    # Популярность людей неравномерная: небольшая часть имён встречается в большинстве дорам
+    people = [make_name(rnd) for _ in range(max(1, size // 5))]
+    weights = [1 / (rank + 1) for rank in range(len(people))]
+    for _ in range(size):
+        director, actress, actor = rnd.choices(people, weights, k=3)
+        yield director, actress, actor, rnd.choice(COUNTRIES)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк PeopleIndex")
+    parser.add_argument("--size", type=int, default=50_000, help="Количество дорам")
+    parser.add_argument("--queries", type=int, default=2_000, help="Количество запросов")
+    parser.add_argument("--budget-ms", type=float, default=1.0, help="Допустимое p99 на один запрос, мс")
+    args = parser.parse_args()
+
+    rows = list(make_rows(args.size))
+    index = PeopleIndex()
+    started = time.perf_counter()
+    index.load(rows)
+    build_seconds = time.perf_counter() - started
+
+    # Запросы — начало имени длиной 2..8 букв, как при наборе в инлайн-режиме
+    rnd = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        director, actress, actor, _ = rnd.choice(rows)
+        name = rnd.choice((director, actress, actor))
+        queries.append((rnd.choice(PEOPLE_FIELDS), name[:rnd.randint(2, 8)]))
+
+    timings = []
+    for field, text in queries:
+        started = time.perf_counter()
+        index.search(field, text, limit=INLINE_PEOPLE_LIMIT)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    p99 = percentile(timings, 0.99)
+    print(f"Дорам: {args.size}, людей: {len(index)}, построение индекса: {build_seconds:.2f} с")
+    print(
+        f"search   p50={statistics.median(timings):.3f} мс  p99={p99:.3f} мс  "
+        f"max={max(timings):.3f} мс  запросов={len(timings)}  (бюджет {args.budget_ms} мс)"
+    )
+    sys.exit(1 if p99 > args.budget_ms else 0)
+
+if __name__ == "__main__":
+    main()
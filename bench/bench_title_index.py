@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Бенчмарк триграммного индекса названий (TitleIndex).
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/bench_title_index.py --size 50000
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NeZabuDrama import TitleIndex, COUNTRIES  # noqa: E402
+
+WORDS_RU = [
+    "любовь", "луна", "сердце", "король", "принцесса", "тайна", "весна", "дворец", "город",
+    "звезда", "ночь", "судьба", "воин", "гоблин", "доктор", "адвокат", "повар", "призрак",
+    "море", "цветок", "клятва", "империя", "школа", "отель", "небо", "память", "осень",
+    "зима", "лето", "снег", "дождь", "ветер", "огонь", "тень", "свет", "мечта", "песня",
+    "танец", "семья", "брат", "сестра", "дочь", "сын", "учитель", "генерал", "министр",
+    "наследник", "невеста", "жених", "клан", "меч", "нефрит", "лотос", "феникс", "дракон",
+    "лис", "тигр", "журавль", "сад", "река", "гора", "остров", "деревня", "столица",
+    "полиция", "больница", "суд", "игра", "код", "сигнал", "время", "вечность", "обещание",
+]
+WORDS_EN = [
+    "love", "moon", "heart", "king", "princess", "secret", "spring", "palace", "city",
+    "star", "night", "destiny", "warrior", "goblin", "doctor", "lawyer", "chef", "ghost",
+    "sea", "flower", "oath", "empire", "school", "hotel", "sky", "memory", "autumn",
+    "winter", "summer", "snow", "rain", "wind", "fire", "shadow", "light", "dream", "song",
+    "dance", "family", "brother", "sister", "daughter", "son", "teacher", "general", "minister",
+    "heir", "bride", "groom", "clan", "sword", "jade", "lotus", "phoenix", "dragon",
+    "fox", "tiger", "crane", "garden", "river", "mountain", "island", "village", "capital",
+    "police", "hospital", "court", "game", "code", "signal", "time", "eternity", "promise",
+]
+# Слоги для романизированных корейских/китайских/японских слов
+SYLLABLES = ["min", "ho", "seo", "jun", "ji", "woo", "hyun", "yeon", "xiao", "zhang", "li",
+             "wei", "chen", "yu", "mei", "hana", "sora", "taka", "kyo", "ryu", "shin", "hae"]
+
+def make_titles(size, seed=42):
+    rnd = random.Random(seed)
+    for dorama_id in range(1, size + 1):
+        length = rnd.randint(1, 4)
+        picks = [rnd.randrange(len(WORDS_RU)) for _ in range(length)]
+        title_ru = " ".join(WORDS_RU[i] for i in picks).capitalize()
+        title_en = " ".join(WORDS_EN[i] for i in picks).title()
+        if rnd.random() < 0.3:
+            # Часть названий — романизированные имена собственные
+            name = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3)))
+            title_en = f"{title_en} {name.capitalize()}"
+        if rnd.random() < 0.1:
+            season = rnd.randint(2, 5)
+            title_ru, title_en = f"{title_ru} {season}", f"{title_en} {season}"
+        yield dorama_id, title_ru, title_en, rnd.choice(COUNTRIES), rnd.randint(1995, 2025)
+
+def typo(word, rnd):
+    i = rnd.randrange(len(word))
+    return word[:i] + word[i + 1:] if rnd.random() < 0.5 else word[:i] + word[i] + word[i:]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк TitleIndex")
+    parser.add_argument("--size", type=int, default=50_000, help="Количество названий в индексе")
+    parser.add_argument("--queries", type=int, default=2_000, help="Количество поисковых запросов")
+    parser.add_argument("--budget-ms", type=float, default=1.0, help="Допустимое p99 на один поиск, мс")
+    parser.add_argument("--suggest-budget-ms", type=float, default=1.0, help="Допустимое p99 на подбор подсказок, мс")
+    args = parser.parse_args()
+
+    index = TitleIndex()
+    started = time.perf_counter()
+    index.load(make_titles(args.size))
+    build_seconds = time.perf_counter() - started
+
+    rnd = random.Random(7)
+    words = WORDS_RU + WORDS_EN
+    queries = []
+    for _ in range(args.queries):
+        word = rnd.choice(words)
+        queries.append(typo(word, rnd) if rnd.random() < 0.5 else word)
+
+    # Как в боте: подсказки ищем только если точных совпадений нет
+    timings = {"search": [], "suggest": []}
+    for text in queries:
+        started = time.perf_counter()
+        found = index.search(text)
+        timings["search"].append((time.perf_counter() - started) * 1000)
+        if not found:
+            started = time.perf_counter()
+            index.suggest(text)
+            timings["suggest"].append((time.perf_counter() - started) * 1000)
+
+    print(f"Названий: {args.size}, построение индекса: {build_seconds:.2f} с")
+    failed = False
+    for name, values in timings.items():
+        if not values:
+            continue
+        p99 = percentile(values, 0.99)
+        budget = args.budget_ms if name == "search" else args.suggest_budget_ms
+        failed |= p99 > budget
+        print(
+            f"{name:8s} p50={statistics.median(values):.3f} мс  p99={p99:.3f} мс  "
+            f"max={max(values):.3f} мс  запросов={len(values)}  (бюджет {budget} мс)"
+        )
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Проверка подтверждения формы /add: у админа два предпросмотра («Первая», затем «Вторая»),
+# «Добавить» под старым должен добавить именно «Первую», а повторное нажатие — ответить,
+# что форма устарела. Бот работает с пустым каталогом во временном каталоге и поддельным
+# Bot API (fake_bot_api.py); завершается с кодом 1, если что-то пошло не так.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/check_add_form.py
+
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+from load_bot import LoadStats, SimulatedUser, start_application  # noqa: E402
+
+def form(title: str) -> str:
+    return (
+        f"/add\nНазвание: {title}\nАнглийское название: {title} test\nСтрана: Китай\nГод: 2020\n"
+        "Режиссёр: Ли Мин\nАктриса: Ким А\nАктёр: Пак Бо\nОценка: 8\nСюжет: сюжет\nКомментарий: ок\nПостер:"
+    )
+
+def button(markup: dict | None, text: str) -> str | None:
+    for row in (markup or {}).get("inline_keyboard", []):
+        for key in row:
+            if key["text"] == text:
+                return key["callback_data"]
+    return None
+
+async def run_check(workdir: str) -> list[str]:
+    api = FakeBotApi()
+    database = os.path.join(workdir, "doramas.db")
+    application = await start_application(api, database, workdir)
+    admin = SimulatedUser(0, application, api, None, LoadStats(), 1)
+    admin.user["id"] = admin.chat["id"] = bot.ADMINS[0]
+    chat = api.chat(bot.ADMINS[0])
+    sequence = iter(range(1, 1000))
+
+    async def send(update: dict) -> tuple[int, str, dict | None]:
+        await application.process_update(Update.de_json({"update_id": next(sequence), **update}, application.bot))
+        return chat.last()
+
+    problems = []
+    try:
+        first_id, first_text, first_markup = await send(admin.text_update(form("Первая")))
+        await send(admin.text_update(form("Вторая")))
+        confirm = button(first_markup, "✅ Добавить")
+        if confirm is None:
+            return [f"под первой формой нет кнопки «Добавить»: {first_text!r}"]
+
+        _, text, _ = await send(admin.callback_update(first_id, first_text, confirm))
+        with sqlite3.connect(database) as db:
+            titles = [row[0] for row in db.execute("SELECT title_ru FROM doramas ORDER BY id")]
+        print(f"после «Добавить» под первой формой: {text.splitlines()[0]!r}, в каталоге {titles}")
+        if titles != ["Первая"]:
+            problems.append(f"добавлено {titles} вместо ['Первая']")
+
+        _, text, _ = await send(admin.callback_update(first_id, first_text, confirm))
+        print(f"повторное нажатие: {text!r}")
+        if "устарела" not in text:
+            problems.append(f"повторное «Добавить» не отклонено: {text!r}")
+        _, text, _ = await send(admin.callback_update(first_id, first_text, "form_add:confirm"))
+        if "устарела" not in text:
+            problems.append(f"кнопка без номера формы не отклонена: {text!r}")
+        with sqlite3.connect(database) as db:
+            count = db.execute("SELECT COUNT(*) FROM doramas").fetchone()[0]
+        if count != 1:
+            problems.append(f"в каталоге {count} дорам вместо одной")
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await api.close()
+    return problems
+
+def main():
+    logging.getLogger("dorama").setLevel(logging.ERROR)
+    logging.getLogger("telegram").setLevel(logging.ERROR)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="dorama_form_")
+    try:
+        problems = asyncio.run(run_check(workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(f"🚨 {problem}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
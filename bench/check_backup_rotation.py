@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Проверка ротации резервных копий: снимки doramas.db и doramas_users.db лежат в одном
+# каталоге, и ротация одной базы не должна трогать снимки другой (имя одной — префикс другой).
+# Делает настоящие копии двух маленьких баз поверх --days дней старых снимков и завершается
+# с кодом 1, если у какой-то базы осталось не BACKUP_KEEP снимков или пропал свежий.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/check_backup_rotation.py --days 10
+
+import argparse
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+
+def make_old_snapshots(stem: str, days: int) -> None:
+    now = datetime.now()
+    for day in range(1, days + 1):
+        stamp = (now - timedelta(days=day)).strftime("%Y%m%d_%H%M%S")
+        with gzip.open(os.path.join(bot.BACKUP_DIR, f"{stem}_{stamp}.db.gz"), "wb") as file:
+            file.write(b"old")
+
+async def run_check(workdir: str, days: int) -> list[str]:
+    bot.BACKUP_DIR = os.path.join(workdir, "backups")
+    bot.DB_PATH = os.path.join(workdir, "doramas.db")
+    bot.DB_PATH_2 = os.path.join(workdir, "doramas_users.db")
+    os.makedirs(bot.BACKUP_DIR)
+    for path in (bot.DB_PATH, bot.DB_PATH_2):
+        with sqlite3.connect(path) as db:
+            db.execute("CREATE TABLE t (x)")
+        make_old_snapshots(os.path.splitext(os.path.basename(path))[0], days)
+
+    problems = []
+    for path, backup_path, _, _, error in await bot.backup_all():
+        stem = os.path.splitext(os.path.basename(path))[0]
+        kept = bot.backup_files(stem)
+        if error:
+            problems.append(f"{stem}: ошибка копирования: {error}")
+        elif backup_path not in kept:
+            problems.append(f"{stem}: свежий снимок удалён ротацией")
+        if len(kept) != min(bot.BACKUP_KEEP, days + 1):
+            problems.append(f"{stem}: осталось {len(kept)} снимков вместо {min(bot.BACKUP_KEEP, days + 1)}")
+        print(f"{stem}: {len(kept)} снимков, новейший {os.path.basename(kept[0]) if kept else '—'}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка ротации резервных копий двух баз")
+    parser.add_argument("--days", type=int, default=10, help="Сколько дней старых снимков создать для каждой базы")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dorama_backups_")
+    try:
+        problems = asyncio.run(run_check(workdir, args.days))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(f"🚨 {problem}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
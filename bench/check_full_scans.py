@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Проверка планов запросов каталога: ни один не должен перебирать всю таблицу doramas.
+# Строит базу из --size синтетических дорам, прогоняет запросы каталога с построением
+# EXPLAIN QUERY PLAN для каждого и завершается с кодом 1, если нашёлся «SCAN doramas» —
+# в том числе обход индекса без условия («SCAN d USING COVERING INDEX idx_title_ru»).
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/check_full_scans.py --size 100000
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from bench_title_index import make_titles  # noqa: E402
+from bench_people_index import make_rows as make_people  # noqa: E402
+
+def fill_database(path, size):
+    rnd = random.Random(1)
+    rows = (
+        (title_ru, title_en, country, year, director, actress, actor, rnd.randint(1, 10), "Комментарий", "Сюжет", None)
+        for (_, title_ru, title_en, country, year), (director, actress, actor, _) in zip(make_titles(size), make_people(size))
+    )
+    with sqlite3.connect(path) as db:
+        db.executemany(
+            """
+            INSERT INTO doramas (title_ru, title_en, country, year, director, lead_actress, lead_actor, personal_rating, comment, plot, poster_url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        db.executemany(
+            "INSERT INTO search_keys (dorama_id, field, key) VALUES (?, ?, ?)",
+            [
+                key_row
+                for row in db.execute("SELECT id, title_ru, title_en, director, lead_actress, lead_actor FROM doramas").fetchall()
+                for key_row in bot.search_key_rows(*row)
+            ],
+        )
+
+def catalog_queries(rnd, sample):
+    """Запросы, которые строят экраны каталога: по одному фильтру и в сочетаниях."""
+    _, title_ru, title_en, country, year, director, actress, actor = sample
+    people = {"director": director, "lead_actress": actress, "lead_actor": actor}
+    yield bot.DoramaQuery(country=country)
+    yield bot.DoramaQuery(year_from=year, year_to=year)
+    for year_from, year_to in bot.FILTER_YEAR_RANGES:
+        yield bot.DoramaQuery(year_from=year_from, year_to=year_to)
+    yield bot.DoramaQuery(rating=rnd.randint(1, 10))
+    yield bot.DoramaQuery(min_rating=rnd.choice(bot.FILTER_MIN_RATINGS))
+    for field, name in people.items():
+        yield bot.DoramaQuery(people={field: name})
+    yield bot.DoramaQuery(title=title_ru.split()[0])
+    yield bot.DoramaQuery(letter=title_ru[0], language="ru")
+    yield bot.DoramaQuery(letter=title_en[0], language="en")
+    yield bot.DoramaQuery(
+        country=country, year_from=year - 3, year_to=year + 3, min_rating=7, people={"director": director}
+    )
+
+async def run_checks(size, queries):
+    rnd = random.Random(7)
+    started = time.perf_counter()
+    await bot.init_db(background=False)
+    fill_database(bot.DB_PATH, size)
+    await bot.build_title_index()
+    await bot.build_people_index()
+    await bot.build_catalog_stats()
+    print(f"База из {size} дорам готова за {time.perf_counter() - started:.1f} с")
+
+    # Загрузка индексов читает таблицу целиком намеренно — проверяем только запросы каталога
+    bot.SQL_FORBID_FULL_SCANS = True
+    with sqlite3.connect(bot.DB_PATH) as db:
+        samples = db.execute(
+            "SELECT id, title_ru, title_en, country, year, director, lead_actress, lead_actor FROM doramas "
+            "WHERE id IN (SELECT abs(random()) % ? + 1 FROM doramas LIMIT ?)",
+            (size, queries),
+        ).fetchall()
+    for sample in samples:
+        for dorama_query in catalog_queries(rnd, sample):
+            await bot.run_dorama_query(dorama_query, page=rnd.randint(0, 3))
+        for field, name in zip(bot.PEOPLE_FIELDS, (sample[7], sample[6], sample[5])):
+            prefix = name[:rnd.randint(2, len(name))]
+            await bot.fetch_people(field, prefix, 0)
+            await bot.count_people(field, prefix)
+        await bot.build_inline_results(sample[1][:rnd.randint(3, 8)])
+    await bot.get_total_doramas_count()
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as directory:
+        bot.DB_PATH = os.path.join(directory, "doramas.db")
+        await run_checks(args.size, args.queries)
+
+    print(f"Проверено запросов: {len(bot.sql_tracer.plans)}")
+    for sql, plan in bot.sql_tracer.full_scans:
+        print(f"\nПОЛНЫЙ ПРОСМОТР: {sql}\n  план: {plan}")
+    return 1 if bot.sql_tracer.full_scans else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов запросов каталога")
+    parser.add_argument("--size", type=int, default=100_000, help="Количество дорам в тестовой базе")
+    parser.add_argument("--queries", type=int, default=50, help="Сколько дорам брать за образец для запросов")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Проверка меток verb в метриках обработчиков: известные команды идут под своим именем
+# в нижнем регистре, а любой другой текст с «/» — под одной меткой unknown_command, чтобы
+# пользователи не могли заводить новые гистограммы в /metrics. Бот работает с пустым каталогом
+# во временном каталоге и поддельным Bot API (fake_bot_api.py); код 1 — есть лишние метки.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/check_metric_labels.py
+
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+from load_bot import LoadStats, SimulatedUser, start_application  # noqa: E402
+
+UNKNOWN_COMMANDS = ("/garbage_cmd_123", "/zz_other", "/ZZ_OTHER@dorama_bot something")
+
+async def run_check(workdir: str) -> list[str]:
+    api = FakeBotApi()
+    application = await start_application(api, os.path.join(workdir, "doramas.db"), workdir)
+    user = SimulatedUser(0, application, api, None, LoadStats(), 1)
+    try:
+        for update_id, text in enumerate(("/start", *UNKNOWN_COMMANDS, "/Start"), start=1):
+            await application.process_update(Update.de_json({"update_id": update_id, **user.text_update(text)}, application.bot))
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await api.close()
+
+    verbs = {verb for _, verb in bot.metrics.handler_latency}
+    print(f"метки verb: {sorted(verbs)}")
+    problems = [f"команда {verb} стала отдельной меткой" for verb in sorted(verbs) if verb not in ("/start", "unknown_command")]
+    if "unknown_command" not in verbs:
+        problems.append("незнакомые команды не попали под метку unknown_command")
+    if "/start" not in verbs:
+        problems.append("известная команда /start потеряла свою метку")
+    return problems
+
+def main():
+    logging.getLogger("dorama").setLevel(logging.ERROR)
+    logging.getLogger("telegram").setLevel(logging.ERROR)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="dorama_metrics_")
+    try:
+        problems = asyncio.run(run_check(workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(f"🚨 {problem}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Проверка страны человека в индексе имён (PeopleIndex) после правок: режиссёр снял две
+# дорамы, в Китае и в Японии. Страны дорам меняют так же, как /edit (refresh_people_index),
+# потом одну дораму удаляют — после каждого шага страна режиссёра должна считаться по его
+# оставшимся дорамам (самая частая). Код 1 — страна устарела.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/check_people_countries.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+
+DIRECTOR = "Ли Мин"
+
+def dorama(dorama_id: int, country: str) -> dict:
+    return {
+        "title_ru": f"Дорама {dorama_id}", "title_en": f"Drama {dorama_id}", "country": country, "year": 2020,
+        "director": DIRECTOR, "lead_actress": f"Актриса {dorama_id}", "lead_actor": f"Актёр {dorama_id}",
+    }
+
+def edit_country(doramas: dict, dorama_id: int, country: str) -> None:
+    before = doramas[dorama_id]
+    doramas[dorama_id] = {**before, "country": country}
+    bot.refresh_people_index(bot.DoramaChange(dorama_id, before, doramas[dorama_id]))
+
+def director_country() -> str | None:
+    found = [country for name, country, _ in bot.people_index.search("director", DIRECTOR) if name == DIRECTOR]
+    return found[0] if found else None
+
+def main():
+    doramas = {1: dorama(1, "Китай"), 2: dorama(2, "Япония")}
+    bot.people_index.load([(row["director"], row["lead_actress"], row["lead_actor"], row["country"]) for row in doramas.values()])
+
+    def delete(dorama_id: int) -> None:
+        row = doramas.pop(dorama_id)
+        bot.remove_people_from_index(row["director"], row["lead_actress"], row["lead_actor"], row["country"])
+
+    steps = [
+        ("две дорамы: Китай и Япония", lambda: None, "Китай"),  # При равенстве — страна дорамы, добавленной раньше
+        ("первая дорама теперь из Кореи", lambda: edit_country(doramas, 1, "Южная Корея"), "Япония"),
+        ("обе дорамы из Кореи", lambda: edit_country(doramas, 2, "Южная Корея"), "Южная Корея"),
+        ("вторая дорама теперь с Тайваня", lambda: edit_country(doramas, 2, "Тайвань"), "Южная Корея"),
+        ("корейскую дораму удалили", lambda: delete(1), "Тайвань"),
+    ]
+    problems = []
+    for step, action, expected in steps:
+        action()
+        country = director_country()
+        print(f"{step}: {country}")
+        if country != expected:
+            problems.append(f"{step}: страна {country!r} вместо {expected!r}")
+    for problem in problems:
+        print(f"🚨 {problem}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
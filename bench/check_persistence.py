@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Проверка SQLitePersistence вместе с хранилищем сессий:
+#   1. пользователь посреди диалога добавления вытеснен по лимиту сессий — запись user_data
+#      в doramas_users.db остаётся, и следующий шаг диалога видит введённое раньше название;
+#   2. сессия истекла по простою — удаляются и user_data, и состояние диалога;
+#   3. после перезапуска восстановленный диалог, которому осталась секунда, завершается
+#      по таймауту, хотя пользователь больше ничего не присылал.
+# Бот работает с пустым каталогом во временном каталоге и поддельным Bot API
+# (fake_bot_api.py); завершается с кодом 1, если что-то пошло не так.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/check_persistence.py
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+from load_bot import LoadStats, SimulatedUser, start_application  # noqa: E402
+
+class Run:
+    """Запущенный Application и пара пользователей: админ в диалоге и случайный прохожий."""
+
+    def __init__(self, api: FakeBotApi, application):
+        self.api = api
+        self.application = application
+        self.admin = SimulatedUser(0, application, api, None, LoadStats(), 1)
+        self.admin.user["id"] = self.admin.chat["id"] = bot.ADMINS[0]
+        self.other = SimulatedUser(1, application, api, None, LoadStats(), 1)
+        self.update_id = 0
+
+    async def send(self, update: dict) -> str:
+        self.update_id += 1
+        await self.application.process_update(Update.de_json({"update_id": self.update_id, **update}, self.application.bot))
+        return self.api.chat(bot.ADMINS[0]).last()[1]
+
+    async def persist(self) -> None:
+        await self.application.update_persistence()
+        await self.application.persistence.flush()
+
+    async def stop(self) -> None:
+        await self.application.stop()
+        await self.application.shutdown()
+        await self.api.close()
+
+def stored(path: str) -> tuple[dict | None, list]:
+    with sqlite3.connect(path) as db:
+        row = db.execute("SELECT data FROM persisted_user_data WHERE user_id = ?", (bot.ADMINS[0],)).fetchone()
+        conversations = db.execute("SELECT name, key, state, updated_at FROM persisted_conversations").fetchall()
+    return (json.loads(row[0]) if row else None), conversations
+
+async def run_check(workdir: str) -> list[str]:
+    problems = []
+    database = os.path.join(workdir, "doramas.db")
+    users_db = os.path.join(workdir, "doramas_users.db")
+    admin_key = json.dumps([bot.ADMINS[0], bot.ADMINS[0]])
+
+    # 1. Вытеснение по лимиту: только из памяти
+    api = FakeBotApi()
+    run = Run(api, await start_application(api, database, workdir))
+    try:
+        await run.send(run.admin.callback_update(1, "меню", "add_dorama"))
+        await run.send(run.admin.text_update("Проверка вытеснения"))
+        await run.persist()
+        bot.session_store.max_users = 1
+        await run.send(run.other.text_update("/start"))  # Админ вытеснен прохожим
+        await run.persist()
+        data, conversations = stored(users_db)
+        print(f"после вытеснения: user_data {data}, диалоги {[(name, key, state) for name, key, state, _ in conversations]}")
+        if bot.ADMINS[0] in run.application.user_data:
+            problems.append("вытесненный пользователь остался в памяти")
+        if not data or data.get("title_ru") != "Проверка вытеснения":
+            problems.append(f"вытеснение удалило user_data из БД: {data}")
+        text = await run.send(run.admin.text_update("Eviction check"))
+        title = run.application.user_data.get(bot.ADMINS[0], {}).get("title_ru")
+        print(f"следующий шаг диалога: {text.splitlines()[0] if text else ''!r}, title_ru={title!r}")
+        if title != "Проверка вытеснения":
+            problems.append(f"после возвращения title_ru={title!r}: user_data не подгрузилась")
+
+        # 2. Истечение по простою: user_data и диалог удаляются
+        bot.session_store.max_users = bot.SESSION_MAX_USERS
+        bot.session_store.idle_ttl = 0
+        await bot.sweep_sessions(SimpleNamespace(application=run.application))
+        await run.persist()
+        data, conversations = stored(users_db)
+        print(f"после истечения: user_data {data}, диалоги {len(conversations)}")
+        if data is not None:
+            problems.append("истёкшая сессия осталась в persisted_user_data")
+        if any(key == admin_key for _, key, _, _ in conversations):
+            problems.append("у истёкшей сессии остался диалог в persisted_conversations")
+        bot.session_store.idle_ttl = bot.SESSION_IDLE_TTL
+
+        # Для третьей части — снова диалог, записанный «почти таймаут назад»
+        await run.send(run.admin.callback_update(1, "меню", "add_dorama"))
+        await run.persist()
+    finally:
+        await run.stop()
+    with sqlite3.connect(users_db) as db:
+        db.execute(
+            "UPDATE persisted_conversations SET updated_at = ? WHERE name = 'add_dorama' AND key = ?",
+            (time.time() - bot.CONVERSATION_TIMEOUT + 1, admin_key),
+        )
+
+    # 3. Перезапуск: восстановленный диалог получает таймаут. Обработчики — объекты модуля и
+    # переживают Application; задачи таймаута прошлого запуска забываем, как в новом процессе
+    for handler in bot.conversation_handlers(run.application):
+        handler.timeout_jobs.clear()
+    api = FakeBotApi()
+    run = Run(api, await start_application(api, database, workdir))
+    try:
+        handler = next(handler for handler in bot.conversation_handlers(run.application) if handler.name == "add_dorama")
+        restored = bool(handler.check_update(Update.de_json({"update_id": 1, **run.admin.text_update("x")}, run.application.bot)))
+        await asyncio.sleep(2.5)
+        await run.persist()
+        still_active = bool(handler.check_update(Update.de_json({"update_id": 2, **run.admin.text_update("x")}, run.application.bot)))
+        _, conversations = stored(users_db)
+        print(f"после перезапуска: диалог восстановлен {restored}, активен через 2.5 с {still_active}, в БД {len(conversations)}")
+        if not restored:
+            problems.append("диалог, которому осталась секунда, не восстановлен")
+        if still_active or any(key == admin_key for _, key, _, _ in conversations):
+            problems.append("восстановленный диалог не завершился по таймауту")
+    finally:
+        await run.stop()
+    return problems
+
+def main():
+    logging.getLogger("dorama").setLevel(logging.ERROR)
+    logging.getLogger("telegram").setLevel(logging.ERROR)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="dorama_persistence_")
+    try:
+        problems = asyncio.run(run_check(workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(f"🚨 {problem}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Поддельный Bot API для нагрузочных тестов: принимает sendMessage, editMessageText,
+# answerCallbackQuery, sendPhoto, getFile и прочие методы, отвечает правдоподобными объектами
+# с настраиваемой задержкой и запоминает последние сообщения каждого чата.
+# Используется из bench/load_bot.py, но можно запустить и отдельно, направив на него бота:
+#     python bench/fake_bot_api.py --port 8081 --latency-ms 40
+#     BOT_API_URL=http://127.0.0.1:8081/bot python NeZabuDrama.py
+
+import argparse
+import asyncio
+import email
+import json
+import random
+import sys
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "НеЗабудрама", "username": "fake_dorama_bot"}
+PHOTO = [{"file_id": "fake-photo", "file_unique_id": "fake-photo", "width": 640, "height": 960}]
+
+def parse_multipart(content_type: str, body: bytes) -> dict:
+    """Поля формы multipart/form-data; вместо содержимого файлов — их размер."""
+    message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    params = {}
+    for part in message.get_payload():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        params[name] = f"<{len(payload)} байт>" if part.get_filename() else payload.decode("utf-8")
+    return params
+
+class ChatState:
+    """Сообщения бота в одном чате: id -> (текст, клавиатура)."""
+
+    __slots__ = ("messages", "last_message_id", "next_message_id")
+
+    def __init__(self):
+        self.messages: dict[int, tuple[str, dict | None]] = {}
+        self.last_message_id: int | None = None
+        self.next_message_id = 1
+
+    def add(self, text: str, reply_markup: dict | None) -> int:
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        self.messages[message_id] = (text, reply_markup)
+        self.last_message_id = message_id
+        return message_id
+
+    def last(self) -> tuple[int | None, str, dict | None]:
+        text, reply_markup = self.messages.get(self.last_message_id, ("", None))
+        return self.last_message_id, text, reply_markup
+
+class FakeBotApi:
+    """HTTP-сервер с методами Bot API. Задержка ответа — latency ± jitter секунд."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0, seed: int = 1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.chats: dict[int, ChatState] = {}
+        self.calls: Counter = Counter()
+        self.errors = 0
+        self.updates: asyncio.Queue = asyncio.Queue()  # Для getUpdates, если бот работает через run_polling
+        self.files: dict[str, bytes] = {}  # file_id -> содержимое, для getFile и скачивания
+        self._server: asyncio.AbstractServer | None = None
+        self._next_update_id = 1
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def chat(self, chat_id: int) -> ChatState:
+        if chat_id not in self.chats:
+            self.chats[chat_id] = ChatState()
+        return self.chats[chat_id]
+
+    def add_file(self, data: bytes, file_name: str) -> dict:
+        """Кладёт файл «на сервер» и возвращает объект Document для сообщения пользователя."""
+        file_id = f"fake-file-{len(self.files) + 1}"
+        self.files[file_id] = data
+        return {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name, "file_size": len(data)}
+
+    def push_update(self, update: dict) -> None:
+        update["update_id"] = self._next_update_id
+        self._next_update_id += 1
+        self.updates.put_nowait(update)
+
+    # --- HTTP ---
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # httpx держит соединения открытыми, поэтому обслуживаем запросы по кругу
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                path = request_line.decode("latin-1").split(" ")[1]
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if "/file/" in path:  # Скачивание файла: /file/bot<токен>/<file_path>
+                    data = self.files.get(path.rsplit("/", 1)[-1])
+                    status, content_type = (200, "application/octet-stream") if data is not None else (404, "text/plain")
+                    data = data if data is not None else b"Not Found"
+                else:
+                    status, payload = await self._dispatch(path, headers.get("content-type", ""), body)
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, path: str, content_type: str, body: bytes) -> tuple[int, dict]:
+        method = path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        params = parse_multipart(content_type, body) if "multipart" in content_type else dict(parse_qsl(body.decode("utf-8")))
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(float(params.get("timeout", 0)))}
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return 200, {"ok": True, "result": True}
+        try:
+            return 200, {"ok": True, "result": handler(params)}
+        except (KeyError, ValueError) as e:
+            self.errors += 1
+            return 400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+
+    async def _get_updates(self, timeout: float) -> list[dict]:
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01))
+        except asyncio.TimeoutError:
+            return []
+        updates = [first]
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    # --- Методы Bot API ---
+    def _message(self, chat_id: int, message_id: int, **fields) -> dict:
+        message = {
+            "message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        message.update({key: value for key, value in fields.items() if value is not None})
+        return message
+
+    def _send(self, params: dict, text_field: str, **fields) -> dict:
+        chat_id = int(params["chat_id"])
+        text = params.get(text_field, "")
+        reply_markup = json.loads(params["reply_markup"]) if "reply_markup" in params else None
+        message_id = self.chat(chat_id).add(text, reply_markup)
+        return self._message(chat_id, message_id, **{text_field: text}, reply_markup=reply_markup, **fields)
+
+    def _edit(self, params: dict, text: str | None) -> dict | bool:
+        if "inline_message_id" in params:  # Сообщения из инлайн-режима не хранятся
+            return True
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        chat = self.chat(chat_id)
+        old_text, old_markup = chat.messages.get(message_id, ("", None))
+        reply_markup = json.loads(params["reply_markup"]) if "reply_markup" in params else None
+        chat.messages[message_id] = (old_text if text is None else text, reply_markup or old_markup)
+        chat.last_message_id = message_id
+        return self._message(chat_id, message_id, text=chat.messages[message_id][0], reply_markup=reply_markup)
+
+    def api_getMe(self, params):
+        return {**BOT_USER, "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": True}
+
+    def api_sendMessage(self, params):
+        return self._send(params, "text")
+
+    def api_sendPhoto(self, params):
+        return self._send(params, "caption", photo=PHOTO)
+
+    def api_sendDocument(self, params):
+        document = {"file_id": "fake-document", "file_unique_id": "fake-document", "file_size": 0}
+        return self._send(params, "caption", document=document)
+
+    def api_getFile(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]), "file_path": f"documents/{file_id}"}
+
+    def api_editMessageText(self, params):
+        return self._edit(params, params["text"])
+
+    def api_editMessageCaption(self, params):
+        return self._edit(params, params.get("caption", ""))
+
+    def api_editMessageReplyMarkup(self, params):
+        return self._edit(params, None)
+
+    def api_deleteMessage(self, params):
+        self.chat(int(params["chat_id"])).messages.pop(int(params["message_id"]), None)
+        return True
+
+async def serve(args):
+    api = FakeBotApi(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000)
+    await api.start()
+    print(f"Поддельный Bot API: BOT_API_URL={api.base_url}", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.close()
+        print(f"Вызовы: {dict(api.calls)}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельный сервер Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответа на каждый вызов, мс")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Разброс задержки, мс")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Генератор синтетического каталога doramas.db для бенчмарков.
+# Распределения похожи на настоящий каталог: больше всего корейских дорам, новые годы
+# встречаются чаще старых, оценки собраны вокруг 7–8, у популярных актёров и режиссёров
+# много дорам. Ключи поиска и готовые карточки пишутся сразу, как при добавлении через бота.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/generate_catalog.py --rows 100000 --output bench/data/doramas_100k.db
+#     python bench/generate_catalog.py --all --output-dir bench/data
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from bench_title_index import WORDS_RU, WORDS_EN, SYLLABLES  # noqa: E402
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+CHUNK_SIZE = 10_000  # Столько дорам пишется за одну транзакцию
+COUNTRY_WEIGHTS = {"Южная Корея": 0.6, "Китай": 0.3, "Япония": 0.1}
+YEARS = list(range(1995, 2026))
+YEAR_WEIGHTS = [(year - 1990) ** 1.5 for year in YEARS]  # Новых дорам больше
+RATINGS = list(range(1, 11))
+RATING_WEIGHTS = [1, 1, 2, 3, 6, 10, 16, 18, 12, 6]
+# Слоги имён в том виде, в каком их пишут в каталоге (кириллицей)
+NAME_SYLLABLES = {
+    "Южная Корея": (["Ли", "Ким", "Пак", "Чхве", "Чон", "Кан", "Юн", "Хан", "Сон", "Со"],
+                    ["Мин", "Хо", "Джи", "Су", "Хён", "Ын", "Чжун", "Ён", "Ха", "У", "Бин", "Сын", "Ки"]),
+    "Китай": (["Ван", "Чжан", "Ли", "Лю", "Чэнь", "Ян", "Чжао", "Хуан", "Чжоу", "Сяо"],
+              ["Ибо", "Кай", "Мэй", "Цзин", "Сюэ", "Лин", "Юй", "Тин", "Хао", "Лэй", "Сы", "Вэй"]),
+    "Япония": (["Сато", "Судзуки", "Такахаси", "Танака", "Ямада", "Ито", "Като", "Мацумото"],
+               ["Кэнто", "Харуна", "Юки", "Сора", "Рэн", "Аой", "Хина", "Такуя", "Мио", "Кадзуя"]),
+}
+
+def make_name(rnd, country):
+    surnames, given = NAME_SYLLABLES[country]
+    if country == "Япония":
+        return f"{rnd.choice(given)} {rnd.choice(surnames)}"  # Японские имена — в европейском порядке
+    if country == "Южная Корея":
+        return f"{rnd.choice(surnames)} {rnd.choice(given)} {rnd.choice(given)}"  # Как «Ли Мин Хо»
+    return f"{rnd.choice(surnames)} {rnd.choice(given)}"
+
+class PeoplePool:
+    """Люди по странам: популярность по закону Ципфа, поэтому имена часто повторяются."""
+
+    def __init__(self, rnd, rows):
+        self.rnd = rnd
+        self.people = {}
+        for country in COUNTRY_WEIGHTS:
+            size = max(10, rows // 4)
+            names = [make_name(rnd, country) for _ in range(size)]
+            self.people[country] = (names, list(itertools.accumulate(1 / (rank + 5) for rank in range(size))))
+
+    def pick(self, country):
+        names, cumulative = self.people[country]
+        return self.rnd.choices(names, cum_weights=cumulative)[0]
+
+def make_sentence(rnd, words):
+    text = " ".join(rnd.choice(WORDS_RU) for _ in range(words)).capitalize()
+    return text + rnd.choice([".", "!", "...", "?"])
+
+def make_title(rnd):
+    picks = [rnd.randrange(len(WORDS_RU)) for _ in range(rnd.randint(1, 4))]
+    title_ru = " ".join(WORDS_RU[i] for i in picks).capitalize()
+    title_en = " ".join(WORDS_EN[i] for i in picks).title()
+    roll = rnd.random()
+    if roll < 0.2:
+        # Романизированное имя собственное в названии
+        name = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3))).capitalize()
+        title_en = f"{title_en} {name}"
+        title_ru = f"{title_ru} {bot.transliterate(name).capitalize()}" if rnd.random() < 0.5 else title_ru
+    elif roll < 0.25:
+        title_ru = title_en  # Название не переводили
+    elif roll < 0.3:
+        title_en = f"The {title_en}"
+    if rnd.random() < 0.08:
+        season = rnd.randint(2, 4)
+        title_ru, title_en = f"{title_ru} {season}", f"{title_en} {season}"
+    return title_ru, title_en
+
+def make_dorama(rnd, people, dorama_id):
+    country = rnd.choices(list(COUNTRY_WEIGHTS), weights=list(COUNTRY_WEIGHTS.values()))[0]
+    title_ru, title_en = make_title(rnd)
+    return {
+        "id": dorama_id,
+        "title_ru": title_ru,
+        "title_en": title_en,
+        "country": country,
+        "year": rnd.choices(YEARS, weights=YEAR_WEIGHTS)[0],
+        "director": people.pick(country),
+        "lead_actress": people.pick(country),
+        "lead_actor": people.pick(country),
+        "personal_rating": rnd.choices(RATINGS, weights=RATING_WEIGHTS)[0],
+        "comment": make_sentence(rnd, rnd.randint(4, 10)),
+        "plot": " ".join(make_sentence(rnd, rnd.randint(6, 14)) for _ in range(rnd.randint(1, 3))),
+        "poster_url": f"https://downloader.disk.yandex.ru/preview/{rnd.getrandbits(64):016x}",
+    }
+
+class CardRow(dict):
+    """Строка как у aiosqlite.Row: доступ и по имени колонки, и по номеру (row[0] — id)."""
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, "id" if key == 0 else key)
+
+async def generate(path, rows, seed=42):
+    if os.path.exists(path):
+        os.remove(path)
+    bot.DB_PATH = path
+    await bot.init_db(background=False)  # Та же схема и индексы, что у бота
+
+    rnd = random.Random(seed)
+    people = PeoplePool(rnd, rows)
+    columns = bot.CARD_COLUMNS.split(", ")
+    with sqlite3.connect(path) as db:
+        db.execute("PRAGMA synchronous = OFF")  # Файл всё равно пересоздаётся с нуля
+        for start in range(1, rows + 1, CHUNK_SIZE):
+            doramas = [CardRow(make_dorama(rnd, people, dorama_id)) for dorama_id in range(start, min(start + CHUNK_SIZE, rows + 1))]
+            db.executemany(
+                f"INSERT INTO doramas ({bot.CARD_COLUMNS}, rendered_card) VALUES ({', '.join('?' * (len(columns) + 1))})",
+                ([dorama[column] for column in columns] + [bot.render_dorama_card(dorama)] for dorama in doramas),
+            )
+            db.executemany(
+                "INSERT INTO search_keys (dorama_id, field, key) VALUES (?, ?, ?)",
+                (
+                    key_row for dorama in doramas for key_row in bot.search_key_rows(
+                        dorama["id"], dorama["title_ru"], dorama["title_en"],
+                        dorama["director"], dorama["lead_actress"], dorama["lead_actor"],
+                    )
+                ),
+            )
+            db.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетического каталога дорам")
+    parser.add_argument("--rows", type=int, default=10_000, help="Количество дорам")
+    parser.add_argument("--output", default="bench/data/doramas.db", help="Файл базы")
+    parser.add_argument("--all", action="store_true", help="Сгенерировать базы на 1k, 10k, 100k и 1M дорам")
+    parser.add_argument("--output-dir", default="bench/data", help="Куда класть базы при --all")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    targets = (
+        [(os.path.join(args.output_dir, f"doramas_{name}.db"), rows) for name, rows in SIZES.items()]
+        if args.all else [(args.output, args.rows)]
+    )
+    for path, rows in targets:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        started = time.perf_counter()
+        asyncio.run(generate(path, rows, args.seed))
+        print(f"{path}: {rows} дорам, {os.path.getsize(path) / 2 ** 20:.1f} МБ за {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
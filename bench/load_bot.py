@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Сквозная нагрузка на бота без Telegram: Application из setup_handlers ходит в поддельный
+# Bot API (fake_bot_api.py), а N пользователей одновременно жмут кнопки из последнего ответа
+# бота, вводят запросы, листают страницы и пользуются инлайн-поиском.
+# Отчёт — пропускная способность, перцентили задержки «обновление -> ответ» и число
+# вызовов Bot API на одно обновление.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/load_bot.py bench/data/doramas_10k.db --users 50 --duration 30 --latency-ms 40
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from bench_title_index import percentile  # noqa: E402
+from fake_bot_api import BOT_USER, FakeBotApi  # noqa: E402
+
+# Кнопки, которые меняют каталог или просто закрывают диалог, пользователи не нажимают
+SKIPPED_BUTTONS = ("add_dorama", "delete_dorama", "confirm_delete", "cancel")
+COMMANDS = ("/start", "/menu", "/search_by_title")
+COMMAND_SHARE = 0.05  # Доля действий, начинающихся с команды
+INLINE_SHARE = 0.1  # Доля инлайн-запросов
+
+class Catalog:
+    """Образцы из базы для ответов на вопросы бота."""
+
+    def __init__(self, path: str, size: int = 2000):
+        with sqlite3.connect(path) as db:
+            rows = db.execute(
+                "SELECT id, title_ru, lead_actor, lead_actress, director, year FROM doramas ORDER BY random() LIMIT ?",
+                (size,),
+            ).fetchall()
+        self.ids = [str(row[0]) for row in rows]
+        self.title_words = [word for row in rows for word in row[1].split() if len(word) > 2]
+        self.people = [name for row in rows for name in row[2:5] if name]
+        self.years = [str(row[5]) for row in rows]
+
+    def answer(self, prompt: str, rnd: random.Random) -> str:
+        """Ответ пользователя на просьбу бота что-нибудь ввести."""
+        prompt = prompt.lower()
+        if " id " in prompt:
+            return rnd.choice(self.ids)
+        if "год" in prompt:
+            return rnd.choice(self.years)
+        if any(word in prompt for word in ("актер", "актёр", "актрис", "режисс")):
+            return rnd.choice(rnd.choice(self.people).split())
+        return rnd.choice(self.title_words)
+
+class LoadStats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.failures = Counter()
+
+    def observe(self, kind: str, seconds: float) -> None:
+        self.latencies.setdefault(kind, []).append(seconds * 1000)
+
+def summarize(timings):
+    return {
+        "updates": len(timings),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+class SimulatedUser:
+    def __init__(self, index: int, application, api: FakeBotApi, catalog: Catalog, stats: LoadStats, seed: int):
+        self.user = {"id": 100_000 + index, "is_bot": False, "first_name": f"Нагрузка {index}", "username": f"load_{index}"}
+        self.chat = {"id": self.user["id"], "type": "private", "first_name": self.user["first_name"]}
+        self.application = application
+        self.api = api
+        self.catalog = catalog
+        self.stats = stats
+        self.random = random.Random(seed * 100_003 + index)
+        self.sequence = 0
+
+    def _next_id(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+    def text_update(self, text: str) -> dict:
+        message = {"message_id": 1_000_000 + self._next_id(), "date": int(time.time()), "chat": self.chat, "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def callback_update(self, message_id: int, text: str, data: str) -> dict:
+        message = {"message_id": message_id, "date": int(time.time()), "chat": self.chat, "from": BOT_USER, "text": text}
+        return {"callback_query": {
+            "id": f"{self.user['id']}-{self._next_id()}", "from": self.user, "chat_instance": str(self.user["id"]),
+            "message": message, "data": data,
+        }}
+
+    def inline_update(self, query: str) -> dict:
+        return {"inline_query": {"id": f"{self.user['id']}-{self._next_id()}", "from": self.user, "query": query, "offset": ""}}
+
+    def next_action(self) -> tuple[str, dict]:
+        """Следующее действие: по кнопкам последнего ответа бота, ввод текста, команда или инлайн-поиск."""
+        roll = self.random.random()
+        if roll < COMMAND_SHARE:
+            return "command", self.text_update(self.random.choice(COMMANDS))
+        if roll < COMMAND_SHARE + INLINE_SHARE:
+            return "inline", self.inline_update(self.random.choice(self.catalog.title_words))
+
+        message_id, text, reply_markup = self.api.chat(self.user["id"]).last()
+        if message_id is None:
+            return "command", self.text_update("/start")
+        buttons = [
+            button["callback_data"]
+            for row in (reply_markup or {}).get("inline_keyboard", [])
+            for button in row
+            if "callback_data" in button and button["callback_data"] not in SKIPPED_BUTTONS
+        ]
+        if "введите" in text.lower():
+            return "text", self.text_update(self.catalog.answer(text, self.random))
+        if buttons:
+            return "callback", self.callback_update(message_id, text, self.random.choice(buttons))
+        return "command", self.text_update("/menu")
+
+    async def run(self, deadline: float, think_time: float) -> None:
+        while time.monotonic() < deadline:
+            kind, data = self.next_action()
+            update = Update.de_json({"update_id": self._next_id(), **data}, self.application.bot)
+            started = time.perf_counter()
+            try:
+                await self.application.process_update(update)
+            except Exception as e:  # Ошибки обработчиков PTB ловит сам, сюда попадают только сбои диспетчера
+                self.stats.failures[type(e).__name__] += 1
+            self.stats.observe(kind, time.perf_counter() - started)
+            if think_time:
+                await asyncio.sleep(self.random.expovariate(1 / think_time))
+
+async def start_application(api: FakeBotApi, database: str, workdir: str):
+    """Готовит базы и индексы как main() и запускает Application против поддельного Bot API."""
+    bot.DB_PATH = database
+    bot.DB_PATH_2 = os.path.join(workdir, "doramas_users.db")  # Пустая база пользователей, чтобы не трогать настоящую
+    await bot.init_db(background=False)
+    await bot.init_user_db(background=False)
+    await bot.build_title_index()
+    await bot.build_people_index()
+    await bot.build_catalog_stats()
+
+    await api.start()
+    application = bot.build_application(api.base_url, persistence_path=bot.DB_PATH_2)
+    bot.setup_handlers(application)
+    await application.initialize()
+    bot.schedule_restored_conversation_timeouts(application)
+    await application.start()
+    return application
+
+async def run_load(args, workdir: str) -> dict:
+    # init_db применяет миграции к файлу базы, поэтому бот работает с копией
+    catalog_copy = os.path.join(workdir, "doramas.db")
+    shutil.copyfile(args.database, catalog_copy)
+    api = FakeBotApi(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, seed=args.seed)
+    application = await start_application(api, catalog_copy, workdir)
+    setup_calls = api.calls.copy()  # getMe и прочее из initialize() в отчёт не идут
+
+    catalog = Catalog(args.database)
+    stats = LoadStats()
+    users = [SimulatedUser(index, application, api, catalog, stats, args.seed) for index in range(args.users)]
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    try:
+        await asyncio.gather(*(user.run(deadline, args.think_ms / 1000) for user in users))
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await api.close()
+
+    all_latencies = [value for values in stats.latencies.values() for value in values]
+    calls = api.calls - setup_calls
+    api_calls = sum(calls.values())
+    return {
+        "database": os.path.basename(args.database),
+        "users": args.users,
+        "duration_s": round(elapsed, 2),
+        "bot_api_latency_ms": args.latency_ms,
+        "updates": len(all_latencies),
+        "updates_per_second": round(len(all_latencies) / elapsed, 1),
+        "latency": summarize(all_latencies) if all_latencies else {},
+        "latency_by_kind": {kind: summarize(values) for kind, values in sorted(stats.latencies.items())},
+        "bot_api_calls": api_calls,
+        "bot_api_calls_per_update": round(api_calls / max(1, len(all_latencies)), 2),
+        "bot_api_calls_by_method": dict(calls.most_common()),
+        "bot_api_errors": api.errors,
+        "handler_errors": sum(bot.metrics.handler_errors.values()),
+        "dispatch_failures": dict(stats.failures),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозная нагрузка на бота через поддельный Bot API")
+    parser.add_argument("database", help="Файл базы из generate_catalog.py (не изменяется: бот работает с копией)")
+    parser.add_argument("--users", type=int, default=20, help="Одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=20.0, help="Длительность, с")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Средняя пауза пользователя между действиями, мс")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Задержка ответа Bot API, мс")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Разброс задержки Bot API, мс")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Куда записать JSON (по умолчанию — stdout)")
+    args = parser.parse_args()
+
+    # Ошибки обработчиков видны в отчёте, в stderr оставляем только их текст
+    logging.getLogger("dorama").setLevel(logging.ERROR)
+    logging.getLogger("telegram").setLevel(logging.ERROR)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="dorama_load_")
+    try:
+        results = asyncio.run(run_load(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"Обновлений: {results['updates']} за {results['duration_s']} с ({results['updates_per_second']}/с), "
+        f"p50={results['latency'].get('p50_ms')} мс  p99={results['latency'].get('p99_ms')} мс, "
+        f"вызовов Bot API на обновление: {results['bot_api_calls_per_update']}",
+        file=sys.stderr,
+    )
+    report = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Повтор настоящего трафика из user_actions (doramas_users.db) как нагрузки: команды,
+# сообщения и нажатия превращаются в обновления Telegram и проходят через настоящие
+# обработчики в исходном темпе или быстрее. Бот работает с копией doramas.db и
+# поддельным Bot API (fake_bot_api.py); исходные базы не изменяются.
+# Запуск из корня репозитория (нужен config.py, как и для самого бота):
+#     python bench/replay_actions.py doramas_users.db doramas.db --since "2025-03-01" --speed 20
+#     python bench/replay_actions.py doramas_users.db doramas.db --limit 5000 --speed 0  # без пауз
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NeZabuDrama as bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from fake_bot_api import BOT_USER, FakeBotApi  # noqa: E402
+from load_bot import start_application, summarize  # noqa: E402
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+NUMBER_RE = re.compile(r"\d+")
+
+class RecordedAction:
+    __slots__ = ("user_id", "action_type", "action_data", "timestamp")
+
+    def __init__(self, user_id: int, action_type: str, action_data: str, timestamp: str):
+        self.user_id = user_id
+        self.action_type = action_type
+        self.action_data = action_data
+        self.timestamp = datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+
+    @property
+    def key(self) -> str:
+        """Вид действия без конкретных чисел: callback:list_doramas_year_N_N, command:/start, message."""
+        if self.action_type == "message":
+            return "message"
+        return f"{self.action_type}:{NUMBER_RE.sub('N', self.action_data.split()[0])}"
+
+def load_actions(path: str, since: str | None, until: str | None, user_id: int | None, limit: int | None) -> list[RecordedAction]:
+    conditions = ["action_type IN ('command', 'message', 'callback')", "action_data IS NOT NULL", "action_data != ''"]
+    params = []
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    sql = f"SELECT user_id, action_type, action_data, timestamp FROM user_actions WHERE {' AND '.join(conditions)} ORDER BY timestamp, id"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    # Исходную базу открываем только на чтение
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as db:
+        rows = db.execute(sql, params).fetchall()
+    actions = []
+    for user_id, action_type, action_data, timestamp in rows:
+        # Ссылки из добавления дорамы ушли бы в настоящий Яндекс.Диск
+        if action_type == "message" and action_data.startswith("http"):
+            continue
+        actions.append(RecordedAction(user_id, action_type, action_data, timestamp))
+    return actions
+
+def make_update(action: RecordedAction, api: FakeBotApi, sequence: int) -> dict:
+    user = {"id": action.user_id, "is_bot": False, "first_name": f"Пользователь {action.user_id}"}
+    chat = {"id": action.user_id, "type": "private", "first_name": user["first_name"]}
+    if action.action_type == "callback":
+        # Кнопка нажата под последним сообщением бота в этом чате
+        message_id, text, _ = api.chat(action.user_id).last()
+        message = {"message_id": message_id or 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": text or "…"}
+        return {"update_id": sequence, "callback_query": {
+            "id": f"replay-{sequence}", "from": user, "chat_instance": str(action.user_id),
+            "message": message, "data": action.action_data,
+        }}
+    message = {"message_id": 1_000_000 + sequence, "date": int(time.time()), "chat": chat, "from": user, "text": action.action_data}
+    if action.action_type == "command":
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(action.action_data.split()[0])}]
+    return {"update_id": sequence, "message": message}
+
+class Replay:
+    def __init__(self, application, api: FakeBotApi, actions: list[RecordedAction], speed: float):
+        self.application = application
+        self.api = api
+        self.actions = actions
+        self.speed = speed
+        self.latencies: dict[str, list[float]] = {}
+        self.lag: list[float] = []  # Насколько действие началось позже, чем по расписанию, мс
+        self.sequence = 0
+
+    async def replay_user(self, actions: list[RecordedAction], origin: float, started: float) -> None:
+        # Действия одного пользователя идут строго по очереди, как в жизни
+        for action in actions:
+            if self.speed:
+                due = started + (action.timestamp - origin) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.lag.append(max(0.0, -delay) * 1000)
+            self.sequence += 1
+            update = Update.de_json(make_update(action, self.api, self.sequence), self.application.bot)
+            begin = time.perf_counter()
+            await self.application.process_update(update)
+            self.latencies.setdefault(action.key, []).append((time.perf_counter() - begin) * 1000)
+
+    async def run(self) -> float:
+        by_user: dict[int, list[RecordedAction]] = {}
+        for action in self.actions:
+            by_user.setdefault(action.user_id, []).append(action)
+        origin = self.actions[0].timestamp
+        started = time.perf_counter()
+        await asyncio.gather(*(self.replay_user(actions, origin, started) for actions in by_user.values()))
+        return time.perf_counter() - started
+
+async def run_replay(args, workdir: str) -> dict:
+    actions = load_actions(args.users_db, args.since, args.until, args.user, args.limit)
+    if not actions:
+        raise SystemExit("В выбранном интервале нет действий")
+    catalog_copy = os.path.join(workdir, "doramas.db")
+    shutil.copyfile(args.catalog, catalog_copy)
+
+    api = FakeBotApi(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+    application = await start_application(api, catalog_copy, workdir)
+    setup_calls = api.calls.copy()
+    replay = Replay(application, api, actions, args.speed)
+    try:
+        elapsed = await replay.run()
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await api.close()
+
+    all_latencies = [value for values in replay.latencies.values() for value in values]
+    calls = api.calls - setup_calls
+    mix = Counter({key: len(values) for key, values in replay.latencies.items()})
+    return {
+        "actions": len(actions),
+        "users": len({action.user_id for action in actions}),
+        "recorded_from": datetime.fromtimestamp(actions[0].timestamp).strftime(TIMESTAMP_FORMAT),
+        "recorded_to": datetime.fromtimestamp(actions[-1].timestamp).strftime(TIMESTAMP_FORMAT),
+        "recorded_span_s": round(actions[-1].timestamp - actions[0].timestamp, 1),
+        "speed": args.speed,
+        "duration_s": round(elapsed, 2),
+        "updates_per_second": round(len(all_latencies) / elapsed, 1),
+        "latency": summarize(all_latencies),
+        "schedule_lag": summarize(replay.lag) if replay.lag else {},
+        "latency_by_action": {key: summarize(replay.latencies[key]) for key, _ in mix.most_common()},
+        "bot_api_calls_per_update": round(sum(calls.values()) / len(all_latencies), 2),
+        "bot_api_calls_by_method": dict(calls.most_common()),
+        "handler_errors": sum(bot.metrics.handler_errors.values()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Повтор действий из user_actions через настоящие обработчики")
+    parser.add_argument("users_db", help="doramas_users.db с таблицей user_actions (только чтение)")
+    parser.add_argument("catalog", help="doramas.db; бот работает с её копией")
+    parser.add_argument("--since", help="Начало интервала, например 2025-03-01 или 2025-03-01 12:00:00")
+    parser.add_argument("--until", help="Конец интервала (не включая)")
+    parser.add_argument("--user", type=int, help="Только действия одного пользователя")
+    parser.add_argument("--limit", type=int, help="Не больше стольких действий")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение относительно записи; 0 — без пауз")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Задержка ответа Bot API, мс")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Разброс задержки Bot API, мс")
+    parser.add_argument("--output", help="Куда записать JSON (по умолчанию — stdout)")
+    args = parser.parse_args()
+
+    logging.getLogger("dorama").setLevel(logging.ERROR)
+    logging.getLogger("telegram").setLevel(logging.ERROR)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="dorama_replay_")
+    try:
+        results = asyncio.run(run_replay(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"Действий: {results['actions']} от {results['users']} пользователей за {results['duration_s']} с, "
+        f"p50={results['latency']['p50_ms']} мс  p99={results['latency']['p99_ms']} мс",
+        file=sys.stderr,
+    )
+    report = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()